@@ -0,0 +1,258 @@
+"""
+Non-interactive command mode for scripts, bots and load tests.
+
+    python3 twitter.py batch <database_file> [--file commands.jsonl] [--group-size N]
+
+Reads one JSON command per line from the file (or stdin) and writes one JSON
+result per line to stdout, in the same order:
+
+    {"op": "post", "user": "12", "text": "hello #world", "id": 7}
+    -> {"seq": 1, "id": 7, "ok": true, "result": {"tid": 1043, "hashtags": ["world"]}}
+
+    {"op": "follow", "user": "12", "followee": "12"}
+    -> {"seq": 2, "ok": false, "error": "You cannot follow yourself."}
+
+"id" is optional and echoed back. All commands run on one connection. Writes
+are grouped: up to --group-size commands share a transaction, each inside its
+own savepoint, so a failing command is undone alone and the rest of the group
+still commits. The results of a group are written once it has committed, so an
+"ok" result is never reported for a write that could still be lost.
+"""
+import argparse
+import dataclasses
+import json
+import sqlite3
+import sys
+import time
+
+import cache
+import credentials
+import db
+import migrations
+import queries
+from store import QUERIES, MicroTweetStore, StoreError
+
+DEFAULT_GROUP_SIZE = 1000
+
+
+def _rows(rows):
+    return [dataclasses.asdict(row) for row in rows]
+
+
+def _feed(store, cmd):
+    items, has_more = next(store.feed_pages(cmd["user"], cmd.get("limit", 5)), ([], False))
+    return {"items": _rows(items), "has_more": has_more}
+
+
+def _conversation(conversation):
+    return dataclasses.asdict(conversation) if conversation is not None else None
+
+
+def _post(store, cmd):
+    tid, hashtags = store.post_tweet(cmd["user"], cmd["text"], cmd.get("replyto"))
+    return {"tid": tid, "hashtags": hashtags}
+
+
+# op: (handler(store, cmd) -> JSON-able result, whether the op writes)
+OPS = {
+    "signup": (lambda store, cmd: {"usr": store.signup(
+        cmd["name"], cmd["email"], cmd.get("phone"), cmd["pwd"])}, True),
+    "login": (lambda store, cmd: {"usr": store.login(cmd["usr"], cmd["pwd"])}, False),
+    "post": (_post, True),
+    "retweet": (lambda store, cmd: store.retweet(cmd["user"], cmd["tid"]), True),
+    "follow": (lambda store, cmd: store.follow(cmd["user"], cmd["followee"]), True),
+    "follow_many": (lambda store, cmd: {"followed": store.follow_many(
+        cmd["user"], cmd["followees"])}, True),
+    "unfollow": (lambda store, cmd: store.unfollow(cmd["user"], cmd["followee"]), True),
+    "unfollow_many": (lambda store, cmd: {"unfollowed": store.unfollow_many(
+        cmd["user"], cmd["followees"])}, True),
+    "add_to_list": (lambda store, cmd: store.add_to_favorite_list(
+        cmd["user"], cmd["list"], cmd["tid"]), True),
+    "add_many_to_list": (lambda store, cmd: {"added": store.add_many_to_favorite_list(
+        cmd["user"], cmd["list"], cmd["tids"])}, True),
+    "remove_from_list": (lambda store, cmd: store.remove_from_favorite_list(
+        cmd["user"], cmd["list"], cmd["tid"]), True),
+    "create_list": (lambda store, cmd: store.create_favorite_list(cmd["user"], cmd["list"]), True),
+    "delete_list": (lambda store, cmd: store.delete_favorite_list(cmd["user"], cmd["list"]), True),
+    "feed": (_feed, False),
+    "search": (lambda store, cmd: _rows(store.search_tweets(
+        cmd["keywords"], cmd.get("limit", 5), cmd.get("offset", 0))), False),
+    "search_users": (lambda store, cmd: _rows(store.search_users(
+        cmd["keyword"], cmd.get("limit", -1), cmd.get("offset", 0))), False),
+    "user_stats": (lambda store, cmd: dataclasses.asdict(store.user_stats(cmd["user"])), False),
+    "tweet_stats": (lambda store, cmd: dataclasses.asdict(store.tweet_stats(cmd["tid"])), False),
+    "user_tweets": (lambda store, cmd: _rows(store.user_tweets(
+        cmd["user"], cmd.get("limit", -1))), False),
+    "followers": (lambda store, cmd: store.followers(cmd["user"]), False),
+    "follower_summaries": (lambda store, cmd: _rows(store.follower_summaries(
+        cmd["user"], cmd.get("limit", -1), cmd.get("offset", 0))), False),
+    "following": (lambda store, cmd: _rows(store.following_summaries(
+        cmd["user"], cmd.get("limit", -1), cmd.get("offset", 0))), False),
+    "mutuals": (lambda store, cmd: _rows(store.mutuals(cmd["user"])), False),
+    "suggestions": (lambda store, cmd: _rows(store.follow_suggestions(
+        cmd["user"], cmd.get("limit", 10))), False),
+    "conversation": (lambda store, cmd: _conversation(store.conversation(
+        cmd["tid"], cmd.get("depth", 4), cmd.get("width", 5))), False),
+    "replies": (lambda store, cmd: _rows(store.replies(
+        cmd["tid"], cmd.get("after"), cmd.get("depth", 4), cmd.get("width", 5))), False),
+    "favorite_lists": (lambda store, cmd: _rows(store.favorite_lists(cmd["user"])), False),
+    "trending": (lambda store, cmd: _rows(store.trending_hashtags(
+        cmd.get("hours", 24), cmd.get("limit", 20))), False),
+}
+
+
+class InvalidCommand(Exception):
+    """
+    A line that is not a command; str(e) is the error to report.
+    """
+
+
+def parse_command(line):
+    """
+    Return (cmd dict, writes) for a command line, or raise InvalidCommand.
+    """
+    try:
+        cmd = json.loads(line)
+        if not isinstance(cmd, dict):
+            raise ValueError("command must be a JSON object")
+    except ValueError as e:
+        raise InvalidCommand(f"Invalid command: {e}")
+    op = OPS.get(cmd.get("op"))
+    if op is None:
+        raise InvalidCommand(f"Unknown op: {cmd.get('op')!r}")
+    return cmd, op[1]
+
+
+def error_result(line, error):
+    """
+    The result of a line that failed to parse, echoing its id if it has one.
+    """
+    try:
+        cmd = json.loads(line)
+    except ValueError:
+        cmd = None
+    result = {"id": cmd["id"]} if isinstance(cmd, dict) and "id" in cmd else {}
+    result.update(ok=False, error=str(error))
+    return result
+
+
+def execute_command(store, cmd):
+    """
+    Run a parsed command. Returns the result dict without "seq".
+    Errors caused by the command (a missing field, a value of the wrong type,
+    a broken constraint, a StoreError) are reported in the result; any other
+    database error propagates. A write opens the group transaction if none is
+    open and runs inside its own savepoint.
+    """
+    result = {"id": cmd["id"]} if "id" in cmd else {}
+    handler, writes = OPS[cmd["op"]]
+
+    conn = store.conn
+    if writes:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("SAVEPOINT command")
+    try:
+        value = handler(store, cmd)
+    except (StoreError, KeyError, TypeError, ValueError,
+            sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+        if writes:
+            conn.execute("ROLLBACK TO command")
+            conn.execute("RELEASE command")
+        if isinstance(e, KeyError):
+            e = f"Missing field: {e.args[0]}"
+        result.update(ok=False, error=str(e))
+        return result
+    if writes:
+        conn.execute("RELEASE command")
+    result.update(ok=True, result=value)
+    return result
+
+
+def run_command(store, line):
+    """
+    Parse and run one command line. Returns the result dict without "seq".
+    """
+    try:
+        cmd, _ = parse_command(line)
+    except InvalidCommand as e:
+        return error_result(line, e)
+    return execute_command(store, cmd)
+
+
+def run(store, lines, out, group_size=DEFAULT_GROUP_SIZE):
+    """
+    Run the command lines and write a result line to out for each. Returns
+    (commands, errors).
+    """
+    conn = store.conn
+    pending = []
+    seq = 0
+    errors = 0
+
+    def flush():
+        nonlocal errors
+        if conn.in_transaction:
+            conn.commit()
+        for result in pending:
+            errors += not result["ok"]
+            out.write(json.dumps(result) + "\n")
+        out.flush()
+        pending.clear()
+
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            seq += 1
+            pending.append({"seq": seq, **run_command(store, line)})
+            if len(pending) >= group_size:
+                flush()
+        flush()
+    except BaseException:
+        # The open group never committed; its results must not be reported.
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return seq, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="twitter.py batch",
+        description="Run newline-delimited JSON commands against a microtweet "
+                    "database and print one JSON result per line.")
+    parser.add_argument("database_file")
+    parser.add_argument("--file", help="command file (default: stdin)")
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE,
+                        help="commands per transaction; use 1 to see each result "
+                             f"as soon as it is committed (default: {DEFAULT_GROUP_SIZE})")
+    db.add_connection_arguments(parser)
+    cache.add_cache_arguments(parser)
+    credentials.add_credential_arguments(parser)
+    queries.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.group_size < 1:
+        parser.error("--group-size must be at least 1")
+
+    conn = db.connect_from_args(args.database_file, args)
+    migrations.migrate(conn)
+    registry = queries.registry_from_args(QUERIES, args)
+    store = MicroTweetStore(conn, registry, args.cache_entries, args.cache_ttl,
+                            verifier=credentials.verifier_from_args(args))
+    source = open(args.file, encoding="utf-8") if args.file else sys.stdin
+    start = time.perf_counter()
+    try:
+        commands, errors = run(store, source, sys.stdout, args.group_size)
+    finally:
+        if args.file:
+            source.close()
+        store.close()
+        queries.finish(registry, args)
+        if args.profile:
+            print("\n" + cache.report(store.caches), file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    rate = commands / elapsed if elapsed else 0
+    print(f"{commands:,} commands, {errors:,} failed, {elapsed:.2f}s, "
+          f"{rate:,.0f} commands/s", file=sys.stderr)
+    return 0
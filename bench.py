@@ -0,0 +1,1247 @@
+"""
+Benchmarks and stress tests for microtweet databases.
+
+Each subcommand works on a scratch copy of the given database unless noted,
+so the original file is never modified.
+
+    python3 bench.py ids <database_file> [--processes N] [--posts N]
+    python3 bench.py concurrency <database_file> [--readers N] [--writers N]
+    python3 bench.py suite [--scales 1000,10000] [--out results.json]
+    python3 bench.py server <database_file> [--sessions N] [--seconds S]
+    python3 bench.py writes <database_file> [--threads N] [--seconds S]
+    python3 bench.py trending [--mentions 2000000]
+    python3 bench.py logins <database_file> [--threads N] [--seconds S]
+    python3 bench.py threads [--deep 10000] [--wide 10000] [--bushy 20000]
+    python3 bench.py graph [--users 20000] [--follows 500]
+    python3 bench.py lists [--lists 20] [--tweets-per-list 50]
+    python3 bench.py snapshot [--users 10000]
+
+The suite, trending, threads, graph, lists and snapshot generate synthetic
+databases (see datagen.py) instead.
+"""
+import argparse
+import asyncio
+import builtins
+import collections
+import contextlib
+import dataclasses
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cache
+import credentials
+import datagen
+import db
+import migrations
+import snapshot
+import trending
+import twitter
+import store as store_module
+import writequeue
+from store import QUERIES, MicroTweetStore
+
+
+def scratch_copy(db_name, directory):
+    """
+    Copy db_name into directory, migrate the copy and return its path.
+    """
+    path = os.path.join(directory, os.path.basename(db_name))
+    shutil.copyfile(db_name, path)
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    conn.close()
+    return path
+
+
+def _post_tweets(args):
+    """
+    Worker for bench_ids: post `posts` tweets as writer_id, each with a fresh
+    id from db.allocate_id. Returns (tids, errors).
+    """
+    path, writer_id, posts = args
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    tids = []
+    errors = []
+    for i in range(posts):
+        try:
+            with db.write_transaction(conn):
+                tid = db.allocate_id(conn, "tweets")
+                conn.execute("""
+                    INSERT INTO tweets(tid, writer_id, text, tdate, ttime, replyto_tid)
+                    VALUES (?, ?, ?, date('now'), time('now'), NULL)
+                """, (tid, writer_id, f"stress tweet {i} from process {os.getpid()}"))
+            tids.append(tid)
+        except sqlite3.Error as e:
+            errors.append(str(e))
+    conn.close()
+    return tids, errors
+
+
+def bench_ids(args):
+    """
+    Have several processes post tweets concurrently and check that every post
+    got a distinct tid and none of them failed.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = scratch_copy(args.database_file, tmp)
+        conn = sqlite3.connect(path)
+        writer_id = conn.execute("SELECT usr FROM users LIMIT 1").fetchone()[0]
+        before = conn.execute("SELECT COUNT(*) FROM tweets").fetchone()[0]
+        conn.close()
+
+        jobs = [(path, writer_id, args.posts)] * args.processes
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.map(_post_tweets, jobs)
+        elapsed = time.perf_counter() - start
+
+        tids = [tid for worker_tids, _ in results for tid in worker_tids]
+        errors = [e for _, worker_errors in results for e in worker_errors]
+        conn = sqlite3.connect(path)
+        after = conn.execute("SELECT COUNT(*) FROM tweets").fetchone()[0]
+        conn.close()
+
+    expected = args.processes * args.posts
+    collisions = len(tids) - len(set(tids))
+    print(f"Processes: {args.processes}, posts per process: {args.posts}")
+    print(f"Posted: {len(tids)}/{expected} in {elapsed:.2f}s "
+          f"({len(tids) / elapsed:.0f} posts/s)")
+    print(f"Rows added: {after - before}")
+    print(f"Duplicate tids: {collisions}")
+    print(f"Failed inserts: {len(errors)}")
+    for e in sorted(set(errors)):
+        print(f"   {e}")
+    ok = collisions == 0 and not errors and after - before == expected
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+# Connection settings compared by bench_concurrency: what main() used before
+# db.connect existed, and the defaults of db.connect.
+CONCURRENCY_CONFIGS = {
+    "rollback journal, no busy timeout": dict(
+        journal_mode="delete", busy_timeout=0, synchronous="full",
+        mmap_size=0, cache_size=-2000),
+    "db.connect defaults": dict(),
+}
+
+
+def _concurrency_worker(args):
+    """
+    Worker for bench_concurrency: until deadline, either read feed pages or
+    post tweets. Returns (role, completed operations, locked errors,
+    per-operation latencies).
+    """
+    path, config, role, user_id, deadline = args
+    done = 0
+    locked = 0
+    latencies = []
+    conn = None
+    while conn is None:
+        try:
+            conn = db.connect(path, **config)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            if role == "reader":
+                next(MicroTweetStore(conn).feed_pages(user_id), None)
+            else:
+                with db.write_transaction(conn):
+                    tid = db.allocate_id(conn, "tweets")
+                    conn.execute("""
+                        INSERT INTO tweets(tid, writer_id, text, tdate, ttime, replyto_tid)
+                        VALUES (?, ?, 'concurrency benchmark', date('now'), time('now'), NULL)
+                    """, (tid, user_id))
+            done += 1
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    conn.close()
+    return role, done, locked, latencies
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_concurrency(args):
+    """
+    Run readers (feed pages) and writers (tweets) against the same database
+    at once, for each entry of CONCURRENCY_CONFIGS, and report throughput,
+    tail latency and "database is locked" errors.
+    """
+    for name, config in CONCURRENCY_CONFIGS.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = scratch_copy(args.database_file, tmp)
+            # Switch the journal mode up front; switching needs an exclusive
+            # lock the workers would otherwise fight over.
+            conn = db.connect(path, **config)
+            user_id = conn.execute(
+                "SELECT flwer FROM follows GROUP BY flwer "
+                "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+            conn.close()
+
+            deadline = time.time() + args.seconds
+            jobs = ([(path, config, "reader", user_id, deadline)] * args.readers
+                    + [(path, config, "writer", user_id, deadline)] * args.writers)
+            with multiprocessing.Pool(len(jobs)) as pool:
+                results = pool.map(_concurrency_worker, jobs)
+
+        print(f"\n--- {name} ---")
+        for role in ("reader", "writer"):
+            done = sum(r[1] for r in results if r[0] == role)
+            locked = sum(r[2] for r in results if r[0] == role)
+            latencies = [l for r in results if r[0] == role for l in r[3]]
+            print(f"{role}s: {done / args.seconds:8.0f} ops/s, "
+                  f"p50 {percentile(latencies, 50) * 1000:6.2f} ms, "
+                  f"p99 {percentile(latencies, 99) * 1000:6.2f} ms, "
+                  f"locked errors: {locked}")
+    return 0
+
+
+@contextlib.contextmanager
+def scripted_input(answers):
+    """
+    Answer input() prompts from answers (then with blank lines) and discard
+    everything printed, so the interactive menu functions can run headless.
+    """
+    answers = iter(answers)
+    real_input = builtins.input
+    builtins.input = lambda prompt="": next(answers, "")
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        builtins.input = real_input
+
+
+def suite_paths(conn, rng, samples):
+    """
+    Return {name: [callable, ...]}: samples calls of each menu path, with
+    arguments drawn from the database by rng.
+    """
+    users = [row[0] for row in conn.execute(
+        "SELECT DISTINCT flwer FROM follows ORDER BY flwer").fetchall()]
+    tweets = conn.execute("SELECT MAX(tid) FROM tweets").fetchone()[0]
+    store = MicroTweetStore(conn)
+    tags = [row[0] for row in conn.execute(
+        "SELECT term FROM hashtag_mentions GROUP BY term "
+        "ORDER BY COUNT(*) DESC LIMIT 100").fetchall()]
+
+    def text_of(tid):
+        row = conn.execute("SELECT text FROM tweets WHERE tid = ?", (tid,)).fetchone()
+        return row[0] if row and row[0] else "a"
+
+    def word():
+        return rng.choice(text_of(rng.randint(1, tweets)).split())
+
+    def name_part():
+        row = conn.execute("SELECT name FROM users WHERE usr = ?",
+                           (rng.choice(users),)).fetchone()
+        return row[0].split()[0][:rng.randint(1, 4)].lower()
+
+    def feed(user_id, pages):
+        return lambda: list(itertools.islice(
+            store.feed_pages(user_id), pages))
+
+    def search(keywords):
+        return lambda: store.search_tweets(keywords)
+
+    def menu(func, answers, *args):
+        def run():
+            with scripted_input(answers):
+                func(store, *args)
+        return run
+
+    paths = {
+        "feed_first_page": [feed(rng.choice(users), 1) for _ in range(samples)],
+        "feed_three_pages": [feed(rng.choice(users), 3) for _ in range(samples)],
+        "search_tweets_keyword": [search([word()]) for _ in range(samples)],
+        "search_tweets_hashtag": [search(["#" + rng.choice(tags)]) for _ in range(samples)],
+        "search_tweets_multi": [search([word(), word(), "#" + rng.choice(tags)])
+                                for _ in range(samples)],
+        "search_users": [menu(twitter.search_users, [name_part(), "n", ""], users[0])
+                         for _ in range(samples)],
+        "show_user_details": [menu(twitter.show_user_details, ["3"], users[0],
+                                   rng.choice(users)) for _ in range(samples)],
+        "tweet_options": [menu(twitter.tweet_options, ["4"], users[0],
+                               rng.randint(1, tweets)) for _ in range(samples)],
+    }
+    return paths
+
+
+def latency_summary(latencies):
+    return {
+        "n": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def _run_suite(args):
+    """
+    Worker for bench_suite, run in a fresh process so that ru_maxrss is the
+    peak of the query workload alone.
+    """
+    path, samples, seed = args
+    conn = db.connect(path)
+    rng = random.Random(seed)
+    paths = suite_paths(conn, rng, samples)
+    results = {}
+    for name, calls in paths.items():
+        latencies = []
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+        results[name] = latency_summary(latencies)
+    rows = {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            for table in ("users", "tweets", "retweets", "follows", "hashtag_mentions")}
+    conn.close()
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"rows": rows, "peak_rss_kb": peak_rss_kb, "paths": results}
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def bench_suite(args):
+    """
+    Generate a synthetic database per scale (cached in --cache-dir), time
+    every menu path on it and write the results to --out as JSON.
+    """
+    os.makedirs(args.cache_dir, exist_ok=True)
+    report = {"environment": environment(), "seed": args.seed,
+              "samples": args.samples, "scales": {}}
+    spawn = multiprocessing.get_context("spawn")
+    for users in args.scales:
+        path = os.path.join(args.cache_dir, f"synthetic-u{users}-s{args.seed}.db")
+        if not os.path.exists(path):
+            print(f"Generating {users} users into {path} ...")
+            datagen.generate(path, datagen.Generator(users, seed=args.seed))
+        with spawn.Pool(1) as pool:
+            result = pool.apply(_run_suite, ((path, args.samples, args.seed),))
+        report["scales"][str(users)] = result
+
+        print(f"\n--- {users} users, {result['rows']['tweets']} tweets, "
+              f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MiB ---")
+        for name, summary in result["paths"].items():
+            print(f"{name:24} p50 {summary['p50_ms']:9.3f} ms   "
+                  f"p99 {summary['p99_ms']:9.3f} ms")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"\nResults written to {args.out}")
+    return 0
+
+
+def session_script(rng, users, words):
+    """
+    The commands of one simulated client session, as JSON lines.
+    """
+    usr, pwd = rng.choice(users)
+    other = rng.choice(users)[0]
+    word = rng.choice(words)
+    commands = [
+        {"op": "login", "usr": usr, "pwd": pwd},
+        {"op": "feed", "user": usr},
+        {"op": "search", "keywords": [word]},
+        {"op": "search_users", "keyword": word[:2], "limit": 5},
+        {"op": "user_stats", "user": other},
+        {"op": "post", "user": usr, "text": f"load test {word} #bench"},
+        {"op": "follow", "user": usr, "followee": other},
+    ]
+    return [json.dumps(cmd).encode() + b"\n" for cmd in commands]
+
+
+async def _run_sessions(socket_path, clients, seconds, users, words, seed):
+    """
+    Run clients concurrent session loops against the server until seconds
+    have passed. Returns (sessions completed, {op: [latency, ...]}).
+    """
+    latencies = collections.defaultdict(list)
+    sessions = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(n):
+        nonlocal sessions
+        rng = random.Random(f"{seed}:{n}")
+        while time.perf_counter() < deadline:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            for line in session_script(rng, users, words):
+                start = time.perf_counter()
+                writer.write(line)
+                await writer.drain()
+                await reader.readline()
+                latencies[json.loads(line)["op"]].append(time.perf_counter() - start)
+            writer.close()
+            await writer.wait_closed()
+            sessions += 1
+
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return sessions, latencies
+
+
+def bench_server(args):
+    """
+    Start server.py on a scratch copy, drive it with --sessions concurrent
+    clients, each running session_script over and over, and report sessions
+    per second and per-command tail latency.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = scratch_copy(args.database_file, tmp)
+        conn = sqlite3.connect(path)
+        users = conn.execute("SELECT usr, pwd FROM users").fetchall()
+        words = [w for (text,) in conn.execute(
+                     "SELECT text FROM tweets ORDER BY random() LIMIT 200")
+                 for w in (text or "").split() if len(w) >= 3 and w.isalpha()] or ["the"]
+        conn.close()
+
+        socket_path = os.path.join(tmp, "server.sock")
+        server_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+        server = subprocess.Popen(
+            [sys.executable, server_py, path, "--unix", socket_path,
+             "--readers", str(args.readers), "--group-size", str(args.group_size)],
+            stdout=subprocess.PIPE, text=True)
+        try:
+            server.stdout.readline()    # "Serving ..."
+            start = time.perf_counter()
+            sessions, latencies = asyncio.run(_run_sessions(
+                socket_path, args.sessions, args.seconds, users, words, args.seed))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server_stats = server.communicate()[0].strip()
+
+    commands = sum(len(l) for l in latencies.values())
+    print(f"{args.sessions} concurrent clients, {args.readers} readers: "
+          f"{sessions / elapsed:,.1f} sessions/s, {commands / elapsed:,.0f} commands/s")
+    print(f"server: {server_stats}")
+    for op, values in latencies.items():
+        print(f"{op:14} p50 {percentile(values, 50) * 1000:7.2f} ms   "
+              f"p99 {percentile(values, 99) * 1000:7.2f} ms   "
+              f"max {max(values) * 1000:7.2f} ms")
+    return 0
+
+
+def _post_until(path, options, write_queue, verifier, writer_id, deadline, latencies):
+    """
+    Thread body for bench_writes: post tweets through a store of its own
+    (over write_queue, if given) until deadline.
+    """
+    store = MicroTweetStore(db.connect(path, **options), cache_entries=0,
+                            write_queue=write_queue, verifier=verifier)
+    try:
+        while time.time() < deadline:
+            start = time.perf_counter()
+            store.post_tweet(writer_id, f"write benchmark #bench{len(latencies) % 10}")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        # The queue and verifier are shared; bench_writes closes them.
+        store.write_queue = None
+        store.close()
+
+
+def bench_writes(args):
+    """
+    Post tweets from --threads threads for --seconds, once per durability
+    mode (see writequeue.py), and report writes/s, commits and latency.
+    sync is the client without a queue: every post is its own commit.
+    """
+    options = db.connection_options(args)
+    print(f"{args.threads} threads posting for {args.seconds:g}s, "
+          f"flush every {args.flush_ms:g} ms or {args.flush_ops} writes, "
+          f"synchronous={args.synchronous}")
+    for mode in writequeue.DURABILITY_MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = scratch_copy(args.database_file, tmp)
+            conn = db.connect(path)
+            writer_id = conn.execute("SELECT usr FROM users LIMIT 1").fetchone()[0]
+            before = conn.execute("SELECT COUNT(*) FROM tweets").fetchone()[0]
+            conn.close()
+
+            verifier = credentials.Verifier()
+            queue = None
+            if mode != "sync":
+                queue = writequeue.WriteQueue(path, mode, args.flush_ms, args.flush_ops,
+                                              options, verifier=verifier)
+            latencies = [[] for _ in range(args.threads)]
+            deadline = time.time() + args.seconds
+            threads = [threading.Thread(target=_post_until,
+                                        args=(path, options, queue, verifier, writer_id,
+                                              deadline, l))
+                       for l in latencies]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if queue is not None:
+                queue.close()
+            verifier.close()
+            elapsed = time.perf_counter() - start
+
+            conn = db.connect(path)
+            stored = conn.execute("SELECT COUNT(*) FROM tweets").fetchone()[0] - before
+            conn.close()
+
+        writes = [l for thread_latencies in latencies for l in thread_latencies]
+        commits = queue.stats["commits"] if queue is not None else len(writes)
+        print(f"{mode:6} {len(writes) / elapsed:9,.0f} writes/s  "
+              f"{commits:7,} commits ({len(writes) / max(commits, 1):5.1f} writes each)  "
+              f"p50 {percentile(writes, 50) * 1000:6.2f} ms  "
+              f"p99 {percentile(writes, 99) * 1000:6.2f} ms  "
+              f"stored {stored:,}/{len(writes):,}")
+    return 0
+
+
+# Top hashtags straight from hashtag_mentions, with the same buckets and
+# terms as the hashtag_counts rollup, for bench_trending to compare against.
+TRENDING_GROUP_BY_QUERY = f"""
+    SELECT term, COUNT(*) AS mentions FROM (
+        SELECT {migrations.trending_term("m.term")} AS term,
+               {migrations.trending_bucket("t.tdate", "t.ttime")} AS bucket
+        FROM hashtag_mentions m JOIN tweets t ON t.tid = m.tid, (SELECT ? AS span)
+    )
+    WHERE bucket > ? AND bucket <= ?
+    GROUP BY term
+    ORDER BY mentions DESC, term
+    LIMIT ?
+"""
+
+TRENDING_WINDOWS = [1, 24, 7 * 24, 30 * 24]
+
+
+def _time_posts(conn, posts, tid_base, drop_triggers=()):
+    """
+    Insert posts tweets with two hashtags each in one transaction, roll it
+    back (together with dropping drop_triggers), and return the seconds the
+    inserts took.
+    """
+    conn.execute("BEGIN")
+    for name in drop_triggers:
+        conn.execute(f'DROP TRIGGER "{name}"')
+    start = time.perf_counter()
+    for tid in range(tid_base, tid_base + posts):
+        conn.execute(QUERIES["insert_tweet"],
+                     (tid, 1, "bench", "2024-12-31", "12:00:00", None, None))
+        conn.executemany(QUERIES["insert_hashtags"], [(tid, "bench"), (tid, f"tag{tid % 50}")])
+    elapsed = time.perf_counter() - start
+    conn.rollback()
+    return elapsed
+
+
+def bench_trending(args):
+    """
+    Generate a synthetic database with about --mentions hashtag mentions
+    (cached in --cache-dir), then time the top hashtags of several windows
+    from the hashtag_counts rollup and with a GROUP BY over every mention,
+    and what keeping the rollup costs a post.
+    """
+    os.makedirs(args.cache_dir, exist_ok=True)
+    path = os.path.join(args.cache_dir, f"trending-m{args.mentions}-s{args.seed}.db")
+    if not os.path.exists(path):
+        tweets = int(args.mentions / (datagen.HASHTAG_PROBABILITY * 1.5))
+        print(f"Generating {tweets:,} tweets into {path} ...")
+        datagen.generate(path, datagen.Generator(
+            args.users, tweets, follows_per_user=5, retweet_ratio=0, seed=args.seed))
+
+    conn = db.connect(path)
+    mentions = conn.execute("SELECT COUNT(*) FROM hashtag_mentions").fetchone()[0]
+    buckets = conn.execute("SELECT COUNT(*) FROM hashtag_counts").fetchone()[0]
+    print(f"{mentions:,} mentions, {buckets:,} rollup rows; "
+          f"top {args.limit}, best of {args.repeat}")
+    # Just before the newest generated tweets.
+    now = datetime.datetime.combine(datagen.END_DATE, datetime.time()) - datetime.timedelta(seconds=1)
+    ok = True
+    for hours in TRENDING_WINDOWS:
+        params = trending.window(hours, now) + (args.limit,)
+        timings = {}
+        for name, sql in (("rollup", trending.TOP_QUERY), ("group by", TRENDING_GROUP_BY_QUERY)):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rows = conn.execute(sql, params).fetchall()
+                best = min(best, time.perf_counter() - start)
+            timings[name] = (best, rows)
+        same = timings["rollup"][1] == timings["group by"][1]
+        ok = ok and same
+        print(f"last {hours:4}h ({params[0]:4}): rollup {timings['rollup'][0] * 1000:8.2f} ms   "
+              f"group by {timings['group by'][0] * 1000:9.2f} ms   "
+              f"{timings['group by'][0] / timings['rollup'][0]:7.0f}x   "
+              f"{'same top ' + str(args.limit) if same else 'DIFFERENT RESULTS'}")
+
+    # What the rollup triggers cost a post; both runs are rolled back.
+    tid_base = conn.execute("SELECT MAX(tid) FROM tweets").fetchone()[0] + 1
+    triggers = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%trending%'")]
+    with_rollup = _time_posts(conn, args.posts, tid_base)
+    without_rollup = _time_posts(conn, args.posts, tid_base, triggers)
+    conn.close()
+    print(f"{args.posts} posts with 2 hashtags: "
+          f"{with_rollup * 1e6 / args.posts:.1f} us/post with the rollup, "
+          f"{without_rollup * 1e6 / args.posts:.1f} us/post without")
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def _add_threads(conn, rng, deep, wide, bushy):
+    """
+    Append three reply threads to conn: a chain of `deep` replies, a tweet
+    with `wide` direct replies and a random tree of `bushy` tweets, each
+    replying to a random earlier one. Returns {thread: (root tid, last tid)}.
+    """
+    tid = conn.execute("SELECT MAX(tid) FROM tweets").fetchone()[0]
+    ts = int(datetime.datetime.combine(datagen.END_DATE, datetime.time()).timestamp())
+    rows = []
+    threads = {}
+
+    def add(replyto):
+        nonlocal tid, ts
+        tid += 1
+        ts += 60
+        when = datetime.datetime.fromtimestamp(ts)
+        rows.append((tid, rng.randint(1, 100), f"reply to {replyto}", when.strftime("%Y-%m-%d"),
+                     when.strftime("%H:%M:%S"), replyto, ts))
+        return tid
+
+    root = last = add(None)
+    for _ in range(deep):
+        last = add(last)
+    threads["deep"] = (root, last)
+    root = add(None)
+    for _ in range(wide):
+        last = add(root)
+    threads["wide"] = (root, last)
+    root = add(None)
+    for _ in range(bushy):
+        last = add(rng.randint(root, tid))
+    threads["bushy"] = (root, last)
+
+    with db.write_transaction(conn):
+        conn.executemany(QUERIES["insert_tweet"], rows)
+    return threads
+
+
+def _conversation_per_tweet(conn, tid, depth, width, max_tweets, ancestors):
+    """
+    The same conversation as the conversation query, read the way a client
+    without it would: a query per ancestor, and per tweet one for its reply
+    count and one for its first replies. Returns (tids, queries run).
+    """
+    queries = 1
+    up = []
+    parent = conn.execute("SELECT replyto_tid FROM tweets WHERE tid = ?", (tid,)).fetchone()[0]
+    while parent is not None and len(up) < ancestors:
+        row = conn.execute("SELECT tid, writer_id, text, replyto_tid FROM tweets WHERE tid = ?",
+                           (parent,)).fetchone()
+        queries += 1
+        if row is None:
+            break
+        up.append(row[0])
+        parent = row[3]
+    found = [tid]
+    level = [tid]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            conn.execute("SELECT COUNT(*) FROM tweets WHERE replyto_tid = ?", (parent,)).fetchone()
+            next_level += [row[0] for row in conn.execute(
+                "SELECT tid, writer_id, tdate, ttime, text, ts FROM tweets "
+                "WHERE replyto_tid = ? ORDER BY ts, tid LIMIT ?", (parent, width))]
+            queries += 2
+            if max_tweets >= 0 and len(found) + len(next_level) >= max_tweets:
+                break
+        found += next_level
+        level = next_level
+        if not level or (max_tweets >= 0 and len(found) >= max_tweets):
+            break
+    if max_tweets >= 0:
+        found = found[:max_tweets]
+    return up[::-1] + found, queries
+
+
+def _conversation_tids(conversation):
+    tids = [tweet.tid for tweet in conversation.ancestors]
+    level = [conversation.focus]
+    while level:
+        tids += [node.tweet.tid for node in level]
+        level = [child for node in level for child in node.children]
+    return tids
+
+
+def bench_threads(args):
+    """
+    Time loading conversations from deep, wide and bushy synthetic threads
+    with the single recursive query of MicroTweetStore.conversation and
+    with a query per tweet, with the default depth/width limits and for the
+    whole thread, and what conversation() takes including building the
+    ReplyNodes.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "threads.db")
+        datagen.generate(path, datagen.Generator(args.users, seed=args.seed))
+        conn = db.connect(path)
+        threads = _add_threads(conn, random.Random(args.seed), args.deep, args.wide, args.bushy)
+        conn.close()
+        store = MicroTweetStore.open(path)
+        store.caches = {name: cache.LRUCache(0) for name in store.caches}
+        print(f"deep: {args.deep:,} replies in a chain, wide: {args.wide:,} replies to one "
+              f"tweet, bushy: {args.bushy:,} replies in a random tree; median of {args.repeat}")
+
+        limits = {
+            "limits": (store_module.THREAD_DEPTH, store_module.THREAD_WIDTH,
+                       store_module.THREAD_MAX_TWEETS, store_module.THREAD_ANCESTORS),
+            "whole": (10 ** 9, -1, -1, 10 ** 9),
+        }
+        ok = True
+        for thread, (root, last) in threads.items():
+            for focus, tid in (("root", root), ("last", last)):
+                for label, (depth, width, max_tweets, ancestors) in limits.items():
+                    params = {"tid": tid, "ancestors": ancestors, "depth": depth,
+                              "width": width, "max_tweets": max_tweets}
+                    one, naive, built = [], [], []
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        store.conn.execute(QUERIES["conversation"], params).fetchall()
+                        one.append(time.perf_counter() - start)
+                        start = time.perf_counter()
+                        tids, queries = _conversation_per_tweet(
+                            store.conn, tid, depth, width, max_tweets, ancestors)
+                        naive.append(time.perf_counter() - start)
+                        start = time.perf_counter()
+                        conversation = store.conversation(tid, depth, width, max_tweets, ancestors)
+                        built.append(time.perf_counter() - start)
+                    same = _conversation_tids(conversation) == tids
+                    ok = ok and same
+                    one_ms, naive_ms, built_ms = (statistics.median(t) * 1000
+                                                  for t in (one, naive, built))
+                    print(f"{thread:5} {focus:4} {label:6} {len(tids):6,} tweets: "
+                          f"1 query {one_ms:8.2f} ms  {queries:6,} queries {naive_ms:8.2f} ms "
+                          f"{naive_ms / one_ms:5.1f}x   with nodes {built_ms:8.2f} ms   "
+                          f"{'same' if same else 'DIFFERENT TWEETS'}")
+        store.close()
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def _follow_one_by_one(conn, user_id, user_ids, start_date):
+    """
+    Follow user_ids the way the client used to: a lookup, then an INSERT in
+    its own transaction, per user.
+    """
+    for other_id in user_ids:
+        if conn.execute("SELECT 1 FROM follows WHERE flwer=? AND flwee=?",
+                        (user_id, other_id)).fetchone():
+            continue
+        with db.write_transaction(conn):
+            conn.execute("INSERT INTO follows(flwer, flwee, start_date) VALUES (?,?,?)",
+                         (user_id, other_id, start_date))
+
+
+def _follower_rows_per_user(conn, user_id, viewer):
+    """
+    The follower list with names and counts, a lookup per follower: what
+    graph.FOLLOWERS_QUERY replaces.
+    """
+    rows = []
+    for (flwer,) in conn.execute("SELECT flwer FROM follows WHERE flwee=? ORDER BY flwer",
+                                 (user_id,)).fetchall():
+        name = conn.execute("SELECT name FROM users WHERE usr=?", (flwer,)).fetchone()
+        stats = conn.execute(QUERIES["user_stats"], (flwer,)).fetchone()
+        followed = conn.execute("SELECT 1 FROM follows WHERE flwer=? AND flwee=?",
+                                (viewer, flwer)).fetchone()
+        rows.append((flwer, name[0] if name else None) + tuple(stats or (0, 0, 0))
+                    + (followed is not None,))
+    return rows
+
+
+def bench_graph(args):
+    """
+    On a synthetic power-law follow graph: --follows follows made one at a
+    time (a lookup and a commit each) and with follow_many (one statement,
+    one commit); the follower list of the most followed users with a
+    lookup per follower and with the joined query; and p50/p99 of
+    suggestions and mutuals over --samples users.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "graph.db")
+        datagen.generate(path, datagen.Generator(
+            args.users, tweets=args.users * 2, retweet_ratio=0, seed=args.seed))
+        store = MicroTweetStore.open(path)
+        conn = store.conn
+        store.caches = {name: cache.LRUCache(0) for name in store.caches}
+        follows = conn.execute("SELECT COUNT(*) FROM follows").fetchone()[0]
+        print(f"{args.users:,} users, {follows:,} follows")
+
+        rng = random.Random(args.seed)
+        users = [row[0] for row in conn.execute("SELECT usr FROM users")]
+        old_user, new_user = rng.sample(users, 2)
+        targets = rng.sample(users, args.follows)
+        start = time.perf_counter()
+        _follow_one_by_one(conn, old_user, targets, "2025-01-01")
+        one_by_one = time.perf_counter() - start
+        start = time.perf_counter()
+        store.follow_many(new_user, targets)
+        bulk = time.perf_counter() - start
+        same = all(set(targets) - {user_id}
+                   <= {u.usr for u in store.following_summaries(user_id)}
+                   for user_id in (old_user, new_user))
+        print(f"follow {args.follows} users: one by one {one_by_one * 1000:9.1f} ms   "
+              f"follow_many {bulk * 1000:7.1f} ms   {one_by_one / bulk:5.0f}x   "
+              f"{'all followed' if same else 'MISSING FOLLOWS'}")
+        ok = same
+
+        for user_id, followers in conn.execute(
+                "SELECT usr, followers FROM user_stats ORDER BY followers DESC LIMIT 3").fetchall():
+            start = time.perf_counter()
+            per_user = _follower_rows_per_user(conn, user_id, user_id)
+            per_user_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            joined = store.follower_summaries(user_id)
+            joined_ms = (time.perf_counter() - start) * 1000
+            same = [dataclasses.astuple(u) for u in joined] == per_user
+            ok = ok and same
+            print(f"followers of {user_id} ({followers:,}): per follower {per_user_ms:8.1f} ms   "
+                  f"joined {joined_ms:7.1f} ms   {per_user_ms / joined_ms:5.1f}x   "
+                  f"{'same rows' if same else 'DIFFERENT ROWS'}")
+
+        for name, fn in (("suggestions", store.follow_suggestions), ("mutuals", store.mutuals)):
+            latencies = []
+            for user_id in rng.sample(users, args.samples):
+                start = time.perf_counter()
+                fn(user_id)
+                latencies.append(time.perf_counter() - start)
+            print(f"{name:11} over {args.samples} users: p50 {percentile(latencies, 50) * 1000:7.2f} ms"
+                  f"   p99 {percentile(latencies, 99) * 1000:7.2f} ms")
+        store.close()
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def _favorite_lists_per_query(conn, user_id):
+    """
+    The user's lists with their tweets the old way: the names, then the tids
+    of each list, then each tweet. Returns [(lname, tids, tweets)].
+    """
+    lists = []
+    for (lname,) in conn.execute(QUERIES["list_names"], (user_id,)).fetchall():
+        tids = [row[0] for row in conn.execute(
+            "SELECT tid FROM include WHERE owner_id=? AND lname=?", (user_id, lname))]
+        tweets = [conn.execute(QUERIES["tweet"], (tid,)).fetchone() for tid in tids]
+        lists.append((lname, tuple(tids), tuple(t for t in tweets if t is not None)))
+    return sorted(lists)
+
+
+def bench_lists(args):
+    """
+    Give a user --lists favorite lists of --tweets-per-list tweets, added one
+    commit per tweet and with add_many_to_favorite_list, then time reading
+    them back with a query per list and per tweet and with the joined
+    query.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lists.db")
+        datagen.generate(path, datagen.Generator(args.users, retweet_ratio=0, seed=args.seed))
+        store = MicroTweetStore.open(path)
+        conn = store.conn
+        rng = random.Random(args.seed)
+        tweets = conn.execute("SELECT MAX(tid) FROM tweets").fetchone()[0]
+        old_user, new_user = rng.sample(range(1, args.users + 1), 2)
+        lists = {f"bench{i}": rng.sample(range(1, tweets + 1), args.tweets_per_list)
+                 for i in range(args.lists)}
+        print(f"{args.lists} lists of {args.tweets_per_list} tweets; median of {args.repeat}")
+
+        start = time.perf_counter()
+        for lname, tids in lists.items():
+            with db.write_transaction(conn):
+                conn.execute(QUERIES["insert_list"], (old_user, lname))
+            for tid in tids:
+                with db.write_transaction(conn):
+                    conn.execute("INSERT INTO include(owner_id, lname, tid) VALUES (?, ?, ?)",
+                                 (old_user, lname, tid))
+        one_by_one = time.perf_counter() - start
+        start = time.perf_counter()
+        for lname, tids in lists.items():
+            store.create_favorite_list(new_user, lname)
+            store.add_many_to_favorite_list(new_user, lname, tids)
+        bulk = time.perf_counter() - start
+        print(f"add {args.lists * args.tweets_per_list:,} tweets: one by one "
+              f"{one_by_one * 1000:8.1f} ms   add_many {bulk * 1000:7.1f} ms   "
+              f"{one_by_one / bulk:5.1f}x")
+
+        per_query, joined = [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            old = _favorite_lists_per_query(conn, old_user)
+            per_query.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            new = store.favorite_lists(new_user)
+            joined.append(time.perf_counter() - start)
+        same = old == [(l.lname, l.tids, tuple(dataclasses.astuple(t) for t in l.tweets))
+                       for l in new]
+        queries = 1 + args.lists * (1 + args.tweets_per_list)
+        per_query_ms, joined_ms = (statistics.median(t) * 1000 for t in (per_query, joined))
+        print(f"show lists with tweets: {queries:,} queries {per_query_ms:7.2f} ms   "
+              f"1 query {joined_ms:7.2f} ms   {per_query_ms / joined_ms:5.1f}x   "
+              f"{'same lists' if same else 'DIFFERENT LISTS'}")
+        store.close()
+    print("OK" if same else "FAILED")
+    return 0 if same else 1
+
+
+# The snapshot.py analytics helpers as SQL, for bench_snapshot to compare
+# against.
+SNAPSHOT_QUERIES = {
+    "hashtag_counts": f"""
+        SELECT {migrations.trending_term("term")} AS term, COUNT(*) AS mentions
+        FROM hashtag_mentions
+        WHERE term IS NOT NULL
+        GROUP BY 1
+        ORDER BY mentions DESC, term
+        LIMIT :limit
+    """,
+    "follower_distribution": """
+        SELECT followers, COUNT(*) FROM (
+            SELECT COUNT(f.flwee) AS followers
+            FROM users AS u LEFT JOIN follows AS f ON f.flwee = u.usr
+            GROUP BY u.usr
+        )
+        GROUP BY followers
+        ORDER BY followers
+    """,
+    "spam_rates": """
+        SELECT retweeter_id, COUNT(*) AS retweets, SUM(spam > 0) AS spam,
+               SUM(spam > 0) * 1.0 / COUNT(*) AS rate
+        FROM retweets
+        GROUP BY retweeter_id
+        HAVING COUNT(*) >= :min_retweets
+        ORDER BY rate DESC, retweets DESC, retweeter_id
+        LIMIT :limit
+    """,
+}
+
+
+def _directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def bench_snapshot(args):
+    """
+    Export a synthetic database to a snapshot, then time each snapshot.py
+    analytics helper over the memory-mapped columns against the same
+    aggregation in SQL, best of --repeat.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot.db")
+        directory = os.path.join(tmp, "snapshot")
+        datagen.generate(path, datagen.Generator(args.users, seed=args.seed))
+        conn = db.connect(path)
+        db_size = os.path.getsize(path)
+        start = time.perf_counter()
+        manifest = snapshot.export(conn, directory)
+        elapsed = time.perf_counter() - start
+        rows = sum(table["rows"] for table in manifest["tables"].values())
+        print(f"export {rows:,} rows in {elapsed:.2f}s: {_directory_size(directory):,} bytes "
+              f"(database {db_size:,} bytes with indexes and derived tables)")
+
+        start = time.perf_counter()
+        snap = snapshot.Snapshot.open(directory)
+        for table, info in snap.tables.items():
+            for name in info["columns"]:
+                snap.column(table, name)
+        print(f"open and map {sum(len(t['columns']) for t in snap.tables.values())} columns: "
+              f"{(time.perf_counter() - start) * 1000:.2f} ms; best of {args.repeat}")
+
+        params = {"limit": args.limit, "min_retweets": args.min_retweets}
+        helpers = {
+            "hashtag_counts": lambda: snapshot.hashtag_counts(snap, args.limit),
+            "follower_distribution": lambda: snapshot.follower_distribution(snap),
+            "spam_rates": lambda: snapshot.spam_rates(snap, args.min_retweets, args.limit),
+        }
+        ok = True
+        for name, helper in helpers.items():
+            timings = {}
+            for kind, run in (("sql", lambda: conn.execute(SNAPSHOT_QUERIES[name], params).fetchall()),
+                              ("snapshot", helper)):
+                best = float("inf")
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    result = [tuple(row) for row in run()]
+                    best = min(best, time.perf_counter() - start)
+                timings[kind] = (best, result)
+            same = timings["sql"][1] == timings["snapshot"][1]
+            ok = ok and same
+            print(f"{name:22} sql {timings['sql'][0] * 1000:8.2f} ms   "
+                  f"snapshot {timings['snapshot'][0] * 1000:8.2f} ms   "
+                  f"{timings['sql'][0] / timings['snapshot'][0]:5.1f}x   "
+                  f"{'same results' if same else 'DIFFERENT RESULTS'}")
+        snap.close()
+        conn.close()
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def _login_until(path, verifier, attempts, deadline, results):
+    """
+    Thread body for bench_logins: log in with random (usr, pwd) attempts
+    until deadline and append whether each one succeeded to results.
+    """
+    store = MicroTweetStore(db.connect(path, read_only=True), cache_entries=0,
+                            read_only=True, verifier=verifier)
+    rng = random.Random(threading.get_ident())
+    try:
+        while time.time() < deadline:
+            usr, pwd = rng.choice(attempts)
+            results.append(store.login(usr, pwd) is not None)
+    finally:
+        store.close()
+
+
+def _run_logins(path, verifier, attempts, threads, seconds):
+    results = [[] for _ in range(threads)]
+    deadline = time.time() + seconds
+    workers = [threading.Thread(target=_login_until,
+                                args=(path, verifier, attempts, deadline, r))
+               for r in results]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    verifier.close()
+    done = [ok for r in results for ok in r]
+    return len(done) / elapsed, sum(done), len(done)
+
+
+def bench_logins(args):
+    """
+    Logins/s from --threads threads against --users users: with the legacy
+    plaintext passwords, with hashed passwords for several hashing pool
+    sizes, and under a brute-force storm of wrong passwords against --targets
+    users with and without the failed-login cache.
+    """
+    hasher = credentials.hasher_from_args(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = scratch_copy(args.database_file, tmp)
+        conn = db.connect(path)
+        users = [(str(usr), pwd) for usr, pwd in conn.execute(
+                     "SELECT usr, pwd FROM users WHERE pwd IS NOT NULL ORDER BY random() LIMIT ?",
+                     (args.users,))
+                 if isinstance(credentials.identify(pwd), credentials.PlaintextHasher)]
+        print(f"{args.threads} threads, {len(users)} users, {args.seconds:g}s per run, "
+              f"{args.password_hash} hashes")
+
+        rate, ok, total = _run_logins(path, credentials.Verifier(hasher, 1), users,
+                                      args.threads, args.seconds)
+        print(f"plaintext rows          {rate:10,.1f} logins/s  ({ok:,}/{total:,} accepted)")
+
+        verifier = credentials.Verifier(hasher)
+        hashes = verifier.hash_many([pwd for _, pwd in users])
+        verifier.close()
+        with db.write_transaction(conn):
+            conn.executemany("UPDATE users SET pwd = ? WHERE usr = ?",
+                             [(h, usr) for h, (usr, _) in zip(hashes, users)])
+        conn.close()
+        for workers in args.workers:
+            rate, ok, total = _run_logins(path, credentials.Verifier(hasher, workers), users,
+                                          args.threads, args.seconds)
+            print(f"hashed, {workers:2} workers       {rate:10,.1f} logins/s  "
+                  f"({ok:,}/{total:,} accepted)")
+
+        # A storm against a few accounts, as from a password-guessing script.
+        wrong = [(usr, pwd + "x") for usr, pwd in users[:args.targets]]
+        for label, max_failures in (("no failed-login cache", 0),
+                                    ("failed-login cache", args.max_failed_logins)):
+            verifier = credentials.Verifier(
+                hasher, max(args.workers),
+                credentials.FailedLogins(max_failures, args.lockout_seconds))
+            rate, _, total = _run_logins(path, verifier, wrong, args.threads, args.seconds)
+            print(f"brute force, {label:22} {rate:10,.1f} attempts/s  "
+                  f"({verifier.stats['verifications']:,} of {total:,} hashed)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ids = commands.add_parser(
+        "ids", help="multi-process id allocation stress test")
+    ids.add_argument("database_file")
+    ids.add_argument("--processes", type=int, default=8)
+    ids.add_argument("--posts", type=int, default=200,
+                     help="tweets posted by each process")
+    ids.set_defaults(func=bench_ids)
+
+    concurrency = commands.add_parser(
+        "concurrency", help="concurrent readers and writers on one database")
+    concurrency.add_argument("database_file")
+    concurrency.add_argument("--readers", type=int, default=4)
+    concurrency.add_argument("--writers", type=int, default=2)
+    concurrency.add_argument("--seconds", type=float, default=5.0)
+    concurrency.set_defaults(func=bench_concurrency)
+
+    suite = commands.add_parser(
+        "suite", help="latency of every menu path on synthetic databases")
+    suite.add_argument("--scales", default="1000,10000",
+                       type=lambda v: [int(x) for x in v.split(",")],
+                       help="comma-separated user counts; each user writes "
+                            f"{datagen.DEFAULT_TWEETS_PER_USER} tweets on average "
+                            "(default: 1000,10000)")
+    suite.add_argument("--samples", type=int, default=50,
+                       help="calls per path and scale")
+    suite.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    suite.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(),
+                                                           "microtweet-bench"),
+                       help="where generated databases are kept between runs")
+    suite.add_argument("--out", default="bench_results.json")
+    suite.set_defaults(func=bench_suite)
+
+    server = commands.add_parser(
+        "server", help="sessions/s and tail latency of server.py under load")
+    server.add_argument("database_file")
+    server.add_argument("--sessions", type=int, default=32,
+                        help="concurrent client connections")
+    server.add_argument("--seconds", type=float, default=10.0)
+    server.add_argument("--readers", type=int, default=4)
+    server.add_argument("--group-size", type=int, default=256)
+    server.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    server.set_defaults(func=bench_server)
+
+    writes = commands.add_parser(
+        "writes", help="writes/s with and without the group-commit write queue")
+    writes.add_argument("database_file")
+    writes.add_argument("--threads", type=int, default=8,
+                        help="threads posting at once")
+    writes.add_argument("--seconds", type=float, default=5.0,
+                        help="run time per durability mode")
+    writes.add_argument("--flush-ms", type=float, default=writequeue.DEFAULT_FLUSH_MS)
+    writes.add_argument("--flush-ops", type=int, default=writequeue.DEFAULT_FLUSH_OPS)
+    db.add_connection_arguments(writes)
+    writes.set_defaults(func=bench_writes)
+
+    trend = commands.add_parser(
+        "trending", help="top hashtags from the rollup vs. GROUP BY over all mentions")
+    trend.add_argument("--mentions", type=int, default=2000000,
+                       help="approximate hashtag mentions to generate")
+    trend.add_argument("--users", type=int, default=10000)
+    trend.add_argument("--limit", type=int, default=trending.DEFAULT_LIMIT)
+    trend.add_argument("--repeat", type=int, default=5,
+                       help="runs per query; the best is reported")
+    trend.add_argument("--posts", type=int, default=2000,
+                       help="posts timed with and without the rollup triggers")
+    trend.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    trend.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(),
+                                                           "microtweet-bench"),
+                       help="where generated databases are kept between runs")
+    trend.set_defaults(func=bench_trending)
+
+    thread = commands.add_parser(
+        "threads", help="conversations from one recursive query vs. a query per tweet")
+    thread.add_argument("--deep", type=int, default=10000,
+                        help="replies in the chain thread")
+    thread.add_argument("--wide", type=int, default=10000,
+                        help="direct replies in the wide thread")
+    thread.add_argument("--bushy", type=int, default=20000,
+                        help="replies in the random tree thread")
+    thread.add_argument("--users", type=int, default=1000,
+                        help="users of the database the threads are added to")
+    thread.add_argument("--repeat", type=int, default=5,
+                        help="runs per conversation; the median is reported")
+    thread.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    thread.set_defaults(func=bench_threads)
+
+    graph = commands.add_parser(
+        "graph", help="bulk follows, joined follower lists and follow suggestions")
+    graph.add_argument("--users", type=int, default=20000)
+    graph.add_argument("--follows", type=int, default=500,
+                       help="users followed one at a time and in bulk")
+    graph.add_argument("--samples", type=int, default=200,
+                       help="users whose suggestions and mutuals are timed")
+    graph.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    graph.set_defaults(func=bench_graph)
+
+    lists = commands.add_parser(
+        "lists", help="favorite lists: bulk adds and the joined list query")
+    lists.add_argument("--lists", type=int, default=20)
+    lists.add_argument("--tweets-per-list", type=int, default=50)
+    lists.add_argument("--users", type=int, default=1000)
+    lists.add_argument("--repeat", type=int, default=5,
+                       help="reads of the lists; the median is reported")
+    lists.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    lists.set_defaults(func=bench_lists)
+
+    snap = commands.add_parser(
+        "snapshot", help="columnar snapshot analytics against the same SQL aggregations")
+    snap.add_argument("--users", type=int, default=10000)
+    snap.add_argument("--limit", type=int, default=snapshot.DEFAULT_LIMIT)
+    snap.add_argument("--min-retweets", type=int, default=snapshot.DEFAULT_MIN_RETWEETS)
+    snap.add_argument("--repeat", type=int, default=5)
+    snap.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    snap.set_defaults(func=bench_snapshot)
+
+    logins = commands.add_parser(
+        "logins", help="logins/s with plaintext and hashed passwords, and under brute force")
+    logins.add_argument("database_file")
+    logins.add_argument("--threads", type=int, default=8,
+                        help="threads logging in at once")
+    logins.add_argument("--seconds", type=float, default=3.0,
+                        help="run time per scenario")
+    logins.add_argument("--users", type=int, default=200,
+                        help="users whose passwords are hashed and tried")
+    logins.add_argument("--targets", type=int, default=4,
+                        help="users the brute-force run guesses passwords for")
+    logins.add_argument("--workers", default=f"1,{credentials.DEFAULT_WORKERS}",
+                        type=lambda v: [int(x) for x in v.split(",")],
+                        help="comma-separated hashing pool sizes to compare")
+    credentials.add_credential_arguments(logins)
+    logins.set_defaults(func=bench_logins)
+
+    args = parser.parse_args()
+    raise SystemExit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Size-bounded LRU caches with a time-to-live, for data a session reads over
+and over (user profiles opened from search results, tweets opened from a
+search). Caches are per process: writes made through the same
+MicroTweetStore invalidate the entries they affect, and writes by other
+processes become visible when an entry's TTL runs out.
+"""
+import collections
+import dataclasses
+import time
+
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 30.0      # seconds
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0      # dropped for space; expired entries count as misses
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LRUCache:
+    """
+    Up to max_entries values, each kept for at most ttl seconds. A
+    max_entries of 0 disables the cache: every lookup misses.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._entries = collections.OrderedDict()   # key -> (expires, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, load):
+        """
+        Return the cached value of key, or load() it and cache the result.
+        A None result means "not found" and is not cached, so a row another
+        connection creates shows up on the next lookup, not after the TTL.
+        """
+        entry = self._entries.get(key, self._MISSING)
+        if entry is not self._MISSING:
+            expires, value = entry
+            if expires > self.clock():
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return value
+            del self._entries[key]
+        self.stats.misses += 1
+        value = load()
+        if value is not None and self.max_entries > 0:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        for key in keys:
+            if self._entries.pop(key, self._MISSING) is not self._MISSING:
+                self.stats.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+
+def add_cache_arguments(parser):
+    """
+    Add the session cache options to an argparse parser.
+    """
+    group = parser.add_argument_group("cache")
+    group.add_argument("--cache-entries", type=int, metavar="N",
+                       default=DEFAULT_MAX_ENTRIES,
+                       help="entries per session cache, 0 to disable "
+                            f"(default: {DEFAULT_MAX_ENTRIES})")
+    group.add_argument("--cache-ttl", type=float, metavar="SECONDS",
+                       default=DEFAULT_TTL,
+                       help="how long a cached entry is trusted; bounds how "
+                            "stale another process's writes can look "
+                            f"(default: {DEFAULT_TTL:g})")
+
+
+def report(caches):
+    """
+    Return a table of the CacheStats of {name: LRUCache}.
+    """
+    lines = [f"{'cache':12} {'entries':>8} {'hits':>9} {'misses':>9} "
+             f"{'hit rate':>9} {'evicted':>8} {'invalidated':>12}"]
+    for name, c in caches.items():
+        s = c.stats
+        lines.append(f"{name:12} {len(c):>8,} {s.hits:>9,} {s.misses:>9,} "
+                     f"{s.hit_rate:>9.1%} {s.evictions:>8,} {s.invalidations:>12,}")
+    return "\n".join(lines)
@@ -0,0 +1,158 @@
+"""
+Rebuild and verify the tweet_stats / user_stats counters.
+
+The counters are kept up to date by triggers (see migrations.COUNTER_DDL). If
+they ever drift from the base tables, for example after rows were changed with
+the triggers dropped, this recomputes them:
+
+    python3 counters.py <database_file>            # report drift
+    python3 counters.py <database_file> --rebuild  # recompute from scratch
+"""
+import sqlite3
+import sys
+
+import migrations
+
+
+EXPECTED_TWEET_STATS = """
+    SELECT tid, SUM(retweets) AS retweets, SUM(replies) AS replies
+    FROM (
+        SELECT tid, COUNT(*) AS retweets, 0 AS replies
+        FROM retweets
+        WHERE tid IS NOT NULL
+        GROUP BY tid
+        UNION ALL
+        SELECT replyto_tid, 0, COUNT(*)
+        FROM tweets
+        WHERE replyto_tid IS NOT NULL
+        GROUP BY replyto_tid
+    )
+    GROUP BY tid
+"""
+
+EXPECTED_USER_STATS = """
+    SELECT usr, SUM(tweets) AS tweets, SUM(following) AS following,
+           SUM(followers) AS followers
+    FROM (
+        SELECT writer_id AS usr, COUNT(*) AS tweets, 0 AS following, 0 AS followers
+        FROM tweets
+        WHERE writer_id IS NOT NULL
+        GROUP BY writer_id
+        UNION ALL
+        SELECT flwer, 0, COUNT(*), 0
+        FROM follows
+        WHERE flwer IS NOT NULL
+        GROUP BY flwer
+        UNION ALL
+        SELECT flwee, 0, 0, COUNT(*)
+        FROM follows
+        WHERE flwee IS NOT NULL
+        GROUP BY flwee
+    )
+    GROUP BY usr
+"""
+
+# Rows that differ between the expected counts and the stored ones. All-zero
+# stored rows are ignored, since a missing row also means zero.
+TWEET_DRIFT_QUERY = f"""
+    WITH expected AS ({EXPECTED_TWEET_STATS}),
+    actual AS (
+        SELECT tid, retweets, replies FROM tweet_stats
+        WHERE retweets != 0 OR replies != 0
+    )
+    SELECT tid FROM (SELECT * FROM expected EXCEPT SELECT * FROM actual)
+    UNION
+    SELECT tid FROM (SELECT * FROM actual EXCEPT SELECT * FROM expected)
+"""
+
+USER_DRIFT_QUERY = f"""
+    WITH expected AS ({EXPECTED_USER_STATS}),
+    actual AS (
+        SELECT usr, tweets, following, followers FROM user_stats
+        WHERE tweets != 0 OR following != 0 OR followers != 0
+    )
+    SELECT usr FROM (SELECT * FROM expected EXCEPT SELECT * FROM actual)
+    UNION
+    SELECT usr FROM (SELECT * FROM actual EXCEPT SELECT * FROM expected)
+"""
+
+
+def rebuild(conn):
+    """
+    Recompute both counter tables from the base tables. Runs inside the
+    caller's transaction; the caller commits.
+    """
+    conn.execute("DELETE FROM tweet_stats")
+    conn.execute(
+        f"INSERT INTO tweet_stats(tid, retweets, replies) {EXPECTED_TWEET_STATS}")
+    conn.execute("DELETE FROM user_stats")
+    conn.execute(
+        "INSERT INTO user_stats(usr, tweets, following, followers) "
+        f"{EXPECTED_USER_STATS}")
+
+
+def verify(conn):
+    """
+    Return (drifted tids, drifted user ids); both empty when the counters
+    match the base tables.
+    """
+    tids = [row[0] for row in conn.execute(TWEET_DRIFT_QUERY)]
+    users = [row[0] for row in conn.execute(USER_DRIFT_QUERY)]
+    return tids, users
+
+
+TWEET_COUNTS_QUERY = "SELECT retweets, replies FROM tweet_stats WHERE tid=?"
+USER_COUNTS_QUERY = "SELECT tweets, following, followers FROM user_stats WHERE usr=?"
+
+
+def tweet_counts(conn, tid):
+    """
+    Return (# retweets, # replies) of tid.
+    """
+    row = conn.execute(TWEET_COUNTS_QUERY, (tid,)).fetchone()
+    return row if row else (0, 0)
+
+
+def user_counts(conn, user_id):
+    """
+    Return (# tweets, # following, # followers) of user_id.
+    """
+    row = conn.execute(USER_COUNTS_QUERY, (user_id,)).fetchone()
+    return row if row else (0, 0, 0)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python3 counters.py <database_file> [--rebuild]")
+        sys.exit(1)
+
+    conn = sqlite3.connect(sys.argv[1])
+    migrations.migrate(conn)
+
+    if "--rebuild" in sys.argv[2:]:
+        try:
+            conn.execute("BEGIN")
+            rebuild(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print("Counters rebuilt.")
+
+    tids, users = verify(conn)
+    conn.close()
+    if not tids and not users:
+        print("Counters are consistent.")
+        return
+    if tids:
+        print(f"{len(tids)} tweet counter(s) drifted: "
+              + ", ".join(str(t) for t in tids))
+    if users:
+        print(f"{len(users)} user counter(s) drifted: "
+              + ", ".join(str(u) for u in users))
+    print("Run with --rebuild to recompute them.")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
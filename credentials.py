@@ -0,0 +1,344 @@
+"""
+Password hashing and verification.
+
+users.pwd holds an encoded hash that names its own scheme and cost:
+
+    scrypt$n=16384,r=8,p=1$<salt>$<hash>
+    pbkdf2_sha256$600000$<salt>$<hash>
+
+Anything else, including a value that only looks like a hash of either
+scheme, is a legacy plaintext password. It is still accepted, and a
+writable store replaces it with a hash of the configured scheme the first
+time its owner logs in (as it does for hashes of an older scheme or cost).
+Hashing is slow on purpose. It runs on a pool of worker threads (hashlib
+releases the GIL while it hashes), which only helps callers that hash
+concurrently: server readers, whose logins then use at most --hash-workers
+cores, and hash_many. A single login or signup still waits for its hash, so
+the interactive menu blocks for it. A FailedLogins cache turns away a user's
+logins after too many failures without hashing anything.
+
+    python3 twitter.py <database_file> --password-hash pbkdf2 --pbkdf2-iterations 600000
+    python3 credentials.py <database_file>              # count legacy passwords
+    python3 credentials.py <database_file> --upgrade    # hash them all now
+"""
+import argparse
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+
+import db
+import migrations
+
+
+DEFAULT_SCHEME = "scrypt"
+DEFAULT_SCRYPT_N = 2 ** 14
+DEFAULT_PBKDF2_ITERATIONS = 600000
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_MAX_FAILURES = 5
+DEFAULT_LOCKOUT = 300.0     # seconds
+SALT_BYTES = 16
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+class ScryptHasher:
+    prefix = "scrypt"
+
+    def __init__(self, n=DEFAULT_SCRYPT_N, r=8, p=1):
+        self.n, self.r, self.p = n, r, p
+
+    def hash(self, password, salt=None):
+        salt = salt if salt is not None else os.urandom(SALT_BYTES)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{self.prefix}$n={self.n},r={self.r},p={self.p}${_b64(salt)}${_b64(key)}"
+
+    @staticmethod
+    def parse(encoded):
+        """
+        Return (salt, key, n, r, p) of encoded; raise ValueError or KeyError
+        if it is not a well-formed scrypt hash.
+        """
+        _, params, salt, key = encoded.split("$")
+        cost = dict(item.split("=") for item in params.split(","))
+        return _unb64(salt), _unb64(key), int(cost["n"]), int(cost["r"]), int(cost["p"])
+
+    def verify(self, password, encoded):
+        salt, key, n, r, p = self.parse(encoded)
+        return hmac.compare_digest(self._derive(password, salt, n, r, p), key)
+
+    def is_current(self, encoded):
+        return encoded.split("$")[1] == f"n={self.n},r={self.r},p={self.p}"
+
+    @staticmethod
+    def _derive(password, salt, n, r, p):
+        return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + 2 ** 20, dklen=32)
+
+
+class Pbkdf2Hasher:
+    prefix = "pbkdf2_sha256"
+
+    def __init__(self, iterations=DEFAULT_PBKDF2_ITERATIONS):
+        self.iterations = iterations
+
+    def hash(self, password, salt=None):
+        salt = salt if salt is not None else os.urandom(SALT_BYTES)
+        key = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, self.iterations)
+        return f"{self.prefix}${self.iterations}${_b64(salt)}${_b64(key)}"
+
+    @staticmethod
+    def parse(encoded):
+        """
+        Return (salt, key, iterations) of encoded; raise ValueError if it is
+        not a well-formed PBKDF2 hash.
+        """
+        _, iterations, salt, key = encoded.split("$")
+        return _unb64(salt), _unb64(key), int(iterations)
+
+    def verify(self, password, encoded):
+        salt, key, iterations = self.parse(encoded)
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+        return hmac.compare_digest(derived, key)
+
+    def is_current(self, encoded):
+        return encoded.split("$")[1] == str(self.iterations)
+
+
+class PlaintextHasher:
+    """
+    Legacy rows: the password as typed. Never used to store new passwords.
+    """
+    prefix = None
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(password.encode("utf-8"), encoded.encode("utf-8"))
+
+    def is_current(self, encoded):
+        return False
+
+
+HASHERS = {"scrypt": ScryptHasher, "pbkdf2": Pbkdf2Hasher}
+_BY_PREFIX = {cls.prefix: cls for cls in HASHERS.values()}
+
+
+def identify(encoded):
+    """
+    Return a hasher that can verify encoded, PlaintextHasher for legacy rows
+    (and for values that merely start like a hash but do not parse as one).
+    """
+    prefix = encoded.split("$", 1)[0] if encoded.count("$") == 3 else None
+    if prefix not in _BY_PREFIX:
+        return PlaintextHasher()
+    hasher = _BY_PREFIX[prefix]()
+    try:
+        hasher.parse(encoded)
+    except (ValueError, KeyError):      # binascii.Error is a ValueError
+        return PlaintextHasher()
+    return hasher
+
+
+class FailedLogins:
+    """
+    Failed login counts of up to max_entries users. A user with
+    max_failures failures, the last less than lockout seconds ago, is
+    blocked until then; a successful login clears the count.
+    """
+
+    def __init__(self, max_failures=DEFAULT_MAX_FAILURES, lockout=DEFAULT_LOCKOUT,
+                 max_entries=100000, clock=time.monotonic):
+        self.max_failures = max_failures
+        self.lockout = lockout
+        self.max_entries = max_entries
+        self.clock = clock
+        self.blocked_attempts = 0
+        self._failures = collections.OrderedDict()     # usr -> (count, last failure)
+        self._lock = threading.Lock()
+
+    def blocked(self, usr):
+        with self._lock:
+            entry = self._failures.get(usr)
+            if entry is None or not self.max_failures:
+                return False
+            count, last = entry
+            if self.clock() - last >= self.lockout:
+                del self._failures[usr]
+                return False
+            if count >= self.max_failures:
+                self.blocked_attempts += 1
+                return True
+            return False
+
+    def failed(self, usr):
+        with self._lock:
+            count, _ = self._failures.pop(usr, (0, 0.0))
+            self._failures[usr] = (count + 1, self.clock())
+            if len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, usr):
+        with self._lock:
+            self._failures.pop(usr, None)
+
+
+class Verifier:
+    """
+    Hashes and checks passwords on a pool of worker threads with hasher
+    (a ScryptHasher or Pbkdf2Hasher), and tracks FailedLogins. One Verifier
+    can be shared by every store of a process, so that their concurrent
+    hashes share the pool. hash and verify block their caller until the
+    hash is done.
+    """
+
+    def __init__(self, hasher=None, workers=DEFAULT_WORKERS, failed_logins=None):
+        self.hasher = hasher if hasher is not None else ScryptHasher()
+        self.failed_logins = failed_logins if failed_logins is not None else FailedLogins()
+        self.stats = {"hashes": 0, "verifications": 0}
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix="credentials")
+        self._dummy_hash = None
+        self._dummy_lock = threading.Lock()
+
+    def hash(self, password):
+        """
+        Return the encoded hash of password under the current scheme,
+        once a worker has computed it.
+        """
+        self.stats["hashes"] += 1
+        return self._pool.submit(self.hasher.hash, password).result()
+
+    def hash_many(self, passwords):
+        """
+        Return the encoded hashes of passwords, hashed in parallel.
+        """
+        self.stats["hashes"] += len(passwords)
+        return list(self._pool.map(self.hasher.hash, passwords))
+
+    def verify(self, password, encoded):
+        """
+        Return (matches, needs_rehash) for password against a stored pwd.
+        Every call costs one hash of the current scheme or more, whatever
+        is stored.
+        """
+        hasher = identify(encoded)
+        if not isinstance(hasher, PlaintextHasher):
+            self.stats["verifications"] += 1
+            try:
+                matches = self._pool.submit(hasher.verify, password, encoded).result()
+            except (ValueError, OverflowError):
+                # Parses, but with a cost hashlib refuses: not one of our
+                # hashes, so it can only be a legacy password.
+                hasher = PlaintextHasher()
+        if isinstance(hasher, PlaintextHasher):
+            # As slow as a hash, so that legacy users are not told apart.
+            self.verify_missing(password)
+            matches = hasher.verify(password, encoded)
+        return matches, matches and (type(hasher) is not type(self.hasher)
+                                     or not self.hasher.is_current(encoded))
+
+    def verify_missing(self, password):
+        """
+        Check password against a hash that matches nothing, for logins of
+        users who do not exist or have no password, so that they take as
+        long as a wrong password and do not reveal which ids exist.
+        """
+        with self._dummy_lock:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hasher.hash(os.urandom(SALT_BYTES).hex())
+        self.verify(password, self._dummy_hash)
+
+    def close(self):
+        self._pool.shutdown()
+
+
+def add_credential_arguments(parser):
+    """
+    Add the password hashing options to an argparse parser.
+    """
+    group = parser.add_argument_group("passwords")
+    group.add_argument("--password-hash", choices=HASHERS, default=DEFAULT_SCHEME,
+                       help=f"scheme for new and rehashed passwords (default: {DEFAULT_SCHEME})")
+    group.add_argument("--scrypt-n", type=int, default=DEFAULT_SCRYPT_N,
+                       help=f"scrypt CPU/memory cost, a power of 2 (default: {DEFAULT_SCRYPT_N})")
+    group.add_argument("--pbkdf2-iterations", type=int, default=DEFAULT_PBKDF2_ITERATIONS,
+                       help=f"PBKDF2-SHA256 iterations (default: {DEFAULT_PBKDF2_ITERATIONS})")
+    group.add_argument("--hash-workers", type=int, default=DEFAULT_WORKERS,
+                       help=f"password hashing threads (default: {DEFAULT_WORKERS})")
+    group.add_argument("--max-failed-logins", type=int, default=DEFAULT_MAX_FAILURES,
+                       help="failures after which a user's logins are refused "
+                            f"without checking, 0 for no limit (default: {DEFAULT_MAX_FAILURES})")
+    group.add_argument("--lockout-seconds", type=float, default=DEFAULT_LOCKOUT,
+                       help=f"how long that lasts (default: {DEFAULT_LOCKOUT:g})")
+
+
+def hasher_from_args(args):
+    if args.password_hash == "pbkdf2":
+        return Pbkdf2Hasher(args.pbkdf2_iterations)
+    return ScryptHasher(args.scrypt_n)
+
+
+def verifier_from_args(args):
+    """
+    The Verifier configured by add_credential_arguments.
+    """
+    return Verifier(hasher_from_args(args), args.hash_workers,
+                    FailedLogins(args.max_failed_logins, args.lockout_seconds))
+
+
+LEGACY_PASSWORDS_QUERY = "SELECT usr, pwd FROM users WHERE pwd IS NOT NULL"
+
+
+def upgrade(conn, verifier, batch_size=1000):
+    """
+    Hash every legacy plaintext password now instead of at its owner's next
+    login, batch_size users per transaction. Returns the number hashed.
+    """
+    rows = [(usr, pwd) for usr, pwd in conn.execute(LEGACY_PASSWORDS_QUERY)
+            if isinstance(identify(pwd), PlaintextHasher)]
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        hashes = verifier.hash_many([pwd for _, pwd in batch])
+        with db.write_transaction(conn):
+            conn.executemany("UPDATE users SET pwd = ? WHERE usr = ?",
+                             [(h, usr) for h, (usr, _) in zip(hashes, batch)])
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report or upgrade the legacy plaintext passwords of a database.")
+    parser.add_argument("database_file")
+    parser.add_argument("--upgrade", action="store_true",
+                        help="hash every plaintext password now")
+    add_credential_arguments(parser)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database_file)
+    migrations.migrate(conn)
+    schemes = collections.Counter(
+        identify(pwd).prefix or "plaintext"
+        for _, pwd in conn.execute(LEGACY_PASSWORDS_QUERY))
+    for scheme, count in sorted(schemes.items()):
+        print(f"{scheme:16} {count:>9,}")
+    if args.upgrade:
+        verifier = verifier_from_args(args)
+        start = time.perf_counter()
+        count = upgrade(conn, verifier)
+        verifier.close()
+        print(f"Hashed {count:,} passwords in {time.perf_counter() - start:.1f}s")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
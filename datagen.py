@@ -0,0 +1,236 @@
+"""
+Synthetic microtweet databases for benchmarking.
+
+    python3 datagen.py <new_database_file> --users 50000 --tweets 1000000 --seed 42
+
+Popularity follows a power law: a few users have most of the followers and a
+few users write most of the tweets, and hashtag and word frequencies are
+Zipf-distributed. The same arguments and seed always produce the same data.
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import os
+import random
+import sqlite3
+import time
+
+import db
+import importer
+import migrations
+import store
+
+
+DEFAULT_SEED = 42
+DEFAULT_USERS = 1000
+DEFAULT_TWEETS_PER_USER = 20
+DEFAULT_FOLLOWS_PER_USER = 20
+DEFAULT_RETWEET_RATIO = 0.2
+DEFAULT_REPLY_RATIO = 0.1
+HASHTAG_PROBABILITY = 0.3
+SPAM_PROBABILITY = 0.02
+ZIPF_EXPONENT = 1.1
+
+VOCABULARY_SIZE = 5000
+HASHTAG_VOCABULARY_SIZE = 2000
+SYLLABLES = ["ka", "lo", "mi", "ra", "tu", "ne", "so", "vi", "da", "pe",
+             "ro", "xi", "an", "el", "or", "us", "ty", "qu", "ba", "zo"]
+
+# Tweets are spread over the year before this date; a fixed date keeps the
+# output independent of when it was generated.
+END_DATE = datetime.date(2025, 1, 1)
+DAYS = 365
+
+
+class Zipf:
+    """
+    Draw indexes 0..n-1 with probability proportional to 1 / (rank ** s),
+    where rank is the index's position in a seeded random permutation.
+    """
+
+    def __init__(self, rng, n, s=ZIPF_EXPONENT):
+        self.rng = rng
+        self.ranked = list(range(n))
+        rng.shuffle(self.ranked)
+        self.cum_weights = list(itertools.accumulate(
+            1.0 / (rank ** s) for rank in range(1, n + 1)))
+        self.total = self.cum_weights[-1]
+
+    def draw(self):
+        pick = self.rng.random() * self.total
+        rank = bisect.bisect_left(self.cum_weights, pick)
+        return self.ranked[min(rank, len(self.ranked) - 1)]
+
+
+def _word(rng, syllables):
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+class Generator:
+    """
+    Row generators for each table, in importer.TABLE_COLUMNS order.
+    Users are numbered 1..users and tweets 1..tweets.
+    """
+
+    def __init__(self, users=DEFAULT_USERS, tweets=None,
+                 follows_per_user=DEFAULT_FOLLOWS_PER_USER,
+                 retweet_ratio=DEFAULT_RETWEET_RATIO,
+                 reply_ratio=DEFAULT_REPLY_RATIO, seed=DEFAULT_SEED):
+        self.users = users
+        self.tweets = tweets if tweets is not None else users * DEFAULT_TWEETS_PER_USER
+        self.follows_per_user = follows_per_user
+        self.retweet_ratio = retweet_ratio
+        self.reply_ratio = reply_ratio
+        self.seed = seed
+
+        rng = random.Random(seed)
+        self.vocabulary = [_word(rng, rng.randint(1, 4)) for _ in range(VOCABULARY_SIZE)]
+        self.hashtags = [_word(rng, rng.randint(2, 4)) for _ in range(HASHTAG_VOCABULARY_SIZE)]
+
+    def _rng(self, table):
+        # One stream per table, so changing one table's generator does not
+        # reshuffle the others.
+        return random.Random(f"{self.seed}:{table}")
+
+    def user_rows(self):
+        rng = self._rng("users")
+        for usr in range(1, self.users + 1):
+            name = " ".join(_word(rng, rng.randint(1, 3)).capitalize()
+                            for _ in range(rng.randint(1, 3)))
+            yield (usr, name, f"user{usr}@example.com",
+                   5550000000 + usr, f"pw{usr}")
+
+    def follow_rows(self):
+        rng = self._rng("follows")
+        popularity = Zipf(rng, self.users)
+        for flwer in range(1, self.users + 1):
+            count = min(self.users - 1,
+                        int(rng.expovariate(1 / self.follows_per_user)))
+            followees = set()
+            for _ in range(count * 2):
+                if len(followees) >= count:
+                    break
+                flwee = popularity.draw() + 1
+                if flwee != flwer:
+                    followees.add(flwee)
+            for flwee in sorted(followees):
+                yield (flwer, flwee, self._date(rng))
+
+    def tweet_rows(self):
+        rng = self._rng("tweets")
+        activity = Zipf(rng, self.users)
+        words = Zipf(rng, len(self.vocabulary))
+        tags = Zipf(rng, len(self.hashtags))
+        for tid in range(1, self.tweets + 1):
+            text = " ".join(self.vocabulary[words.draw()]
+                            for _ in range(rng.randint(3, 12)))
+            if rng.random() < HASHTAG_PROBABILITY:
+                text += " " + " ".join("#" + self.hashtags[tags.draw()]
+                                       for _ in range(rng.randint(1, 2)))
+            replyto = None
+            if tid > 1 and rng.random() < self.reply_ratio:
+                replyto = rng.randint(max(1, tid - 1000), tid - 1)
+            yield (tid, activity.draw() + 1, text, self._date(rng),
+                   self._time(rng), replyto)
+
+    def hashtag_rows(self):
+        # Re-derived from the tweet text, the same way compose_tweet does.
+        for tid, _, text, _, _, _ in self.tweet_rows():
+            for term in store.extract_hashtags(text):
+                yield (tid, term)
+
+    def retweet_rows(self):
+        rng = self._rng("retweets")
+        activity = Zipf(rng, self.users)
+        writers = {}
+        for tid, writer_id, _, _, _, _ in self.tweet_rows():
+            writers[tid] = writer_id
+        for _ in range(int(self.tweets * self.retweet_ratio)):
+            tid = rng.randint(1, self.tweets)
+            spam = 1 if rng.random() < SPAM_PROBABILITY else 0
+            yield (tid, activity.draw() + 1, writers[tid], spam, self._date(rng))
+
+    def list_rows(self):
+        rng = self._rng("lists")
+        for owner in range(1, self.users + 1, 10):
+            for i in range(rng.randint(1, 3)):
+                yield (owner, f"list{i + 1}")
+
+    def include_rows(self):
+        rng = self._rng("include")
+        for owner, lname in self.list_rows():
+            for tid in sorted({rng.randint(1, self.tweets)
+                               for _ in range(rng.randint(0, 10))}):
+                yield (owner, lname, tid)
+
+    def sources(self):
+        return {
+            "users": self.user_rows(),
+            "tweets": self.tweet_rows(),
+            "retweets": self.retweet_rows(),
+            "follows": self.follow_rows(),
+            "hashtag_mentions": self.hashtag_rows(),
+            "lists": self.list_rows(),
+            "include": self.include_rows(),
+        }
+
+    @staticmethod
+    def _date(rng):
+        return (END_DATE - datetime.timedelta(days=rng.randrange(DAYS))).isoformat()
+
+    @staticmethod
+    def _time(rng):
+        seconds = rng.randrange(24 * 60 * 60)
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def generate(path, generator):
+    """
+    Create a new database at path filled by generator. Returns the importer
+    stats.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    conn = db.connect(path)
+    try:
+        migrations.create_database(conn)
+        # Retweets of the same tweet by the same user collapse into one row.
+        return importer.import_rows(conn, generator.sources(), on_conflict="ignore")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic microtweet database.")
+    parser.add_argument("database_file", help="path of the new database")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--tweets", type=int,
+                        help=f"default: {DEFAULT_TWEETS_PER_USER} per user")
+    parser.add_argument("--follows-per-user", type=int,
+                        default=DEFAULT_FOLLOWS_PER_USER,
+                        help="mean number of followees")
+    parser.add_argument("--retweet-ratio", type=float,
+                        default=DEFAULT_RETWEET_RATIO)
+    parser.add_argument("--reply-ratio", type=float,
+                        default=DEFAULT_REPLY_RATIO)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    generator = Generator(args.users, args.tweets, args.follows_per_user,
+                          args.retweet_ratio, args.reply_ratio, args.seed)
+    start = time.perf_counter()
+    try:
+        stats = generate(args.database_file, generator)
+    except (FileExistsError, sqlite3.Error) as e:
+        print(f"Error generating database: {e}")
+        raise SystemExit(1)
+    for table, rows, _ in stats:
+        if rows:
+            print(f"{table:20} {rows:>12,}")
+    print(f"Generated in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
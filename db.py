@@ -0,0 +1,160 @@
+"""
+Connection and transaction helpers shared by twitter.py and the tools.
+"""
+import contextlib
+import os
+import sqlite3
+import urllib.parse
+
+
+JOURNAL_MODES = ["wal", "delete", "truncate", "persist", "memory", "off"]
+SYNCHRONOUS_MODES = ["off", "normal", "full", "extra"]
+
+DEFAULT_JOURNAL_MODE = "wal"
+DEFAULT_BUSY_TIMEOUT = 5000             # ms
+DEFAULT_SYNCHRONOUS = "normal"
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024   # bytes
+DEFAULT_CACHE_SIZE = -64 * 1024         # negative: KiB, i.e. 64 MiB
+DEFAULT_CACHED_STATEMENTS = 256         # compiled statements kept per connection
+
+
+def connect(db_name,
+            journal_mode=DEFAULT_JOURNAL_MODE,
+            busy_timeout=DEFAULT_BUSY_TIMEOUT,
+            synchronous=DEFAULT_SYNCHRONOUS,
+            mmap_size=DEFAULT_MMAP_SIZE,
+            cache_size=DEFAULT_CACHE_SIZE,
+            cached_statements=DEFAULT_CACHED_STATEMENTS,
+            read_only=False):
+    """
+    Open db_name tuned for several processes sharing it.
+    In WAL mode readers never block on a writer and a writer never blocks
+    readers; only writers queue behind each other, for up to busy_timeout ms
+    instead of failing at once with "database is locked". synchronous=NORMAL
+    is safe with WAL (a power loss can drop the last commits but never
+    corrupts the file) and saves an fsync per commit.
+    cached_statements is the size of sqlite3's per-connection cache of
+    compiled statements, keyed by SQL text; it should hold every query in
+    store.QUERIES so none of them is compiled twice.
+    A read_only connection cannot write and leaves the journal mode as the
+    file has it; open a writable connection first to switch it to WAL.
+    """
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unknown journal mode: {journal_mode}")
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unknown synchronous mode: {synchronous}")
+
+    if read_only:
+        uri = "file:" + urllib.parse.quote(os.path.abspath(db_name)) + "?mode=ro"
+        # Read-only connections are usually pooled; allow the pool's owner
+        # to close them from another thread.
+        conn = sqlite3.connect(uri, uri=True, timeout=busy_timeout / 1000,
+                               cached_statements=cached_statements,
+                               check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_name, timeout=busy_timeout / 1000,
+                               cached_statements=cached_statements)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    if not read_only:
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = {int(cache_size)}")
+    return conn
+
+
+def add_connection_arguments(parser):
+    """
+    Add the connect() options to an argparse parser.
+    """
+    group = parser.add_argument_group("connection")
+    group.add_argument("--journal-mode", choices=JOURNAL_MODES,
+                       default=DEFAULT_JOURNAL_MODE,
+                       help=f"SQLite journal mode (default: {DEFAULT_JOURNAL_MODE})")
+    group.add_argument("--busy-timeout", type=int, metavar="MS",
+                       default=DEFAULT_BUSY_TIMEOUT,
+                       help="how long to wait for a lock held by another "
+                            f"process (default: {DEFAULT_BUSY_TIMEOUT})")
+    group.add_argument("--synchronous", choices=SYNCHRONOUS_MODES,
+                       default=DEFAULT_SYNCHRONOUS,
+                       help=f"PRAGMA synchronous (default: {DEFAULT_SYNCHRONOUS})")
+    group.add_argument("--mmap-size", type=int, metavar="BYTES",
+                       default=DEFAULT_MMAP_SIZE,
+                       help=f"PRAGMA mmap_size (default: {DEFAULT_MMAP_SIZE})")
+    group.add_argument("--cache-size", type=int, metavar="N",
+                       default=DEFAULT_CACHE_SIZE,
+                       help="PRAGMA cache_size, pages or -KiB "
+                            f"(default: {DEFAULT_CACHE_SIZE})")
+    group.add_argument("--cached-statements", type=int, metavar="N",
+                       default=DEFAULT_CACHED_STATEMENTS,
+                       help="compiled statements cached per connection "
+                            f"(default: {DEFAULT_CACHED_STATEMENTS})")
+
+
+def connection_options(args):
+    """
+    The connect() keyword arguments parsed by add_connection_arguments.
+    """
+    return dict(journal_mode=args.journal_mode,
+                busy_timeout=args.busy_timeout,
+                synchronous=args.synchronous,
+                mmap_size=args.mmap_size,
+                cache_size=args.cache_size,
+                cached_statements=args.cached_statements)
+
+
+def connect_from_args(db_name, args):
+    """
+    connect() with the options parsed by add_connection_arguments.
+    """
+    return connect(db_name, **connection_options(args))
+
+
+@contextlib.contextmanager
+def write_transaction(conn):
+    """
+    Run the body in a BEGIN IMMEDIATE transaction, committing on success and
+    rolling back on error. IMMEDIATE takes the write lock up front, so two
+    processes can never both read state (such as the next id) and then race
+    to write it; the second one waits for the lock instead.
+    Inside an already open transaction the body simply joins it, and the
+    outer owner commits or rolls back.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# Largest id already used for each sequence. 'x < ""' selects the numeric
+# keys only (numbers sort before text in SQLite) and still lets the max be
+# read from the end of the primary-key index.
+SEQUENCE_SOURCES = {
+    "tweets": "SELECT MAX(tid) FROM tweets WHERE tid < ''",
+    "users": "SELECT MAX(usr) FROM users WHERE usr < ''",
+}
+
+
+def allocate_id(conn, name):
+    """
+    Return the next id of sequence name ('tweets' or 'users') and advance it.
+    Must be called inside write_transaction, so the increment and the insert
+    that uses the id commit together. Ids written by anything that bypassed
+    the sequence are skipped over.
+    """
+    used = conn.execute(SEQUENCE_SOURCES[name]).fetchone()[0]
+    used = int(used) if used is not None else 0
+    conn.execute("""
+        INSERT INTO sequences(name, next_id) VALUES (?, ? + 2)
+        ON CONFLICT(name) DO UPDATE SET next_id = MAX(next_id, excluded.next_id - 1) + 1
+    """, (name, used))
+    row = conn.execute(
+        "SELECT next_id - 1 FROM sequences WHERE name = ?", (name,)).fetchone()
+    return row[0]
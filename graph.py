@@ -0,0 +1,126 @@
+"""
+The follow graph: bulk follows, mutual follows and who-to-follow suggestions.
+
+Follows and unfollows take a whole list of users at once. The list is bound
+as one JSON array and expanded with json_each, so following 500 users is one
+INSERT OR IGNORE on the (flwer, flwee) primary key in one transaction, not a
+SELECT and an INSERT per user. Users already followed, unknown users and the
+user themself are skipped.
+
+Suggestions are friends of friends: the users followed by the most of a
+user's followees, through the follows primary key, ties broken by follower
+count. Follower and followee lists come with each user's name and counts
+from user_stats in the same query.
+
+    python3 graph.py <database_file> <user> --suggestions [--limit 10]
+    python3 graph.py <database_file> <user> --mutuals
+    python3 graph.py <database_file> <user> --follow 12,40,41
+    python3 graph.py <database_file> <user> --unfollow 12,40
+"""
+import argparse
+
+
+DEFAULT_SUGGESTIONS = 10
+
+# Parameters: :user, :users (JSON array of user ids), :start_date.
+FOLLOW_MANY_QUERY = """
+    INSERT OR IGNORE INTO follows(flwer, flwee, start_date)
+    SELECT DISTINCT :user, u.usr, :start_date
+    FROM json_each(:users) AS j JOIN users AS u ON u.usr = j.value
+    WHERE u.usr != :user
+"""
+
+UNFOLLOW_MANY_QUERY = """
+    DELETE FROM follows
+    WHERE flwer = :user AND flwee IN (SELECT value FROM json_each(:users))
+"""
+
+# Users who follow :user and whom :user follows back.
+MUTUALS_QUERY = """
+    SELECT u.usr, u.name
+    FROM follows AS f
+    JOIN follows AS back ON back.flwer = f.flwee AND back.flwee = f.flwer
+    JOIN users AS u ON u.usr = f.flwee
+    WHERE f.flwer = :user
+    ORDER BY u.usr
+"""
+
+# Users followed by :user's followees that :user does not follow yet, with
+# how many of the followees follow each one.
+SUGGESTIONS_QUERY = """
+    SELECT f2.flwee AS usr, u.name, COUNT(*) AS via, COALESCE(s.followers, 0) AS followers
+    FROM follows AS f1
+    JOIN follows AS f2 ON f2.flwer = f1.flwee
+    JOIN users AS u ON u.usr = f2.flwee
+    LEFT JOIN user_stats AS s ON s.usr = f2.flwee
+    WHERE f1.flwer = :user
+      AND f2.flwee != :user
+      AND NOT EXISTS (SELECT 1 FROM follows WHERE flwer = :user AND flwee = f2.flwee)
+    GROUP BY f2.flwee
+    ORDER BY via DESC, followers DESC, usr
+    LIMIT :limit
+"""
+
+# A page of :user's followers ({user_column} = flwer, through
+# idx_follows_flwee) or followees (flwee, through the primary key), each with
+# their name, their counts and whether :viewer follows them.
+USER_LIST_QUERY = """
+    SELECT f.{user_column}, u.name,
+           COALESCE(s.tweets, 0), COALESCE(s.following, 0), COALESCE(s.followers, 0),
+           EXISTS (SELECT 1 FROM follows
+                   WHERE flwer = :viewer AND flwee = f.{user_column})
+    FROM follows AS f
+    LEFT JOIN users AS u ON u.usr = f.{user_column}
+    LEFT JOIN user_stats AS s ON s.usr = f.{user_column}
+    WHERE f.{key_column} = :user
+    ORDER BY f.{user_column}
+    LIMIT :limit OFFSET :offset
+"""
+FOLLOWERS_QUERY = USER_LIST_QUERY.format(user_column="flwer", key_column="flwee")
+FOLLOWING_QUERY = USER_LIST_QUERY.format(user_column="flwee", key_column="flwer")
+
+
+def main():
+    # Imported here because store imports this module.
+    from store import MicroTweetStore
+
+    parser = argparse.ArgumentParser(
+        description="Follow suggestions, mutual follows and bulk (un)follows for a user.")
+    parser.add_argument("database_file")
+    parser.add_argument("user")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--suggestions", action="store_true",
+                        help="users to follow, from the user's followees' followees")
+    action.add_argument("--mutuals", action="store_true",
+                        help="users who follow the user and are followed back")
+    action.add_argument("--follow", metavar="IDS",
+                        help="comma-separated user ids to follow")
+    action.add_argument("--unfollow", metavar="IDS",
+                        help="comma-separated user ids to unfollow")
+    parser.add_argument("--limit", type=int, default=DEFAULT_SUGGESTIONS)
+    args = parser.parse_args()
+
+    store = MicroTweetStore.open(args.database_file)
+    try:
+        if args.suggestions:
+            suggestions = store.follow_suggestions(args.user, args.limit)
+            for rank, s in enumerate(suggestions, 1):
+                print(f"{rank:3}. UserID={s.usr}, Name={s.name}: followed by {s.via} "
+                      f"of your followees, {s.followers} followers")
+            if not suggestions:
+                print("No suggestions: the user follows no one who follows others.")
+        elif args.mutuals:
+            for user in store.mutuals(args.user):
+                print(f"UserID={user.usr}, Name={user.name}")
+        elif args.follow:
+            ids = [i.strip() for i in args.follow.split(",") if i.strip()]
+            print(f"Followed {store.follow_many(args.user, ids)} of {len(ids)} users.")
+        else:
+            ids = [i.strip() for i in args.unfollow.split(",") if i.strip()]
+            print(f"Unfollowed {store.unfollow_many(args.user, ids)} of {len(ids)} users.")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
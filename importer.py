@@ -0,0 +1,193 @@
+"""
+Bulk import of CSV / JSON Lines files into a microtweet database.
+
+    python3 twitter.py import <database_file> --users users.csv \
+        --tweets tweets.jsonl --follows follows.csv ...
+
+CSV files need a header row naming the columns; empty fields are stored as
+NULL. JSONL files hold one object per line. Columns a file does not mention
+are NULL. Files are streamed in batches, so they can be larger than memory.
+
+Everything is loaded in one transaction. Foreign keys are checked once, at
+commit. Secondary indexes and triggers on the loaded tables are dropped for
+the load and recreated afterwards, and the trigger-maintained tables
+(counters, full-text index, timelines) are rebuilt in bulk.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+
+import counters
+import db
+import migrations
+import timeline
+import trending
+
+
+# Loaded in this order, parents before children.
+TABLE_COLUMNS = {
+    "users": ["usr", "name", "email", "phone", "pwd"],
+    "tweets": ["tid", "writer_id", "text", "tdate", "ttime", "replyto_tid"],
+    "retweets": ["tid", "retweeter_id", "writer_id", "spam", "rdate"],
+    "follows": ["flwer", "flwee", "start_date"],
+    "hashtag_mentions": ["tid", "term"],
+    "lists": ["owner_id", "lname"],
+    "include": ["owner_id", "lname", "tid"],
+}
+
+DEFAULT_BATCH_SIZE = 10000
+
+CONFLICT_CLAUSES = {
+    "abort": "INSERT",
+    "ignore": "INSERT OR IGNORE",
+    "replace": "INSERT OR REPLACE",
+}
+
+
+def read_rows(path, columns):
+    """
+    Yield one tuple of column values per record in the CSV or JSONL file.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8") as f:
+        if ext == ".csv":
+            for record in csv.DictReader(f):
+                yield tuple(record.get(c) or None for c in columns)
+        elif ext in (".jsonl", ".ndjson", ".json"):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield tuple(record.get(c) for c in columns)
+        else:
+            raise ValueError(f"{path}: expected a .csv or .jsonl file")
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _schema_objects(conn, kind, tables):
+    """
+    Return [(name, sql)] of the explicitly created indexes or triggers on
+    tables.
+    """
+    marks = ",".join("?" * len(tables))
+    return conn.execute(
+        f"SELECT name, sql FROM sqlite_master "
+        f"WHERE type = ? AND tbl_name IN ({marks}) AND sql IS NOT NULL",
+        (kind, *tables)).fetchall()
+
+
+def import_files(conn, files, batch_size=DEFAULT_BATCH_SIZE, on_conflict="abort"):
+    """
+    Load {table: path} into conn in one transaction and return
+    [(table, rows, seconds)] for each file, in load order.
+    """
+    sources = {table: read_rows(path, TABLE_COLUMNS[table])
+               for table, path in files.items()}
+    return import_rows(conn, sources, batch_size, on_conflict)
+
+
+def import_rows(conn, sources, batch_size=DEFAULT_BATCH_SIZE, on_conflict="abort"):
+    """
+    Load {table: iterable of row tuples in TABLE_COLUMNS order} into conn in
+    one transaction and return [(table, rows, seconds)] for each table, in
+    load order. The iterables are consumed lazily, one batch at a time.
+    """
+    tables = [t for t in TABLE_COLUMNS if t in sources]
+    insert = CONFLICT_CLAUSES[on_conflict]
+    stats = []
+
+    with db.write_transaction(conn):
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+
+        # Drop triggers and secondary indexes of every table the triggers
+        # write to as well, then rebuild them once at the end.
+        indexes = _schema_objects(conn, "index", list(TABLE_COLUMNS))
+        triggers = _schema_objects(conn, "trigger", list(TABLE_COLUMNS))
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+
+        for table in tables:
+            columns = TABLE_COLUMNS[table]
+            query = (f'{insert} INTO "{table}"({", ".join(columns)}) '
+                     f'VALUES ({", ".join("?" * len(columns))})')
+            start = time.perf_counter()
+            count = 0
+            for batch in batches(sources[table], batch_size):
+                conn.executemany(query, batch)
+                count += len(batch)
+            stats.append((table, count, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        for _, sql in indexes:
+            conn.execute(sql)
+        for _, sql in triggers:
+            conn.execute(sql)
+        if migrations.has_column(conn, "tweets", "ts"):
+            for sql in migrations.TIMESTAMP_BACKFILL:
+                conn.execute(sql)
+        counters.rebuild(conn)
+        if migrations.has_table(conn, "hashtag_counts"):
+            trending.rebuild(conn)
+        if migrations.has_table(conn, "tweets_fts"):
+            conn.execute("INSERT INTO tweets_fts(tweets_fts) VALUES ('rebuild')")
+        if "users" in tables and migrations.has_table(conn, "users_fts"):
+            for sql in migrations.USERS_FTS_REBUILD:
+                conn.execute(sql)
+        if timeline.enabled(conn):
+            timeline.backfill(conn)
+        stats.append(("(indexes and derived tables)", 0, time.perf_counter() - start))
+
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="twitter.py import",
+        description="Bulk-load CSV or JSONL files into a microtweet database.")
+    parser.add_argument("database_file")
+    for table in TABLE_COLUMNS:
+        parser.add_argument(f"--{table.replace('_', '-')}", dest=table, metavar="FILE",
+                            help=f"columns: {', '.join(TABLE_COLUMNS[table])}")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"rows per executemany (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--on-conflict", choices=CONFLICT_CLAUSES, default="abort",
+                        help="what to do with rows whose key already exists")
+    db.add_connection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    files = {t: getattr(args, t) for t in TABLE_COLUMNS if getattr(args, t)}
+    if not files:
+        parser.error("nothing to import; give at least one table file")
+
+    conn = db.connect_from_args(args.database_file, args)
+    migrations.migrate(conn)
+    start = time.perf_counter()
+    try:
+        stats = import_files(conn, files, args.batch_size, args.on_conflict)
+    except Exception as e:
+        print(f"Import failed, nothing was written: {e}")
+        return 1
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+
+    total = 0
+    for table, rows, seconds in stats:
+        total += rows
+        rate = f"{rows / seconds:,.0f} rows/s" if rows and seconds else ""
+        print(f"{table:30} {rows:>10,} rows {seconds:8.2f}s {rate:>16}")
+    print(f"{'total':30} {total:>10,} rows {elapsed:8.2f}s "
+          f"{total / elapsed:>10,.0f} rows/s")
+    return 0
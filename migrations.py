@@ -0,0 +1,790 @@
+"""
+Versioned schema migrations for microtweet databases.
+
+Every function in MIGRATIONS upgrades the schema by one version.  The version a
+database is at is stored in PRAGMA user_version, so migrate() only runs the
+steps a database has not seen yet and is cheap to call at every startup.
+
+Run this module directly to print the EXPLAIN QUERY PLAN of the hot queries
+before and after migrating (the database file itself is left untouched):
+
+    python3 migrations.py <database_file>
+"""
+import sqlite3
+import sys
+
+
+# The tables of a microtweet database as shipped (schema version 0). Only
+# needed to create a database from scratch; migrate() builds on top of them.
+BASE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        usr         int,
+        name        text,
+        email       text,
+        phone       int,
+        pwd         text,
+        primary key (usr)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS follows (
+        flwer       int,
+        flwee       int,
+        start_date  date,
+        primary key (flwer,flwee),
+        foreign key (flwer) references users(usr) ON DELETE CASCADE,
+        foreign key (flwee) references users(usr) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lists (
+        owner_id    int,
+        lname       text,
+        PRIMARY KEY (owner_id, lname),
+        FOREIGN KEY (owner_id) REFERENCES users(usr) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS include (
+        owner_id    int,
+        lname       text,
+        tid         int,
+        PRIMARY KEY (owner_id, lname, tid),
+        FOREIGN KEY (owner_id, lname) REFERENCES lists(owner_id, lname) ON DELETE CASCADE,
+        FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tweets (
+        tid         int,
+        writer_id   int,
+        text        text,
+        tdate       date,
+        ttime       time,
+        replyto_tid int,
+        PRIMARY KEY (tid),
+        FOREIGN KEY (writer_id) REFERENCES users(usr) ON DELETE CASCADE,
+        FOREIGN KEY (replyto_tid) REFERENCES tweets(tid) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS retweets (
+        tid         int,
+        retweeter_id   int,
+        writer_id      int,
+        spam        int,
+        rdate       date,
+        PRIMARY KEY (tid, retweeter_id),
+        FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE,
+        FOREIGN KEY (retweeter_id) REFERENCES users(usr) ON DELETE CASCADE,
+        FOREIGN KEY (writer_id) REFERENCES users(usr) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS hashtag_mentions (
+        tid         int,
+        term        text,
+        primary key (tid, term),
+        FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE
+    )
+    """,
+]
+
+
+def create_database(conn):
+    """
+    Create the base tables in an empty database and migrate it to
+    SCHEMA_VERSION.
+    """
+    if schema_version(conn) != 0:
+        raise RuntimeError("create_database() needs an empty database")
+    for ddl in BASE_SCHEMA:
+        conn.execute(ddl)
+    conn.commit()
+    return migrate(conn)
+
+
+# Secondary indexes for the queries twitter.py runs on every menu path.
+INDEXES = {
+    # Feed, show_user_details and list_user_tweets: covers the writer filter
+    # and the (tdate, ttime) ordering without touching the table.
+    "idx_tweets_writer": """
+        CREATE INDEX IF NOT EXISTS idx_tweets_writer
+        ON tweets(writer_id, tdate, ttime, tid)
+    """,
+    # Reply counts in tweet_options.
+    "idx_tweets_replyto": """
+        CREATE INDEX IF NOT EXISTS idx_tweets_replyto
+        ON tweets(replyto_tid)
+    """,
+    # list_followers and follower counts; the primary key already serves flwer.
+    "idx_follows_flwee": """
+        CREATE INDEX IF NOT EXISTS idx_follows_flwee
+        ON follows(flwee, flwer)
+    """,
+    # Retweet half of the feed.
+    "idx_retweets_retweeter": """
+        CREATE INDEX IF NOT EXISTS idx_retweets_retweeter
+        ON retweets(retweeter_id, spam, rdate, tid)
+    """,
+    # Hashtag lookups in search_tweets compare lower(term).
+    "idx_hashtag_mentions_term": """
+        CREATE INDEX IF NOT EXISTS idx_hashtag_mentions_term
+        ON hashtag_mentions(lower(term), tid)
+    """,
+}
+
+
+def _add_secondary_indexes(conn):
+    for ddl in INDEXES.values():
+        conn.execute(ddl)
+
+
+def fts5_available(conn):
+    """
+    True if this SQLite build has FTS5 with the trigram tokenizer (3.34+).
+    """
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp._fts5_probe")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+# tweets_fts indexes tweets.text by trigram, so a MATCH on a quoted keyword of
+# three or more characters finds the same case-insensitive substrings as
+# lower(text) LIKE '%kw%'. It is an external-content table: the text lives
+# only in tweets and the triggers keep the index in step with it.
+TWEETS_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5(
+        text, content='tweets', content_rowid='tid', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_ai AFTER INSERT ON tweets BEGIN
+        INSERT INTO tweets_fts(rowid, text) VALUES (new.tid, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_ad AFTER DELETE ON tweets BEGIN
+        INSERT INTO tweets_fts(tweets_fts, rowid, text)
+        VALUES ('delete', old.tid, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_au AFTER UPDATE OF tid, text ON tweets BEGIN
+        INSERT INTO tweets_fts(tweets_fts, rowid, text)
+        VALUES ('delete', old.tid, old.text);
+        INSERT INTO tweets_fts(rowid, text) VALUES (new.tid, new.text);
+    END
+    """,
+    "INSERT INTO tweets_fts(tweets_fts) VALUES ('rebuild')",
+]
+
+
+def _add_tweets_fts(conn):
+    # Builds without FTS5 keep using the LIKE search in twitter.py.
+    if not fts5_available(conn):
+        return
+    for ddl in TWEETS_FTS_DDL:
+        conn.execute(ddl)
+
+
+# Denormalized counters so tweet_options and show_user_details read one row
+# by primary key instead of running COUNT(*) scans. A missing row means all
+# counts are zero. counters.py rebuilds and verifies them.
+COUNTER_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS tweet_stats (
+        tid         int,
+        retweets    int NOT NULL DEFAULT 0,
+        replies     int NOT NULL DEFAULT 0,
+        PRIMARY KEY (tid)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        usr         int,
+        tweets      int NOT NULL DEFAULT 0,
+        following   int NOT NULL DEFAULT 0,
+        followers   int NOT NULL DEFAULT 0,
+        PRIMARY KEY (usr)
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_stats_ai AFTER INSERT ON tweets BEGIN
+        INSERT INTO user_stats(usr, tweets) SELECT new.writer_id, 1
+            WHERE new.writer_id IS NOT NULL
+            ON CONFLICT(usr) DO UPDATE SET tweets = tweets + 1;
+        INSERT INTO tweet_stats(tid, replies) SELECT new.replyto_tid, 1
+            WHERE new.replyto_tid IS NOT NULL
+            ON CONFLICT(tid) DO UPDATE SET replies = replies + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_stats_ad AFTER DELETE ON tweets BEGIN
+        UPDATE user_stats SET tweets = tweets - 1 WHERE usr = old.writer_id;
+        UPDATE tweet_stats SET replies = replies - 1 WHERE tid = old.replyto_tid;
+        DELETE FROM tweet_stats WHERE tid = old.tid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_stats_au
+    AFTER UPDATE OF writer_id, replyto_tid ON tweets BEGIN
+        UPDATE user_stats SET tweets = tweets - 1 WHERE usr = old.writer_id;
+        UPDATE tweet_stats SET replies = replies - 1 WHERE tid = old.replyto_tid;
+        INSERT INTO user_stats(usr, tweets) SELECT new.writer_id, 1
+            WHERE new.writer_id IS NOT NULL
+            ON CONFLICT(usr) DO UPDATE SET tweets = tweets + 1;
+        INSERT INTO tweet_stats(tid, replies) SELECT new.replyto_tid, 1
+            WHERE new.replyto_tid IS NOT NULL
+            ON CONFLICT(tid) DO UPDATE SET replies = replies + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS retweets_stats_ai AFTER INSERT ON retweets BEGIN
+        INSERT INTO tweet_stats(tid, retweets) SELECT new.tid, 1
+            WHERE new.tid IS NOT NULL
+            ON CONFLICT(tid) DO UPDATE SET retweets = retweets + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS retweets_stats_ad AFTER DELETE ON retweets BEGIN
+        UPDATE tweet_stats SET retweets = retweets - 1 WHERE tid = old.tid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS follows_stats_ai AFTER INSERT ON follows BEGIN
+        INSERT INTO user_stats(usr, following) SELECT new.flwer, 1
+            WHERE new.flwer IS NOT NULL
+            ON CONFLICT(usr) DO UPDATE SET following = following + 1;
+        INSERT INTO user_stats(usr, followers) SELECT new.flwee, 1
+            WHERE new.flwee IS NOT NULL
+            ON CONFLICT(usr) DO UPDATE SET followers = followers + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS follows_stats_ad AFTER DELETE ON follows BEGIN
+        UPDATE user_stats SET following = following - 1 WHERE usr = old.flwer;
+        UPDATE user_stats SET followers = followers - 1 WHERE usr = old.flwee;
+    END
+    """,
+]
+
+
+def _add_counters(conn):
+    # Imported here because counters imports this module for its CLI.
+    import counters
+
+    for ddl in COUNTER_DDL:
+        conn.execute(ddl)
+    counters.rebuild(conn)
+
+
+# Materialized home feeds for fan-out-on-write (see timeline.py), plus a
+# small key/value table for database-wide options such as whether that mode
+# is enabled. A timeline row has the same sort key as a row of the feed query
+# in twitter.py, so the clustered primary key serves feed pages in order.
+TIMELINE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        name        text,
+        value,
+        PRIMARY KEY (name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS timeline (
+        owner       int,
+        tdate       date,
+        ttime       text,
+        tid         int,
+        ttype       text,
+        actor       int,
+        PRIMARY KEY (owner, tdate, ttime, tid, ttype, actor)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def _add_timeline(conn):
+    for ddl in TIMELINE_DDL:
+        conn.execute(ddl)
+
+
+def _add_sequences(conn):
+    # Next free tid / usr, advanced by db.allocate_id.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sequences (
+            name        text,
+            next_id     int NOT NULL,
+            PRIMARY KEY (name)
+        )
+    """)
+
+
+# search_users lists matching users shortest name first. Walking this index
+# yields users in that order, so a short keyword that matches most names
+# stops after the first page instead of sorting every match.
+USERS_NAME_LENGTH_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_users_name_length
+    ON users(length(name))
+"""
+
+# users_fts indexes users.name by trigram, like tweets_fts does for tweet text,
+# for keywords of three or more characters. users has no integer key and
+# VACUUM may renumber its implicit rowids, so instead of pointing at users
+# rows the index keeps its own copy of each name next to the usr it belongs to.
+USERS_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        name, usr UNINDEXED, tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(name, usr) VALUES (new.name, new.usr);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        DELETE FROM users_fts WHERE usr = old.usr;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF usr, name ON users BEGIN
+        DELETE FROM users_fts WHERE usr = old.usr;
+        INSERT INTO users_fts(name, usr) VALUES (new.name, new.usr);
+    END
+    """,
+]
+
+USERS_FTS_REBUILD = [
+    "DELETE FROM users_fts",
+    "INSERT INTO users_fts(name, usr) SELECT name, usr FROM users",
+]
+
+
+def _add_user_name_search(conn):
+    conn.execute(USERS_NAME_LENGTH_INDEX)
+    if fts5_available(conn):
+        for ddl in USERS_FTS_DDL + USERS_FTS_REBUILD:
+            conn.execute(ddl)
+
+
+# Hashtag mentions rolled up per hour and per day of their tweet's tdate/ttime,
+# so "top hashtags of the last 24 hours" sums a few dozen buckets instead of
+# grouping every mention (see trending.py). span is 'hour' (bucket
+# 'YYYY-MM-DD HH') or 'day' (bucket 'YYYY-MM-DD'). Terms are lower-cased and
+# stripped of a leading '#', which older rows kept, so both spellings count
+# as one hashtag. Zero rows may be left behind by deletes.
+TRENDING_SPANS = "(SELECT 'hour' AS span UNION ALL SELECT 'day')"
+
+
+def trending_bucket(tdate, ttime):
+    """
+    SQL for the bucket of a tweet dated tdate, ttime in the current span.
+    """
+    return (f"CASE span WHEN 'day' THEN {tdate} "
+            f"ELSE {tdate} || ' ' || substr(COALESCE({ttime}, '00'), 1, 2) END")
+
+
+def trending_term(term):
+    return f"ltrim(lower({term}), '#')"
+
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def normalize_term(term):
+    """
+    trending_term in Python, for terms counted outside SQL. SQLite's
+    lower() folds only ASCII letters, and so does this.
+    """
+    return term.translate(_ASCII_LOWER).lstrip("#")
+
+
+TRENDING_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS hashtag_counts (
+        span        text,
+        bucket      text,
+        term        text,
+        mentions    int NOT NULL DEFAULT 0,
+        PRIMARY KEY (span, bucket, term)
+    ) WITHOUT ROWID
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS hashtag_mentions_trending_ai
+    AFTER INSERT ON hashtag_mentions BEGIN
+        INSERT INTO hashtag_counts(span, bucket, term, mentions)
+            SELECT span, {trending_bucket("t.tdate", "t.ttime")}, {trending_term("new.term")}, 1
+            FROM tweets t, {TRENDING_SPANS}
+            WHERE t.tid = new.tid AND t.tdate IS NOT NULL AND new.term IS NOT NULL
+            ON CONFLICT(span, bucket, term) DO UPDATE SET mentions = mentions + 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS hashtag_mentions_trending_ad
+    AFTER DELETE ON hashtag_mentions BEGIN
+        UPDATE hashtag_counts SET mentions = mentions - 1
+            WHERE term = {trending_term("old.term")} AND (span, bucket) IN (
+                SELECT span, {trending_bucket("t.tdate", "t.ttime")}
+                FROM tweets t, {TRENDING_SPANS} WHERE t.tid = old.tid);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS hashtag_mentions_trending_au
+    AFTER UPDATE OF tid, term ON hashtag_mentions BEGIN
+        UPDATE hashtag_counts SET mentions = mentions - 1
+            WHERE term = {trending_term("old.term")} AND (span, bucket) IN (
+                SELECT span, {trending_bucket("t.tdate", "t.ttime")}
+                FROM tweets t, {TRENDING_SPANS} WHERE t.tid = old.tid);
+        INSERT INTO hashtag_counts(span, bucket, term, mentions)
+            SELECT span, {trending_bucket("t.tdate", "t.ttime")}, {trending_term("new.term")}, 1
+            FROM tweets t, {TRENDING_SPANS}
+            WHERE t.tid = new.tid AND t.tdate IS NOT NULL AND new.term IS NOT NULL
+            ON CONFLICT(span, bucket, term) DO UPDATE SET mentions = mentions + 1;
+    END
+    """,
+    # BEFORE, so the mentions are still there when foreign keys cascade the
+    # delete to them; by then the tweet is gone and the trigger above no
+    # longer finds their bucket.
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tweets_trending_bd BEFORE DELETE ON tweets BEGIN
+        UPDATE hashtag_counts SET mentions = mentions - (
+                SELECT COUNT(*) FROM hashtag_mentions m
+                WHERE m.tid = old.tid AND {trending_term("m.term")} = hashtag_counts.term)
+            WHERE term IN (SELECT {trending_term("term")} FROM hashtag_mentions WHERE tid = old.tid)
+              AND (span, bucket) IN (
+                  SELECT span, {trending_bucket("old.tdate", "old.ttime")}
+                  FROM {TRENDING_SPANS});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tweets_trending_au
+    AFTER UPDATE OF tdate, ttime ON tweets BEGIN
+        UPDATE hashtag_counts SET mentions = mentions - (
+                SELECT COUNT(*) FROM hashtag_mentions m
+                WHERE m.tid = old.tid AND {trending_term("m.term")} = hashtag_counts.term)
+            WHERE term IN (SELECT {trending_term("term")} FROM hashtag_mentions WHERE tid = old.tid)
+              AND (span, bucket) IN (
+                  SELECT span, {trending_bucket("old.tdate", "old.ttime")}
+                  FROM {TRENDING_SPANS});
+        INSERT INTO hashtag_counts(span, bucket, term, mentions)
+            SELECT span, {trending_bucket("new.tdate", "new.ttime")}, {trending_term("m.term")}, COUNT(*)
+            FROM hashtag_mentions m, {TRENDING_SPANS}
+            WHERE m.tid = new.tid AND new.tdate IS NOT NULL AND m.term IS NOT NULL
+            GROUP BY span, {trending_term("m.term")}
+            ON CONFLICT(span, bucket, term) DO UPDATE
+            SET mentions = mentions + excluded.mentions;
+    END
+    """,
+]
+
+
+def _add_trending(conn):
+    # Imported here because trending imports this module for its CLI.
+    import trending
+
+    for ddl in TRENDING_DDL:
+        conn.execute(ddl)
+    trending.rebuild(conn)
+
+
+# A single integer sort key for tweets and retweets: seconds since the epoch
+# of tdate/ttime (local time, as the client stamps them) or of rdate. tdate,
+# ttime and rdate stay as they are for display; ts is what feeds and
+# listings order by, through indexes that lead with the author, so a user's
+# posts come out of the index newest first without a sort. Rows written
+# without a ts (older clients, imports) get one from these triggers. Old
+# retweets only have a date and sort as if made at midnight.
+def timestamp(tdate, ttime="NULL"):
+    """
+    SQL for the epoch seconds of a local tdate and ttime; midnight of tdate
+    if ttime is missing or not a time.
+    """
+    return (f"CAST(COALESCE(strftime('%s', {tdate} || ' ' || {ttime}, 'utc'), "
+            f"strftime('%s', {tdate}, 'utc')) AS int)")
+
+
+TIMESTAMP_BACKFILL = [
+    f"UPDATE tweets SET ts = {timestamp('tdate', 'ttime')} WHERE ts IS NULL",
+    f"UPDATE retweets SET ts = {timestamp('rdate')} WHERE ts IS NULL",
+]
+
+TIMESTAMP_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tweets_ts_ai AFTER INSERT ON tweets
+    WHEN new.ts IS NULL BEGIN
+        UPDATE tweets SET ts = {timestamp('new.tdate', 'new.ttime')} WHERE rowid = new.rowid;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tweets_ts_au AFTER UPDATE OF tdate, ttime ON tweets BEGIN
+        UPDATE tweets SET ts = {timestamp('new.tdate', 'new.ttime')} WHERE rowid = new.rowid;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS retweets_ts_ai AFTER INSERT ON retweets
+    WHEN new.ts IS NULL BEGIN
+        UPDATE retweets SET ts = {timestamp('new.rdate')} WHERE rowid = new.rowid;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS retweets_ts_au AFTER UPDATE OF rdate ON retweets BEGIN
+        UPDATE retweets SET ts = {timestamp('new.rdate')} WHERE rowid = new.rowid;
+    END
+    """,
+    # Replace the (tdate, ttime) / rdate indexes of schema version 1.
+    "DROP INDEX IF EXISTS idx_tweets_writer",
+    "DROP INDEX IF EXISTS idx_retweets_retweeter",
+    """
+    CREATE INDEX IF NOT EXISTS idx_tweets_writer_ts
+    ON tweets(writer_id, ts, tid)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_retweets_retweeter_ts
+    ON retweets(retweeter_id, spam, ts, tid)
+    """,
+    # Timelines are derived data: rebuilt below with ts in their key.
+    "DROP TABLE IF EXISTS timeline",
+    """
+    CREATE TABLE timeline (
+        owner       int,
+        ts          int,
+        tdate       date,
+        ttime       text,
+        tid         int,
+        ttype       text,
+        actor       int,
+        PRIMARY KEY (owner, ts, tid, ttype, actor)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def _add_timestamps(conn):
+    # Imported here because timeline imports this module.
+    import timeline
+
+    conn.execute("ALTER TABLE tweets ADD COLUMN ts int")
+    conn.execute("ALTER TABLE retweets ADD COLUMN ts int")
+    for ddl in TIMESTAMP_BACKFILL + TIMESTAMP_DDL:
+        conn.execute(ddl)
+    if timeline.enabled(conn):
+        timeline.backfill(conn)
+
+
+# Conversations (store.THREAD_QUERY, MicroTweetStore.conversation) read each
+# tweet's replies oldest first, a page at a time, straight from this index;
+# it also serves reply counts.
+REPLY_INDEX_DDL = [
+    "DROP INDEX IF EXISTS idx_tweets_replyto",
+    """
+    CREATE INDEX IF NOT EXISTS idx_tweets_replyto_ts
+    ON tweets(replyto_tid, ts, tid)
+    """,
+]
+
+
+def _add_reply_index(conn):
+    for ddl in REPLY_INDEX_DDL:
+        conn.execute(ddl)
+
+
+# Hashtag search (store.SEARCH_QUERY) compares terms the way the trending
+# rollup stores them, so a hashtag picked from the trending list finds the
+# tweets of older rows that kept their '#'.
+HASHTAG_TERM_INDEX_DDL = [
+    "DROP INDEX IF EXISTS idx_hashtag_mentions_term",
+    f"""
+    CREATE INDEX IF NOT EXISTS idx_hashtag_mentions_trending_term
+    ON hashtag_mentions({trending_term("term")}, tid)
+    """,
+]
+
+
+def _add_hashtag_term_index(conn):
+    for ddl in HASHTAG_TERM_INDEX_DDL:
+        conn.execute(ddl)
+
+
+MIGRATIONS = [
+    _add_secondary_indexes,
+    _add_tweets_fts,
+    _add_counters,
+    _add_timeline,
+    _add_sequences,
+    _add_user_name_search,
+    _add_trending,
+    _add_timestamps,
+    _add_reply_index,
+    _add_hashtag_term_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Bring conn up to SCHEMA_VERSION. Each step runs in its own transaction
+    together with the user_version bump, so a failed step leaves the database
+    at the last version that completed.
+    """
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this program "
+            f"supports ({SCHEMA_VERSION}).")
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        step = MIGRATIONS[target - 1]
+        try:
+            conn.execute("BEGIN")
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
+
+# Representative statements and parameters for the plan report.
+PLAN_QUERIES = [
+    ("feed (tweets)",
+     "SELECT tid, tdate, ttime FROM tweets WHERE writer_id IN "
+     "(SELECT flwee FROM follows WHERE flwer = ?) ORDER BY tdate DESC, ttime DESC",
+     (1,)),
+    ("feed (retweets)",
+     "SELECT tid, rdate FROM retweets WHERE retweeter_id IN "
+     "(SELECT flwee FROM follows WHERE flwer = ?) AND spam = 0",
+     (1,)),
+    ("user tweet count",
+     "SELECT COUNT(*) FROM tweets WHERE writer_id = ?", (1,)),
+    ("user recent tweets",
+     "SELECT tid, text, tdate, ttime FROM tweets WHERE writer_id = ? "
+     "ORDER BY tdate DESC, ttime DESC LIMIT 3", (1,)),
+    ("reply count",
+     "SELECT COUNT(*) FROM tweets WHERE replyto_tid = ?", (1,)),
+    ("follower count",
+     "SELECT COUNT(*) FROM follows WHERE flwee = ?", (1,)),
+    ("list followers",
+     "SELECT flwer FROM follows WHERE flwee = ?", (1,)),
+    ("keyword search (LIKE)",
+     "SELECT tid FROM tweets WHERE lower(text) LIKE ?", ("%toronto%",)),
+    ("hashtag lookup",
+     f"SELECT tid FROM hashtag_mentions WHERE {trending_term('term')} = ?", ("toronto",)),
+    ("user search (LIKE)",
+     "SELECT usr, name FROM users WHERE lower(name) LIKE ? "
+     "ORDER BY length(name), rowid LIMIT 6", ("%a%",)),
+]
+
+
+FTS_PLAN_QUERY = (
+    "keyword search (FTS5)",
+    "SELECT rowid, rank FROM tweets_fts WHERE tweets_fts MATCH ?",
+    ('"toronto"',))
+
+TIMESTAMP_PLAN_QUERIES = [
+    ("feed (tweets, by ts)",
+     "SELECT t.tid, t.ts FROM follows f JOIN tweets t ON t.rowid IN ("
+     "SELECT rowid FROM tweets WHERE writer_id = f.flwee "
+     "ORDER BY ts DESC, tid DESC LIMIT 6) WHERE f.flwer = ?",
+     (1,)),
+    ("user recent tweets (by ts)",
+     "SELECT tid, text, tdate, ttime FROM tweets WHERE writer_id = ? "
+     "ORDER BY ts DESC, tid DESC LIMIT 3", (1,)),
+    ("first replies (by ts)",
+     "SELECT tid FROM tweets WHERE replyto_tid = ? ORDER BY ts, tid LIMIT 10", (1,)),
+]
+
+TRENDING_PLAN_QUERY = (
+    "trending hashtags (24h)",
+    "SELECT term, SUM(mentions) FROM hashtag_counts "
+    "WHERE span = 'hour' AND bucket > ? AND bucket <= ? "
+    "GROUP BY term ORDER BY 2 DESC LIMIT 20",
+    ("2025-03-25 20", "2025-03-26 20"))
+
+
+def has_table(conn, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info("{table}")'))
+
+
+def get_setting(conn, name, default=None):
+    row = conn.execute(
+        "SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else default
+
+
+def set_setting(conn, name, value):
+    conn.execute(
+        "INSERT INTO settings(name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+        (name, value))
+
+
+def query_plans(conn):
+    """
+    Return {name: [plan detail, ...]} for every statement in PLAN_QUERIES.
+    """
+    plans = {}
+    queries = list(PLAN_QUERIES)
+    if has_table(conn, "tweets_fts"):
+        queries.append(FTS_PLAN_QUERY)
+    if has_table(conn, "hashtag_counts"):
+        queries.append(TRENDING_PLAN_QUERY)
+    if has_column(conn, "tweets", "ts"):
+        queries.extend(TIMESTAMP_PLAN_QUERIES)
+    for name, sql, params in queries:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def plan_report(db_name):
+    """
+    Print the query plans of an in-memory copy of db_name before and after
+    migrating it to SCHEMA_VERSION.
+    """
+    source = sqlite3.connect(db_name)
+    conn = sqlite3.connect(":memory:")
+    source.backup(conn)
+    source.close()
+
+    before_version = schema_version(conn)
+    before = query_plans(conn)
+    after_version = migrate(conn)
+    after = query_plans(conn)
+    conn.close()
+
+    print(f"Schema version {before_version} -> {after_version}")
+    for name in after:
+        print(f"\n--- {name} ---")
+        print("before:")
+        for detail in before.get(name, ["(not available)"]):
+            print(f"   {detail}")
+        print("after:")
+        for detail in after[name]:
+            print(f"   {detail}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 migrations.py <database_file>")
+        sys.exit(1)
+    plan_report(sys.argv[1])
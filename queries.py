@@ -0,0 +1,172 @@
+"""
+Named SQL statements with per-query timing.
+
+Every statement the client runs is registered under a name, with one fixed
+SQL string per name, so sqlite3's statement cache (see db.connect's
+cached_statements) compiles each one only once per connection. A
+QueryRegistry executes statements by name and records, for each name, how
+many times it ran, its total and maximum time, and the rows it returned (or
+changed).
+
+    python3 twitter.py <database_file> --profile
+    python3 twitter.py <database_file> --slow-query-ms 20 --slow-query-log slow.log
+
+--profile prints the hot-query table on exit. The slow-query log gets one
+entry per statement slower than --slow-query-ms, with its parameters and
+EXPLAIN QUERY PLAN output.
+"""
+import collections
+import contextlib
+import dataclasses
+import datetime
+import sys
+import threading
+import time
+
+
+@dataclasses.dataclass
+class QueryStats:
+    count: int = 0
+    total: float = 0.0      # seconds
+    max: float = 0.0        # seconds
+    rows: int = 0
+
+
+class QueryRegistry:
+    """
+    {name: sql} plus the QueryStats of each name. Stores on several threads
+    (a client and its write queue's writer) can share one registry.
+    """
+
+    def __init__(self, queries, slow_ms=None, slow_log=None):
+        self.queries = dict(queries)
+        self.stats = collections.defaultdict(QueryStats)
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self._lock = threading.Lock()
+
+    def execute(self, conn, name, params=()):
+        """
+        Run query name with params and return all of its rows.
+        """
+        sql = self.queries[name]
+        start = time.perf_counter()
+        cur = conn.execute(sql, params)
+        rows = cur.fetchall()
+        elapsed = time.perf_counter() - start
+        self._record(name, elapsed, len(rows) if cur.description else max(cur.rowcount, 0))
+        if self._is_slow(elapsed):
+            self._log_slow(conn, name, sql, params, elapsed)
+        return rows
+
+    def execute_one(self, conn, name, params=()):
+        rows = self.execute(conn, name, params)
+        return rows[0] if rows else None
+
+    def executemany(self, conn, name, seq_of_params):
+        sql = self.queries[name]
+        start = time.perf_counter()
+        cur = conn.executemany(sql, seq_of_params)
+        elapsed = time.perf_counter() - start
+        self._record(name, elapsed, max(cur.rowcount, 0))
+        if self._is_slow(elapsed):
+            self._log_slow(conn, name, sql, None, elapsed)
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """
+        Time the body as one call of name, for operations made of several
+        statements that live in other modules (timeline fan-out, trimming).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record(name, elapsed, 0)
+            if self._is_slow(elapsed):
+                self._log_slow(None, name, None, None, elapsed)
+
+    def _record(self, name, elapsed, rows):
+        with self._lock:
+            stats = self.stats[name]
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.rows += rows
+
+    def _is_slow(self, elapsed):
+        return self.slow_log is not None and elapsed * 1000 >= (self.slow_ms or 0)
+
+    def _log_slow(self, conn, name, sql, params, elapsed):
+        with self._lock:
+            self._write_slow(conn, name, sql, params, elapsed)
+
+    def _write_slow(self, conn, name, sql, params, elapsed):
+        out = self.slow_log
+        stamp = datetime.datetime.now().isoformat(timespec="seconds")
+        out.write(f"{stamp} {name} {elapsed * 1000:.3f} ms")
+        if params is not None:
+            out.write(f" params={params!r}")
+        out.write("\n")
+        if conn is not None and sql is not None:
+            plan_params = params if params is not None else ()
+            try:
+                plan = conn.execute("EXPLAIN QUERY PLAN " + sql, plan_params).fetchall()
+            except Exception as e:   # executemany parameters are not kept
+                out.write(f"   (no plan: {e})\n")
+            else:
+                for row in plan:
+                    out.write(f"   {row[-1]}\n")
+        out.flush()
+
+    def report(self):
+        """
+        Return the hot-query table, slowest total first.
+        """
+        lines = [f"{'query':32} {'calls':>8} {'total ms':>10} {'mean ms':>9} "
+                 f"{'max ms':>9} {'rows':>9}"]
+        ranked = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)
+        for name, s in ranked:
+            lines.append(f"{name:32} {s.count:>8,} {s.total * 1000:>10.1f} "
+                         f"{s.total * 1000 / s.count:>9.3f} {s.max * 1000:>9.3f} "
+                         f"{s.rows:>9,}")
+        return "\n".join(lines)
+
+
+def add_profile_arguments(parser):
+    """
+    Add --profile and the slow-query log options to an argparse parser.
+    """
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile", action="store_true",
+                       help="print per-query counts and timings on exit")
+    group.add_argument("--slow-query-ms", type=float, metavar="MS",
+                       help="log statements slower than MS, with their query plan")
+    group.add_argument("--slow-query-log", metavar="FILE",
+                       help="where to write the slow-query log (default: stderr, "
+                            "when --slow-query-ms is given; without it every "
+                            "statement is logged)")
+
+
+def registry_from_args(queries, args):
+    """
+    A QueryRegistry over queries configured by add_profile_arguments. Pass
+    it to finish() on exit.
+    """
+    slow_log = None
+    if args.slow_query_log:
+        slow_log = open(args.slow_query_log, "a", encoding="utf-8")
+    elif args.slow_query_ms is not None:
+        slow_log = sys.stderr
+    return QueryRegistry(queries, args.slow_query_ms, slow_log)
+
+
+def finish(registry, args):
+    """
+    Print the profile if asked for and close the slow-query log.
+    """
+    if args.profile:
+        print("\n" + registry.report(), file=sys.stderr)
+    if registry.slow_log not in (None, sys.stderr):
+        registry.slow_log.close()
@@ -0,0 +1,308 @@
+"""
+Multi-user server: one long-running process serving many clients from one
+database.
+
+    python3 server.py <database_file> [--host 127.0.0.1] [--port 7878]
+    python3 server.py <database_file> --unix /tmp/microtweet.sock
+
+Clients speak the batch protocol (see batch.py) over TCP or a Unix socket:
+one JSON command per line, answered by one JSON result per line, in order.
+
+Reads run on a pool of read-only connections (--readers), in parallel.
+Writes are queued for a single writer connection. Each time the writer is
+free, it takes every queued write (up to --group-size), runs each one in its
+own savepoint, and commits them all together. While one group is committing,
+the next one fills up, so under load many writes share a single commit.
+A client sees a write's result only after its group has committed. On
+shutdown the group being committed still commits and is answered; writes
+still queued are answered with an error and not made.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import os
+import signal
+import sqlite3
+import threading
+
+import batch
+import credentials
+import db
+import migrations
+from store import MicroTweetStore
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7878
+DEFAULT_READERS = 4
+DEFAULT_GROUP_SIZE = 256
+DEFAULT_GROUP_MS = 0.0
+MAX_LINE = 2 ** 16      # bytes; longer commands are refused
+SHUTDOWN_RESULT = {"ok": False, "error": "Server shutting down; the write was not made."}
+
+
+class Server:
+    """
+    Routes each command to the reader pool or the writer queue. Reader and
+    writer stores do not cache (see cache.py): a write on the writer
+    connection could not invalidate a reader's cache, and clients expect to
+    read their own writes.
+    """
+
+    def __init__(self, db_name, readers=DEFAULT_READERS, group_size=DEFAULT_GROUP_SIZE,
+                 group_ms=DEFAULT_GROUP_MS, connect_options=None, verifier=None):
+        self.db_name = db_name
+        self.group_size = group_size
+        self.group_ms = group_ms
+        self.connect_options = connect_options or {}
+        # Shared, so a user's failed logins count across reader threads.
+        self.verifier = verifier if verifier is not None else credentials.Verifier()
+        self.stats = {"reads": 0, "writes": 0, "groups": 0}
+        self._local = threading.local()
+        self._reader_stores = []
+        self._reader_stores_lock = threading.Lock()
+        self._writer_opened = False
+        self._readers = concurrent.futures.ThreadPoolExecutor(
+            readers, thread_name_prefix="reader", initializer=self._open_reader)
+        self._writer = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="writer", initializer=self._open_writer)
+        self._writes = None
+        self._loop = None
+        self._stopping = False
+
+    def _open_reader(self):
+        conn = db.connect(self.db_name, read_only=True, **self.connect_options)
+        self._local.store = MicroTweetStore(conn, cache_entries=0, read_only=True,
+                                            verifier=self.verifier,
+                                            on_rehash=self._queue_rehash)
+        with self._reader_stores_lock:
+            self._reader_stores.append(self._local.store)
+
+    def _open_writer(self):
+        conn = db.connect(self.db_name, **self.connect_options)
+        migrations.migrate(conn)
+        self._local.store = MicroTweetStore(conn, cache_entries=0, verifier=self.verifier)
+        self._writer_opened = True
+
+    def _close_writer(self):
+        self._local.store.close()
+
+    def _read(self, cmd):
+        return batch.execute_command(self._local.store, cmd)
+
+    def _queue_rehash(self, usr, pwd_hash):
+        """
+        Called on a reader thread when a login verified a password stored
+        in plaintext or under an old scheme: queue its new hash as a write.
+        Nobody waits for it; if the queue is full or the server is
+        stopping, the password is rehashed at a later login instead.
+        """
+        def rehash(store):
+            store.set_password_hash(usr, pwd_hash)
+
+        def put():
+            if not self._stopping:
+                with contextlib.suppress(asyncio.QueueFull):
+                    self._writes.put_nowait((rehash, self._loop.create_future()))
+
+        self._loop.call_soon_threadsafe(put)
+
+    def _commit_group(self, cmds):
+        """
+        Run cmds in one transaction on the writer connection and return their
+        results. If the commit fails, nothing in the group was written.
+        """
+        conn = self._local.store.conn
+        try:
+            # Commands from clients, or functions of the writer store queued
+            # by the server itself (_queue_rehash).
+            results = [cmd(self._local.store) if callable(cmd)
+                       else batch.execute_command(self._local.store, cmd) for cmd in cmds]
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        return results
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            group = []
+            try:
+                group.append(await self._writes.get())
+                if self.group_ms:
+                    await asyncio.sleep(self.group_ms / 1000)
+            except asyncio.CancelledError:
+                _answer(group, [SHUTDOWN_RESULT] * len(group))
+                raise
+            while len(group) < self.group_size and not self._writes.empty():
+                group.append(self._writes.get_nowait())
+            commit = loop.run_in_executor(
+                self._writer, self._commit_group, [cmd for cmd, _ in group])
+            try:
+                await asyncio.shield(commit)
+            except asyncio.CancelledError:
+                # Shutting down: the writer finishes the group anyway, so
+                # wait for it and answer its clients before stopping.
+                await asyncio.wait([commit])
+                self._answer_group(group, commit)
+                raise
+            self._answer_group(group, commit)
+
+    def _answer_group(self, group, commit):
+        try:
+            results = commit.result()
+        except Exception as e:
+            results = [{"ok": False, "error": f"Write failed: {e}"}] * len(group)
+        self.stats["writes"] += len(group)
+        self.stats["groups"] += 1
+        _answer(group, results)
+
+    async def _stop_writes(self, write_loop):
+        """
+        Stop the write loop after the group it is committing, and fail the
+        writes still queued: they were never handed to the writer.
+        """
+        write_loop.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await write_loop
+        self._stopping = True
+        while not self._writes.empty():
+            _answer([self._writes.get_nowait()], [SHUTDOWN_RESULT])
+        # Let the handlers waiting on those writes send their replies.
+        await asyncio.sleep(0)
+
+    async def execute(self, line):
+        """
+        Run one command line and return its result dict.
+        """
+        try:
+            cmd, writes = batch.parse_command(line)
+        except batch.InvalidCommand as e:
+            return batch.error_result(line, e)
+        if writes:
+            if self._stopping:
+                return SHUTDOWN_RESULT
+            future = asyncio.get_running_loop().create_future()
+            await self._writes.put((cmd, future))
+            if self._stopping:
+                # Queued after _stop_writes emptied the queue.
+                _answer([(cmd, future)], [SHUTDOWN_RESULT])
+            return await future
+        self.stats["reads"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._readers, self._read, cmd)
+        except sqlite3.Error as e:
+            return {"ok": False, "error": f"Read failed: {e}"}
+
+    async def handle(self, reader, writer):
+        """
+        Serve one client: its commands run one at a time, in order.
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # The rest of the line is still unread, so the stream
+                    # cannot be resynchronized: answer and hang up.
+                    error = batch.InvalidCommand(f"Command longer than {MAX_LINE} bytes.")
+                    writer.write(json.dumps(batch.error_result("", error)).encode() + b"\n")
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                result = await self.execute(line.decode("utf-8", "replace"))
+                writer.write(json.dumps(result).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # A client that went away, or one still connected at shutdown.
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix=None):
+        loop = self._loop = asyncio.get_running_loop()
+        # Open (and migrate) the writer before any reader, so readers find
+        # the database in WAL mode and at the current schema version.
+        await loop.run_in_executor(self._writer, lambda: None)
+        self._writes = asyncio.Queue(self.group_size * 4)
+        write_loop = asyncio.create_task(self._write_loop())
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, unix, limit=MAX_LINE)
+            where = unix
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+            where = ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}"
+                              for s in server.sockets)
+        print(f"Serving {self.db_name} on {where}", flush=True)
+        stop = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+        try:
+            async with server:
+                await stop
+                await self._stop_writes(write_loop)
+        finally:
+            write_loop.cancel()
+
+    def close(self):
+        self._readers.shutdown()
+        for store in self._reader_stores:
+            store.close()
+        # The writer's connection can only be closed from its own thread.
+        if self._writer_opened:
+            self._writer.submit(self._close_writer).result()
+        self._writer.shutdown()
+        self.verifier.close()
+
+
+def _answer(group, results):
+    for (_, future), result in zip(group, results):
+        if not future.done():
+            future.set_result(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a microtweet database to many clients over a "
+                    "JSON-lines socket protocol.")
+    parser.add_argument("database_file")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"TCP port, 0 for any free port (default: {DEFAULT_PORT})")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead")
+    parser.add_argument("--readers", type=int, default=DEFAULT_READERS,
+                        help=f"read-only connections (default: {DEFAULT_READERS})")
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE,
+                        help=f"most writes per commit (default: {DEFAULT_GROUP_SIZE})")
+    parser.add_argument("--group-ms", type=float, default=DEFAULT_GROUP_MS,
+                        help="how long the writer waits for more writes before "
+                             "committing a group; 0 commits whatever is queued "
+                             f"(default: {DEFAULT_GROUP_MS:g})")
+    db.add_connection_arguments(parser)
+    credentials.add_credential_arguments(parser)
+    args = parser.parse_args()
+    if not os.path.exists(args.database_file):
+        parser.error(f"{args.database_file}: no such database")
+
+    server = Server(args.database_file, args.readers, args.group_size, args.group_ms,
+                    db.connection_options(args), credentials.verifier_from_args(args))
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    finally:
+        server.close()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+    print(f"{server.stats['reads']:,} reads, {server.stats['writes']:,} writes "
+          f"in {server.stats['groups']:,} commits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+Columnar read-only snapshots of a microtweet database, for analytics.
+
+An export writes every column of the base tables (importer.TABLE_COLUMNS) to
+its own NumPy .npy file in a new directory, plus a manifest.json:
+
+    users.usr.npy  tweets.tdate.npy  ...  strings.npy  string_offsets.npy
+
+Integer columns are stored in the narrowest of int8/16/32/64 that holds
+their values, with NULL as the type's minimum (the column's "null" in the
+manifest). Text columns are int32 codes into one string pool shared by all
+columns, NULL being -1. The pool is sorted, so codes compare like their
+strings (dates can be filtered by code range) and equal strings have equal
+codes in every table. It is stored as its UTF-8 bytes (strings.npy) and
+the offsets of each string in them (string_offsets.npy).
+
+Snapshot.open memory-maps the files and exposes each column as a read-only
+memoryview over the mapping: nothing is read until it is used, and nothing
+is copied. The files load as is with numpy.load(path, mmap_mode="r"), but
+numpy is not needed: the helpers below aggregate the memoryviews with
+collections.Counter and itertools, which loop in C.
+
+    python3 twitter.py export <database_file> <directory>
+    python3 snapshot.py <directory> [--limit 20] [--min-retweets 10]
+"""
+import argparse
+import array
+import ast
+import collections
+import datetime
+import heapq
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import db
+import importer
+import migrations
+
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+STRINGS = "strings.npy"
+STRING_OFFSETS = "string_offsets.npy"
+NULL_CODE = -1
+DEFAULT_LIMIT = 20
+DEFAULT_MIN_RETWEETS = 10
+
+NPY_MAGIC = b"\x93NUMPY"
+NPY_ALIGNMENT = 64
+# array typecode -> .npy dtype, narrowest first.
+INT_DTYPES = {"b": "|i1", "h": "<i2", "i": "<i4", "q": "<i8"}
+NPY_TYPECODES = {descr: code for code, descr in INT_DTYPES.items()}
+NPY_TYPECODES["|u1"] = "B"
+
+# One row per column: rows that are neither integer nor NULL, and the
+# column's range.
+COLUMN_STATS_QUERY = """
+    SELECT SUM(typeof({column}) NOT IN ('integer', 'null')), MIN({column}), MAX({column})
+    FROM {table}
+"""
+
+
+def _int_typecode(low, high):
+    """
+    The narrowest typecode whose range holds low..high with its minimum
+    left free for NULL.
+    """
+    for code in INT_DTYPES:
+        bits = array.array(code).itemsize * 8
+        if -2 ** (bits - 1) < low and high < 2 ** (bits - 1):
+            return code
+    raise ValueError(f"integers {low}..{high} do not fit in 64 bits")
+
+
+def _null(typecode):
+    return -2 ** (array.array(typecode).itemsize * 8 - 1)
+
+
+def write_npy(path, values):
+    """
+    Write array values as a one-dimensional .npy file (format 1.0).
+    """
+    descr = INT_DTYPES.get(values.typecode, "|u1")
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({len(values)},), }}"
+    # The data starts on an NPY_ALIGNMENT boundary: magic, version, length,
+    # header, padding and a newline.
+    padding = -(len(NPY_MAGIC) + 4 + len(header) + 1) % NPY_ALIGNMENT
+    header = (header + " " * padding + "\n").encode("latin1")
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    with open(path, "wb") as f:
+        f.write(NPY_MAGIC + b"\x01\x00" + struct.pack("<H", len(header)) + header)
+        values.tofile(f)
+
+
+def _npy_data(buffer, path):
+    """
+    Return (typecode, offset of the data) of the .npy file in buffer.
+    """
+    if buffer[:len(NPY_MAGIC)] != NPY_MAGIC:
+        raise ValueError(f"{path}: not a .npy file")
+    major = buffer[len(NPY_MAGIC)]
+    size_format = "<H" if major == 1 else "<I"
+    start = len(NPY_MAGIC) + 2
+    (length,) = struct.unpack_from(size_format, buffer, start)
+    start += struct.calcsize(size_format)
+    header = ast.literal_eval(bytes(buffer[start:start + length]).decode("latin1"))
+    if header["descr"] not in NPY_TYPECODES or header["fortran_order"] \
+            or len(header["shape"]) != 1:
+        raise ValueError(f"{path}: expected a one-dimensional integer array, got {header}")
+    return NPY_TYPECODES[header["descr"]], start + length
+
+
+class _StringPool:
+    """
+    Codes of the strings seen so far, in order of first appearance.
+    """
+
+    def __init__(self):
+        self.codes = {}
+
+    def code(self, value):
+        if value is None:
+            return NULL_CODE
+        if not isinstance(value, str):
+            value = str(value)
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def sorted(self):
+        """
+        Return (strings in sorted order, list mapping each code to its
+        sorted code). The mapping ends with NULL_CODE, so NULL_CODE maps to
+        itself.
+        """
+        strings = sorted(self.codes)
+        position = {s: i for i, s in enumerate(strings)}
+        remap = [position[s] for s in self.codes]
+        remap.append(NULL_CODE)
+        return strings, remap
+
+
+def export(conn, directory, batch_size=importer.DEFAULT_BATCH_SIZE):
+    """
+    Write a snapshot of the base tables to directory, which must not exist.
+    Every table is read in one transaction, so they are consistent with each
+    other. The manifest is written last: a directory without one is an
+    export that did not finish. Returns the manifest.
+    """
+    os.makedirs(directory)
+    pool = _StringPool()
+    tables = {}
+    columns = {}
+    conn.execute("BEGIN")
+    try:
+        for table, names in importer.TABLE_COLUMNS.items():
+            info = {}
+            for name in names:
+                others, low, high = conn.execute(
+                    COLUMN_STATS_QUERY.format(table=table, column=name)).fetchone()
+                # A column with any non-integer value is stored as text.
+                typecode = "i" if others else _int_typecode(low or 0, high or 0)
+                columns[table, name] = array.array(typecode)
+                info[name] = {"text": bool(others),
+                              "null": NULL_CODE if others else _null(typecode)}
+            arrays = [columns[table, name] for name in names]
+            rows = 0
+            cursor = conn.execute(f"SELECT {', '.join(names)} FROM {table}")
+            for batch in importer.batches(cursor, batch_size):
+                rows += len(batch)
+                for name, values, column in zip(names, zip(*batch), arrays):
+                    if info[name]["text"]:
+                        column.extend(map(pool.code, values))
+                    else:
+                        null = info[name]["null"]
+                        column.extend(null if v is None else v for v in values)
+            tables[table] = {"rows": rows, "columns": info}
+        (schema_version,) = conn.execute("PRAGMA user_version").fetchone()
+    finally:
+        conn.execute("COMMIT")
+
+    strings, remap = pool.sorted()
+    for (table, name), values in columns.items():
+        if tables[table]["columns"][name]["text"]:
+            values = array.array("i", map(remap.__getitem__, values))
+        filename = f"{table}.{name}.npy"
+        write_npy(os.path.join(directory, filename), values)
+        tables[table]["columns"][name].update(file=filename, dtype=INT_DTYPES[values.typecode])
+    encoded = [s.encode("utf-8") for s in strings]
+    write_npy(os.path.join(directory, STRING_OFFSETS),
+              array.array("q", itertools.accumulate(map(len, encoded), initial=0)))
+    write_npy(os.path.join(directory, STRINGS), array.array("B", b"".join(encoded)))
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "schema_version": schema_version,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "strings": len(strings),
+        "tables": tables,
+    }
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+class Snapshot:
+    """
+    A snapshot directory, memory-mapped. column() returns a read-only
+    memoryview over a column's file; the views are invalid once the
+    snapshot is closed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest["format"] != FORMAT_VERSION:
+            raise ValueError(f"{directory}: snapshot format {self.manifest['format']}, "
+                             f"expected {FORMAT_VERSION}")
+        self.tables = self.manifest["tables"]
+        self._maps = []
+        self._views = {}
+        self._strings = self._map(STRINGS)
+        self._offsets = self._map(STRING_OFFSETS)
+
+    @classmethod
+    def open(cls, directory):
+        return cls(directory)
+
+    def _map(self, filename):
+        path = os.path.join(self.directory, filename)
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        buffer = memoryview(mapped)
+        typecode, start = _npy_data(buffer, path)
+        view = buffer[start:].cast(typecode)
+        if sys.byteorder == "big" and view.itemsize > 1:
+            # The files are little-endian: big-endian hosts get a copy.
+            copy = array.array(typecode, view.tobytes())
+            copy.byteswap()
+            view = memoryview(copy)
+        self._views[filename] = view
+        return view
+
+    def rows(self, table):
+        return self.tables[table]["rows"]
+
+    def column(self, table, name):
+        """
+        The values of table.name: integers, NULL as null(table, name), or
+        string codes for text columns.
+        """
+        filename = self.tables[table]["columns"][name]["file"]
+        view = self._views.get(filename)
+        return view if view is not None else self._map(filename)
+
+    def is_text(self, table, name):
+        return self.tables[table]["columns"][name]["text"]
+
+    def null(self, table, name):
+        return self.tables[table]["columns"][name]["null"]
+
+    def string(self, code):
+        """
+        The string of a pool code, None for NULL_CODE.
+        """
+        if code == NULL_CODE:
+            return None
+        return bytes(self._strings[self._offsets[code]:self._offsets[code + 1]]).decode("utf-8")
+
+    def code(self, string):
+        """
+        The pool code of string, None if no column holds it.
+        """
+        low, high = 0, self.manifest["strings"]
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(middle) < string:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.manifest["strings"] and self.string(low) == string else None
+
+    def value(self, table, name, stored):
+        """
+        The database value of a stored value of table.name.
+        """
+        if stored == self.null(table, name):
+            return None
+        return self.string(stored) if self.is_text(table, name) else stored
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views.clear()
+        self._strings = self._offsets = None
+        for mapped in self._maps:
+            mapped.close()
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def hashtag_counts(snapshot, limit=DEFAULT_LIMIT):
+    """
+    The limit most mentioned hashtag terms as [(term, mentions)], ties in
+    term order. Terms are normalized as in trending.py, so "#Toronto" and
+    "toronto" are one hashtag.
+    """
+    counts = collections.Counter(snapshot.column("hashtag_mentions", "term"))
+    counts.pop(snapshot.null("hashtag_mentions", "term"), None)
+    # Each distinct stored term is decoded once, not each mention.
+    terms = collections.Counter()
+    for code, mentions in counts.items():
+        terms[migrations.normalize_term(snapshot.string(code))] += mentions
+    return heapq.nsmallest(limit, terms.items(), key=lambda item: (-item[1], item[0]))
+
+
+def follower_distribution(snapshot):
+    """
+    How many users have each number of followers, as [(followers, users)]
+    by followers, including the users nobody follows. Follows of ids with
+    no row in users are left out.
+    """
+    users = set(snapshot.column("users", "usr"))
+    followers = collections.Counter(snapshot.column("follows", "flwee"))
+    distribution = collections.Counter(
+        count for flwee, count in followers.items() if flwee in users)
+    distribution[0] = len(users) - sum(distribution.values())
+    return sorted((n, users) for n, users in distribution.items() if users)
+
+
+def spam_rates(snapshot, min_retweets=DEFAULT_MIN_RETWEETS, limit=DEFAULT_LIMIT):
+    """
+    The retweeters with at least min_retweets retweets whose retweets are
+    most often spam, as [(retweeter_id, retweets, spam, rate)]. Ties go to
+    more retweets, then to the lower id.
+    """
+    retweeters = snapshot.column("retweets", "retweeter_id")
+    retweets = collections.Counter(retweeters)
+    # Spam is 1; 0 and NULL (the column's minimum) are not.
+    spam = collections.Counter(itertools.compress(
+        retweeters, map((0).__lt__, snapshot.column("retweets", "spam"))))
+    rates = [(retweeter, count, spam[retweeter], spam[retweeter] / count)
+             for retweeter, count in retweets.items() if count >= min_retweets]
+    top = heapq.nsmallest(limit, rates, key=lambda r: (-r[3], -r[1], r[0]))
+    return [(snapshot.value("retweets", "retweeter_id", retweeter), count, n, rate)
+            for retweeter, count, n, rate in top]
+
+
+def export_main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="twitter.py export",
+        description="Export the tables of a microtweet database to a columnar snapshot.")
+    parser.add_argument("database_file")
+    parser.add_argument("directory", help="where to write the snapshot; must not exist")
+    db.add_connection_arguments(parser)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.database_file):
+        parser.error(f"{args.database_file}: no such database")
+    if os.path.exists(args.directory):
+        parser.error(f"{args.directory} already exists")
+
+    conn = db.connect(args.database_file, read_only=True, **db.connection_options(args))
+    start = time.perf_counter()
+    try:
+        manifest = export(conn, args.directory)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+
+    for table, info in manifest["tables"].items():
+        size = sum(os.path.getsize(os.path.join(args.directory, c["file"]))
+                   for c in info["columns"].values())
+        print(f"{table:20} {info['rows']:>10,} rows {size:>14,} bytes")
+    size = sum(os.path.getsize(os.path.join(args.directory, f))
+               for f in (STRINGS, STRING_OFFSETS))
+    print(f"{'(string pool)':20} {manifest['strings']:>10,} strs {size:>14,} bytes")
+    print(f"Exported in {elapsed:.2f}s")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Hashtag counts, the follower distribution and retweet spam "
+                    "rates of a snapshot (see python3 twitter.py export).")
+    parser.add_argument("directory")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--min-retweets", type=int, default=DEFAULT_MIN_RETWEETS,
+                        help="retweets a user needs to be ranked by spam rate "
+                             f"(default: {DEFAULT_MIN_RETWEETS})")
+    args = parser.parse_args()
+
+    with Snapshot.open(args.directory) as snapshot:
+        print(f"Snapshot of {snapshot.manifest['created']}, "
+              f"schema version {snapshot.manifest['schema_version']}")
+        print("\nTop hashtags:")
+        for rank, (term, mentions) in enumerate(hashtag_counts(snapshot, args.limit), 1):
+            print(f"{rank:3}. {term} ({mentions:,} mentions)")
+        print("\nFollowers per user:")
+        # Shown in power-of-two buckets: 0, 1, 2-3, 4-7, ...
+        buckets = collections.Counter()
+        for followers, users in follower_distribution(snapshot):
+            buckets[followers.bit_length()] += users
+        for bits, users in sorted(buckets.items()):
+            low, high = (0, 0) if bits == 0 else (2 ** (bits - 1), 2 ** bits - 1)
+            label = f"{low}" if low == high else f"{low}-{high}"
+            print(f"{label:>13} {users:>10,} users")
+        print(f"\nRetweet spam rates (at least {args.min_retweets} retweets):")
+        for retweeter, retweets, spam, rate in spam_rates(
+                snapshot, args.min_retweets, args.limit):
+            print(f"UserID={retweeter}: {spam:,} of {retweets:,} retweets spam ({rate:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1028 @@
+"""
+Data-access layer of microtweet.
+
+MicroTweetStore holds every query the client runs and returns typed rows;
+twitter.py only does the input()/print() around it. Anything that needs the
+data without the menus (benchmarks, scripts, another frontend) can use the
+store directly:
+
+    store = MicroTweetStore.open("microtweet.db")
+    for items, has_more in store.feed_pages(user_id):
+        ...
+"""
+import collections
+import dataclasses
+import datetime
+import itertools
+import json
+import re
+
+import cache
+import counters
+import credentials
+import db
+import graph
+import migrations
+import queries
+import timeline
+import trending
+
+
+class StoreError(Exception):
+    """
+    A request the store refused. str(e) is a message meant for the user.
+    """
+
+
+class InvalidEmail(StoreError):
+    def __init__(self):
+        super().__init__("Invalid email format.")
+
+
+class CannotFollowSelf(StoreError):
+    def __init__(self):
+        super().__init__("You cannot follow yourself.")
+
+
+class AlreadyFollowing(StoreError):
+    def __init__(self):
+        super().__init__("You already follow this user.")
+
+
+class NotFollowing(StoreError):
+    def __init__(self):
+        super().__init__("You do not follow this user.")
+
+
+class UserNotFound(StoreError):
+    def __init__(self):
+        super().__init__("User does not exist.")
+
+
+class TweetNotFound(StoreError):
+    def __init__(self, message="Tweet does not exist for retweet."):
+        super().__init__(message)
+
+
+class ListExists(StoreError):
+    def __init__(self):
+        super().__init__("You already have a list with that name.")
+
+
+class ListNotFound(StoreError):
+    def __init__(self):
+        super().__init__("You have no list with that name.")
+
+
+class AlreadyInList(StoreError):
+    def __init__(self):
+        super().__init__("This tweet is already in that list.")
+
+
+class NotInList(StoreError):
+    def __init__(self):
+        super().__init__("This tweet is not in that list.")
+
+
+@dataclasses.dataclass(frozen=True)
+class User:
+    usr: int
+    name: str
+
+
+@dataclasses.dataclass(frozen=True)
+class UserStats:
+    usr: int
+    tweets: int
+    following: int
+    followers: int
+
+
+@dataclasses.dataclass(frozen=True)
+class UserSummary:
+    """
+    A user in a follower or followee list, with their counts and whether
+    the user viewing the list follows them.
+    """
+    usr: int
+    name: str
+    tweets: int
+    following: int
+    followers: int
+    followed: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class Suggestion:
+    """
+    A user to follow, followed by `via` of the user's followees.
+    """
+    usr: int
+    name: str
+    via: int
+    followers: int
+
+
+@dataclasses.dataclass(frozen=True)
+class Tweet:
+    tid: int
+    writer_id: int
+    tdate: str
+    ttime: str
+    text: str
+
+
+@dataclasses.dataclass(frozen=True)
+class TweetStats:
+    tid: int
+    retweets: int
+    replies: int
+
+
+@dataclasses.dataclass(frozen=True)
+class FeedItem:
+    """
+    A tweet or retweet in a home feed. Retweets have ttime ''; ts is the
+    epoch seconds the feed is ordered by.
+    """
+    ttype: str
+    tid: int
+    tdate: str
+    ttime: str
+    spam: int
+    ts: int
+
+
+@dataclasses.dataclass(frozen=True)
+class ReplyNode:
+    """
+    A tweet of a conversation with the replies loaded under it, oldest
+    first. replies counts all of its replies, loaded or not.
+    """
+    tweet: Tweet
+    ts: int
+    replies: int
+    children: tuple
+
+    @property
+    def hidden_replies(self):
+        return self.replies - len(self.children)
+
+
+@dataclasses.dataclass(frozen=True)
+class Conversation:
+    """
+    The tweets a tweet replies to, root first, and the tree of its replies.
+    """
+    ancestors: tuple
+    focus: ReplyNode
+
+
+@dataclasses.dataclass(frozen=True)
+class FavoriteList:
+    """
+    A favorite list with the tids in it and the Tweets behind them.
+    """
+    lname: str
+    tids: tuple
+    tweets: tuple = ()
+
+
+@dataclasses.dataclass(frozen=True)
+class Trend:
+    term: str
+    mentions: int
+
+
+FEED_PAGE_SIZE = 5
+SEARCH_PAGE_SIZE = 5
+RECENT_TWEETS = 3
+THREAD_ANCESTORS = 20
+THREAD_DEPTH = 4
+THREAD_WIDTH = 5
+THREAD_MAX_TWEETS = 100
+
+# The feed is read one page at a time, keyed on the last row shown, so only a
+# single page is ever held in memory no matter how many tweets the followees
+# have written. (ts, tid, ttype) is unique across the UNION and gives a
+# total order. Each followee contributes at most :limit + 1 of their newest
+# posts, read in order from idx_tweets_writer_ts / idx_retweets_retweeter_ts
+# (the + 1 makes up for the row equal to the keyset that the outer filter
+# drops), so only those candidates are merged and sorted.
+# Named parameters: :user, :limit and, after the first page, :ts, :tid, :ttype.
+FEED_QUERY = """
+    SELECT ttype, tid, tdate, ttime, spam, ts FROM (
+        SELECT
+            'tweet' AS ttype,
+            t.tid,
+            t.tdate,
+            COALESCE(t.ttime, '') AS ttime,
+            0 AS spam,
+            t.ts
+        FROM follows f JOIN tweets t ON t.rowid IN (
+            SELECT rowid FROM tweets
+            WHERE writer_id = f.flwee {followee_keyset}
+            ORDER BY ts DESC, tid DESC
+            LIMIT :limit + 1)
+        WHERE f.flwer = :user
+        UNION
+        SELECT
+            'retweet' AS ttype,
+            r.tid,
+            r.rdate AS tdate,
+            '' AS ttime,
+            r.spam,
+            r.ts
+        FROM follows f JOIN retweets r ON r.rowid IN (
+            SELECT rowid FROM retweets
+            WHERE retweeter_id = f.flwee AND spam = 0 {followee_keyset}
+            ORDER BY ts DESC, tid DESC
+            LIMIT :limit + 1)
+        WHERE f.flwer = :user
+    )
+    {keyset}
+    ORDER BY ts DESC, tid DESC, ttype DESC
+    LIMIT :limit
+"""
+FEED_FIRST_PAGE_QUERY = FEED_QUERY.format(followee_keyset="", keyset="")
+FEED_NEXT_PAGE_QUERY = FEED_QUERY.format(
+    followee_keyset="AND (ts, tid) <= (:ts, :tid)",
+    keyset="WHERE (ts, tid, ttype) < (:ts, :tid, :ttype)")
+
+# A conversation is one recursive query instead of a query per tweet.
+# ancestors follows replyto_tid up from :tid, at most :ancestors steps (the
+# parent has depth -1). replies walks down from {start} breadth first: every
+# tweet contributes its :width oldest replies, read in order from
+# idx_tweets_replyto_ts, down to depth :depth and :max_tweets tweets in all,
+# so a huge thread costs no more than a small one. tweet_stats.replies tells
+# how many replies of each tweet were left out; the replies_* variants load
+# them later, starting from the :width replies of :tid (after (:ts, :after)).
+THREAD_QUERY = """
+    WITH RECURSIVE
+    ancestors(tid, depth) AS (
+        SELECT replyto_tid, -1 FROM tweets
+        WHERE tid = :tid AND replyto_tid IS NOT NULL AND :ancestors > 0
+        UNION ALL
+        SELECT t.replyto_tid, a.depth - 1
+        FROM ancestors AS a JOIN tweets AS t ON t.tid = a.tid
+        WHERE t.replyto_tid IS NOT NULL AND a.depth > -:ancestors
+    ),
+    replies(tid, depth) AS (
+        {start}
+        UNION ALL
+        SELECT t.tid, r.depth + 1
+        FROM replies AS r JOIN tweets AS t ON t.rowid IN (
+            SELECT rowid FROM tweets
+            WHERE replyto_tid = r.tid
+            ORDER BY ts, tid
+            LIMIT :width)
+        WHERE r.depth < :depth
+        LIMIT :max_tweets
+    )
+    SELECT n.depth, t.tid, t.writer_id, t.tdate, t.ttime, t.text, t.replyto_tid, t.ts,
+           COALESCE(s.replies, 0)
+    FROM (SELECT tid, depth FROM ancestors UNION ALL SELECT tid, depth FROM replies) AS n
+    JOIN tweets AS t ON t.tid = n.tid
+    LEFT JOIN tweet_stats AS s ON s.tid = t.tid
+    ORDER BY n.depth, t.ts, t.tid
+"""
+CONVERSATION_QUERY = THREAD_QUERY.format(start="SELECT tid, 0 FROM tweets WHERE tid = :tid")
+REPLIES_QUERY = THREAD_QUERY.format(start="""
+        SELECT tid, 1 FROM (
+            SELECT tid FROM tweets
+            WHERE replyto_tid = :tid {keyset}
+            ORDER BY ts, tid
+            LIMIT :width)""")
+REPLIES_FIRST_PAGE_QUERY = REPLIES_QUERY.replace("{keyset}", "")
+REPLIES_NEXT_PAGE_QUERY = REPLIES_QUERY.replace("{keyset}", "AND (ts, tid) > (:ts, :after)")
+
+# Every list of a user with its tweets, in one pass: lists and include are
+# both read in primary key order, so the rows come out grouped by list (and
+# by tid within a list) without a sort. Empty lists give one row of NULLs.
+FAVORITE_LISTS_QUERY = """
+    SELECT l.lname, i.tid, t.tid, t.writer_id, t.tdate, t.ttime, t.text
+    FROM lists AS l
+    LEFT JOIN include AS i ON i.owner_id = l.owner_id AND i.lname = l.lname
+    LEFT JOIN tweets AS t ON t.tid = i.tid
+    WHERE l.owner_id = ?
+    ORDER BY l.lname, i.tid
+"""
+
+# Shortest keyword the trigram index in tweets_fts can look up.
+FTS_MIN_KEYWORD = 3
+
+# The whole keyword list is compiled into one statement of fixed shape: the
+# keyword groups are bound as JSON arrays and expanded with json_each, so the
+# number of bound parameters never depends on the number of keywords or hits.
+# Parameters: the FTS5 match expression (twice, may be NULL; FTS variant only),
+# JSON array of LIKE keywords, JSON array of hashtag terms, LIMIT, OFFSET.
+SEARCH_QUERY = """
+    WITH
+    {text_hits},
+    like_hits(tid) AS (
+        SELECT t.tid
+        FROM json_each(?) AS k CROSS JOIN tweets AS t
+        WHERE lower(t.text) LIKE '%' || k.value || '%'
+    ),
+    tag_hits(tid) AS (
+        SELECT tid
+        FROM hashtag_mentions
+        WHERE {tag_term} IN (SELECT value FROM json_each(?))
+    ),
+    hits(tid, rank) AS (
+        SELECT tid, rank FROM text_hits
+        UNION ALL
+        SELECT tid, 0.0 FROM like_hits
+        UNION ALL
+        SELECT tid, 0.0 FROM tag_hits
+    )
+    SELECT t.tid, t.writer_id, t.tdate, t.ttime, t.text
+    FROM (SELECT tid, MIN(rank) AS rank FROM hits GROUP BY tid) AS h
+    JOIN tweets AS t ON t.tid = h.tid
+    ORDER BY h.rank, t.ts DESC, t.tid DESC
+    LIMIT ? OFFSET ?
+"""
+SEARCH_FTS_QUERY = SEARCH_QUERY.format(tag_term=migrations.trending_term("term"), text_hits="""
+    text_hits(tid, rank) AS (
+        SELECT rowid, rank
+        FROM tweets_fts
+        WHERE ? IS NOT NULL AND tweets_fts MATCH ?
+    )""")
+SEARCH_LIKE_QUERY = SEARCH_QUERY.format(tag_term=migrations.trending_term("term"), text_hits="""
+    text_hits(tid, rank) AS (
+        SELECT NULL, NULL WHERE 0
+    )""")
+
+HASHTAG_RE = re.compile(r"#(\w+)")
+
+
+def fts_match_expression(keywords):
+    """
+    OR together keywords as quoted FTS5 phrases, so punctuation in a keyword is
+    matched literally instead of being parsed as query syntax.
+    """
+    phrases = ['"' + kw.replace('"', '""') + '"' for kw in keywords]
+    return " OR ".join(phrases)
+
+
+def compile_search(keywords, fts=True):
+    """
+    Turn lower-cased keywords into (query name, params) for SEARCH_QUERY,
+    minus the trailing LIMIT/OFFSET parameters.
+    A tweet matches a '#kw' keyword through its hashtags only, and a plain
+    keyword through its text or its hashtags. With fts (tweets_fts exists),
+    text keywords long enough for its trigram index are looked up with a
+    single ranked MATCH and those hits come first in bm25 order; shorter
+    keywords, and all of them on builds without FTS5, use lower(text) LIKE.
+    """
+    text_keywords = [kw for kw in keywords if not kw.startswith('#')]
+    tags = [kw.lstrip('#') for kw in keywords]
+
+    if fts:
+        fts_keywords = [kw for kw in text_keywords if len(kw) >= FTS_MIN_KEYWORD]
+        like_keywords = [kw for kw in text_keywords if len(kw) < FTS_MIN_KEYWORD]
+        match = fts_match_expression(fts_keywords) if fts_keywords else None
+        return "search_tweets_fts", (match, match, json.dumps(like_keywords), json.dumps(tags))
+
+    return "search_tweets_like", (json.dumps(text_keywords), json.dumps(tags))
+
+
+def extract_hashtags(text):
+    """
+    Return the distinct hashtags of text, lower-cased, in order of appearance.
+    """
+    return list(dict.fromkeys(m.lower() for m in HASHTAG_RE.findall(text)))
+
+
+def reply_trees(rows):
+    """
+    Build ReplyNodes from the rows of THREAD_QUERY at depth 0 and below and
+    return the shallowest ones, oldest first, with the deeper rows as their
+    replies. A tweet reached twice (a reply cycle in damaged data) is kept
+    at its shallowest place only.
+    """
+    seen = set()
+    rows = [row for row in rows
+            if row[0] >= 0 and row[1] not in seen and not seen.add(row[1])]
+    if not rows:
+        return []
+    top_depth = rows[0][0]
+    top = []
+    children = collections.defaultdict(list)
+    # Deepest first, so each tweet's replies are built before it.
+    for depth, tid, writer_id, tdate, ttime, text, replyto_tid, ts, replies in reversed(rows):
+        node = ReplyNode(Tweet(tid, writer_id, tdate, ttime, text), ts, replies,
+                         tuple(reversed(children.pop(tid, []))))
+        (top if depth == top_depth else children[replyto_tid]).append(node)
+    return top[::-1]
+
+
+def offset_pages(fetch, page_size):
+    """
+    Yield (rows, has_more) pages from fetch(limit, offset), calling it only
+    when the generator is advanced.
+    """
+    offset = 0
+    while True:
+        rows = fetch(page_size + 1, offset)
+        if not rows:
+            return
+        has_more = len(rows) > page_size
+        yield rows[:page_size], has_more
+        if not has_more:
+            return
+        offset += page_size
+
+
+def _today():
+    """
+    Return (date, time, epoch seconds) of now; tweets are stamped in local time.
+    """
+    now = datetime.datetime.now()
+    return now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), int(now.timestamp())
+
+
+# Every statement MicroTweetStore runs, by name (see queries.py).
+QUERIES = {
+    "login": "SELECT usr, pwd FROM users WHERE usr = ?",
+    "update_password": "UPDATE users SET pwd = ? WHERE usr = ?",
+    "insert_user": """
+        INSERT INTO users(usr, name, email, phone, pwd)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+    "feed_first_page": FEED_FIRST_PAGE_QUERY,
+    "feed_next_page": FEED_NEXT_PAGE_QUERY,
+    "timeline_first_page": timeline.FEED_FIRST_PAGE_QUERY,
+    "timeline_next_page": timeline.FEED_NEXT_PAGE_QUERY,
+    "search_tweets_fts": SEARCH_FTS_QUERY,
+    "search_tweets_like": SEARCH_LIKE_QUERY,
+    "tweet_stats": counters.TWEET_COUNTS_QUERY,
+    "tweet": "SELECT tid, writer_id, tdate, ttime, text FROM tweets WHERE tid=?",
+    "conversation": CONVERSATION_QUERY,
+    "replies_first_page": REPLIES_FIRST_PAGE_QUERY,
+    "replies_next_page": REPLIES_NEXT_PAGE_QUERY,
+    "insert_tweet": """
+        INSERT INTO tweets(tid, writer_id, text, tdate, ttime, replyto_tid, ts)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    "insert_hashtags": "INSERT OR IGNORE INTO hashtag_mentions(tid, term) VALUES (?, ?)",
+    "insert_retweet": """
+        INSERT INTO retweets(tid, retweeter_id, writer_id, spam, rdate, ts)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    "list_names": "SELECT lname FROM lists WHERE owner_id=?",
+    "list_exists": "SELECT 1 FROM lists WHERE owner_id=? AND lname=?",
+    "insert_list": "INSERT OR IGNORE INTO lists(owner_id, lname) VALUES (?, ?)",
+    "delete_list": "DELETE FROM lists WHERE owner_id=? AND lname=?",
+    # Parameters: :user, :lname, :tids (JSON array). Unknown tids are skipped.
+    "insert_includes": """
+        INSERT OR IGNORE INTO include(owner_id, lname, tid)
+        SELECT DISTINCT :user, :lname, t.tid
+        FROM json_each(:tids) AS j JOIN tweets AS t ON t.tid = j.value
+    """,
+    "delete_include": "DELETE FROM include WHERE owner_id=? AND lname=? AND tid=?",
+    "favorite_lists": FAVORITE_LISTS_QUERY,
+    "trending_hashtags": trending.TOP_QUERY,
+    # Shortest name first; ties keep table order. The LIKE variant walks
+    # idx_users_name_length, so it stops as soon as the page is full.
+    "search_users_fts": """
+        SELECT u.usr, u.name
+        FROM users_fts AS f JOIN users AS u ON u.usr = f.usr
+        WHERE users_fts MATCH ?
+        ORDER BY length(u.name), u.rowid
+        LIMIT ? OFFSET ?
+    """,
+    "search_users_like": """
+        SELECT usr, name
+        FROM users
+        WHERE lower(name) LIKE ?
+        ORDER BY length(name), rowid
+        LIMIT ? OFFSET ?
+    """,
+    "user_stats": counters.USER_COUNTS_QUERY,
+    "user_tweets": """
+        SELECT tid, writer_id, tdate, ttime, text
+        FROM tweets
+        WHERE writer_id=?
+        ORDER BY ts DESC, tid DESC
+        LIMIT ?
+    """,
+    "user_exists": "SELECT 1 FROM users WHERE usr=?",
+    "follows": "SELECT 1 FROM follows WHERE flwer=? AND flwee=?",
+    # Rows the last INSERT/UPDATE/DELETE changed, not counting triggers.
+    "changes": "SELECT changes()",
+    "follow_many": graph.FOLLOW_MANY_QUERY,
+    "unfollow_many": graph.UNFOLLOW_MANY_QUERY,
+    "followers": "SELECT flwer FROM follows WHERE flwee=?",
+    "follower_summaries": graph.FOLLOWERS_QUERY,
+    "following_summaries": graph.FOLLOWING_QUERY,
+    "mutuals": graph.MUTUALS_QUERY,
+    "follow_suggestions": graph.SUGGESTIONS_QUERY,
+}
+
+
+class MicroTweetStore:
+    """
+    Queries and writes of the microtweet client over one connection.
+    Read methods return User, Tweet, FeedItem, ... objects; write methods
+    commit before returning. Refused requests raise a StoreError; database
+    failures propagate as sqlite3.Error.
+    Statements run by name through a QueryRegistry, which times them.
+    User stats, recent tweets, tweets and tweet stats are kept in per-store
+    LRU caches (see cache.py); the store's own writes invalidate them.
+    A read_only store (over a db.connect(read_only=True) connection) only
+    serves reads; it skips trimming timelines when reading a feed.
+    With a write_queue (see writequeue.py) writes are applied and committed
+    by the queue, and reads flush it first if it holds uncommitted writes.
+    Passwords are hashed and checked by a credentials.Verifier, which
+    several stores can share. A read_only store cannot store the new hash
+    of a password it rehashes at login; it passes (user id, hash) to
+    on_rehash, if given, to be written elsewhere (see set_password_hash).
+    """
+
+    def __init__(self, conn, registry=None,
+                 cache_entries=cache.DEFAULT_MAX_ENTRIES, cache_ttl=cache.DEFAULT_TTL,
+                 read_only=False, write_queue=None, verifier=None, on_rehash=None):
+        self.conn = conn
+        self.read_only = read_only
+        self.on_rehash = on_rehash
+        self.write_queue = write_queue
+        self._owns_verifier = verifier is None
+        self.verifier = verifier if verifier is not None else credentials.Verifier()
+        self.queries = registry if registry is not None else queries.QueryRegistry(QUERIES)
+        self.caches = {
+            "users": cache.LRUCache(cache_entries, cache_ttl),
+            "tweets": cache.LRUCache(cache_entries, cache_ttl),
+        }
+        self._fts = migrations.has_table(conn, "tweets_fts")
+        self._users_fts = migrations.has_table(conn, "users_fts")
+
+    @classmethod
+    def open(cls, db_name, registry=None, **connect_options):
+        """
+        Connect to db_name with db.connect(**connect_options) and migrate it.
+        """
+        conn = db.connect(db_name, **connect_options)
+        migrations.migrate(conn)
+        return cls(conn, registry)
+
+    # Cache keys use str ids, so '12' from the database and 12 from a
+    # batch command name the same entry.
+
+    def _user_changed(self, user_id):
+        self.caches["users"].invalidate(("stats", str(user_id)), ("recent", str(user_id)))
+
+    def _tweet_changed(self, tid):
+        self.caches["tweets"].invalidate(("tweet", str(tid)), ("stats", str(tid)))
+
+    def close(self):
+        if self.write_queue is not None:
+            self.write_queue.close()
+        if self._owns_verifier:
+            self.verifier.close()
+        self.conn.close()
+
+    def _all(self, name, params=()):
+        self._settle()
+        return self.queries.execute(self.conn, name, params)
+
+    def _one(self, name, params=()):
+        self._settle()
+        return self.queries.execute_one(self.conn, name, params)
+
+    def _settle(self):
+        if self.write_queue is not None and self.write_queue.pending:
+            self.write_queue.flush()
+
+    def _write(self, fn, *args):
+        """
+        Run fn(self, *args), or fn(queue's store, *args) on the write queue.
+        """
+        if self.write_queue is None:
+            return fn(self, *args)
+        return self.write_queue.submit(fn, *args)
+
+    # --- accounts ---
+
+    def login(self, usr, pwd):
+        """
+        Return the user id if usr/pwd are valid, otherwise None. A user with
+        too many recent failures is refused without checking. A password
+        stored in plaintext or under an outdated scheme is rehashed (by a
+        read_only store, through on_rehash). Unknown users take as long as
+        a wrong password.
+        """
+        failed_logins = self.verifier.failed_logins
+        if failed_logins.blocked(str(usr)):
+            return None
+        row = self._one("login", (usr,))
+        matches, rehash = (False, False)
+        if row is not None and row[1] is not None:
+            matches, rehash = self.verifier.verify(pwd, row[1])
+        else:
+            self.verifier.verify_missing(pwd)
+        if not matches:
+            failed_logins.failed(str(usr))
+            return None
+        failed_logins.succeeded(str(usr))
+        if rehash and not self.read_only:
+            self.set_password_hash(row[0], self.verifier.hash(pwd))
+        elif rehash and self.on_rehash is not None:
+            self.on_rehash(row[0], self.verifier.hash(pwd))
+        return row[0]
+
+    def set_password_hash(self, usr, pwd_hash):
+        """
+        Store pwd_hash, an encoded hash from the verifier, as usr's password.
+        """
+        self._write(MicroTweetStore._update_password, usr, pwd_hash)
+
+    def _update_password(self, usr, pwd_hash):
+        with db.write_transaction(self.conn):
+            self._all("update_password", (pwd_hash, usr))
+
+    def signup(self, name, email, phone, pwd):
+        """
+        Create a user and return the new user id (as a string) from the users
+        sequence (see db.allocate_id).
+        """
+        if "@" not in email or "." not in email:
+            raise InvalidEmail()
+        new_id = self._write(MicroTweetStore._insert_user, name, email, phone,
+                             self.verifier.hash(pwd))
+        self._user_changed(new_id)
+        return str(new_id)
+
+    def _insert_user(self, name, email, phone, pwd):
+        with db.write_transaction(self.conn):
+            new_id = db.allocate_id(self.conn, "users")
+            self._all("insert_user", (new_id, name, email, phone, pwd))
+        return new_id
+
+    # --- home feed ---
+
+    def feed_pages(self, user_id, page_size=FEED_PAGE_SIZE):
+        """
+        Yield (items, has_more) pages of user_id's feed, newest first.
+        Each page is queried only when the generator is advanced, starting
+        after the last item of the previous page, so at most page_size + 1
+        rows are fetched at a time. With fan-out-on-write enabled the pages
+        come from the user's materialized timeline (see timeline.py).
+        """
+        conn = self.conn
+        if timeline.enabled(conn):
+            if not self.read_only:
+                with self.queries.measure("timeline.trim"), db.write_transaction(conn):
+                    timeline.trim(conn, user_id)
+            first_query, next_query = "timeline_first_page", "timeline_next_page"
+            params = timeline.feed_params(conn, user_id)
+        else:
+            first_query, next_query = "feed_first_page", "feed_next_page"
+            params = {"user": user_id}
+        params["limit"] = page_size + 1
+
+        rows = self._all(first_query, params)
+        while rows:
+            has_more = len(rows) > page_size
+            items = [FeedItem(*row) for row in rows[:page_size]]
+            yield items, has_more
+            if not has_more:
+                return
+            last = items[-1]
+            rows = self._all(next_query, dict(params, ts=last.ts, tid=last.tid,
+                                              ttype=last.ttype))
+
+    # --- tweets ---
+
+    def search_tweets(self, keywords, limit=SEARCH_PAGE_SIZE, offset=0):
+        """
+        Return up to limit Tweets matching any of the lower-cased keywords,
+        best match first, starting at offset (see compile_search).
+        """
+        name, params = compile_search(keywords, self._fts)
+        return [Tweet(*row) for row in self._all(name, params + (limit, offset))]
+
+    def search_tweet_pages(self, keywords, page_size=SEARCH_PAGE_SIZE):
+        return offset_pages(
+            lambda limit, offset: self.search_tweets(keywords, limit, offset),
+            page_size)
+
+    def tweet(self, tid):
+        """
+        Return the Tweet tid, or None if there is no such tweet.
+        """
+        def load():
+            row = self._one("tweet", (tid,))
+            return Tweet(*row) if row else None
+        return self.caches["tweets"].get(("tweet", str(tid)), load)
+
+    def tweet_stats(self, tid):
+        def load():
+            row = self._one("tweet_stats", (tid,))
+            return TweetStats(tid, *(row if row else (0, 0)))
+        return self.caches["tweets"].get(("stats", str(tid)), load)
+
+    def post_tweet(self, writer_id, text, replyto_tid=None):
+        """
+        Write a tweet (or a reply, if replyto_tid is given) together with its
+        hashtag_mentions rows and timeline fan-out in a single transaction, so
+        a post is stored either completely or not at all.
+        Returns (new tid, hashtags).
+        """
+        tdate, ttime, ts = _today()
+        hashtags = extract_hashtags(text)
+        new_tid = self._write(MicroTweetStore._insert_tweet,
+                              writer_id, text, replyto_tid, hashtags, tdate, ttime, ts)
+        self._user_changed(writer_id)
+        self._tweet_changed(new_tid)
+        if replyto_tid is not None:
+            self._tweet_changed(replyto_tid)
+        return new_tid, hashtags
+
+    def _insert_tweet(self, writer_id, text, replyto_tid, hashtags, tdate, ttime, ts):
+        conn = self.conn
+        with db.write_transaction(conn):
+            new_tid = db.allocate_id(conn, "tweets")
+            self._all("insert_tweet", (new_tid, writer_id, text, tdate, ttime, replyto_tid, ts))
+            self.queries.executemany(conn, "insert_hashtags", [(new_tid, h) for h in hashtags])
+            with self.queries.measure("timeline.fan_out"):
+                timeline.fan_out(conn, writer_id, 'tweet', new_tid, tdate, ttime, ts)
+        return new_tid
+
+    def retweet(self, user_id, tid):
+        tweet = self.tweet(tid)
+        if tweet is None:
+            raise TweetNotFound()
+        rdate, _, ts = _today()
+        self._write(MicroTweetStore._insert_retweet, user_id, tid, tweet.writer_id, rdate, ts)
+        self._tweet_changed(tid)
+
+    def _insert_retweet(self, user_id, tid, writer_id, rdate, ts):
+        conn = self.conn
+        with db.write_transaction(conn):
+            self._all("insert_retweet", (tid, user_id, writer_id, 0, rdate, ts))
+            with self.queries.measure("timeline.fan_out"):
+                timeline.fan_out(conn, user_id, 'retweet', tid, rdate, None, ts)
+
+    # --- conversations ---
+
+    def conversation(self, tid, depth=THREAD_DEPTH, width=THREAD_WIDTH,
+                     max_tweets=THREAD_MAX_TWEETS, ancestors=THREAD_ANCESTORS):
+        """
+        Return the Conversation of tweet tid, or None if there is no such
+        tweet: up to `ancestors` of the tweets it replies to, and its
+        replies, `width` per tweet, `depth` levels and `max_tweets` tweets
+        deep, read with a single query (see THREAD_QUERY). Replies left out
+        show up in each ReplyNode's hidden_replies; replies() loads them.
+        """
+        rows = self._all("conversation", {"tid": tid, "ancestors": ancestors, "depth": depth,
+                                          "width": width, "max_tweets": max_tweets})
+        focus = reply_trees(rows)
+        if not focus:
+            return None
+        return Conversation(tuple(Tweet(*row[1:6]) for row in rows if row[0] < 0), focus[0])
+
+    def replies(self, tid, after=None, depth=THREAD_DEPTH, width=THREAD_WIDTH,
+                max_tweets=THREAD_MAX_TWEETS):
+        """
+        Return the next `width` replies to tid as ReplyNodes, oldest first,
+        each with its own replies loaded as in conversation(). after is the
+        (ts, tid) of the last reply already loaded, if any.
+        """
+        params = {"tid": tid, "ancestors": 0, "depth": depth, "width": width,
+                  "max_tweets": max_tweets}
+        if after is None:
+            return reply_trees(self._all("replies_first_page", params))
+        params["ts"], params["after"] = after
+        return reply_trees(self._all("replies_next_page", params))
+
+    # --- favorite lists ---
+
+    def favorite_list_names(self, user_id):
+        return [row[0] for row in self._all("list_names", (user_id,))]
+
+    def create_favorite_list(self, user_id, lname):
+        if not self._write(MicroTweetStore._insert_list, user_id, lname):
+            raise ListExists()
+
+    def _insert_list(self, user_id, lname):
+        with db.write_transaction(self.conn):
+            self._all("insert_list", (user_id, lname))
+            return self._one("changes")[0]
+
+    def delete_favorite_list(self, user_id, lname):
+        """
+        Delete the list lname; its include rows go with it (ON DELETE CASCADE).
+        """
+        if not self._write(MicroTweetStore._delete_list, user_id, lname):
+            raise ListNotFound()
+
+    def _delete_list(self, user_id, lname):
+        with db.write_transaction(self.conn):
+            self._all("delete_list", (user_id, lname))
+            return self._one("changes")[0]
+
+    def add_to_favorite_list(self, user_id, lname, tid):
+        if not self.add_many_to_favorite_list(user_id, lname, [tid]):
+            if self.tweet(tid) is None:
+                raise TweetNotFound("Tweet does not exist.")
+            raise AlreadyInList()
+
+    def add_many_to_favorite_list(self, user_id, lname, tids):
+        """
+        Add every tweet in tids to the list lname in one transaction and
+        return how many were added; tweets already in it and unknown tids
+        are skipped. Raises ListNotFound if the user has no such list.
+        """
+        return self._write(MicroTweetStore._insert_includes, user_id, lname, list(tids))
+
+    def _insert_includes(self, user_id, lname, tids):
+        with db.write_transaction(self.conn):
+            if self._one("list_exists", (user_id, lname)) is None:
+                raise ListNotFound()
+            self._all("insert_includes", {"user": user_id, "lname": lname,
+                                          "tids": json.dumps(tids)})
+            return self._one("changes")[0]
+
+    def remove_from_favorite_list(self, user_id, lname, tid):
+        if not self._write(MicroTweetStore._delete_include, user_id, lname, tid):
+            raise NotInList()
+
+    def _delete_include(self, user_id, lname, tid):
+        with db.write_transaction(self.conn):
+            self._all("delete_include", (user_id, lname, tid))
+            return self._one("changes")[0]
+
+    def favorite_lists(self, user_id):
+        """
+        Return the user's FavoriteLists, by name, with the tids and Tweets
+        in each (by tid), all read with one query.
+        """
+        lists = []
+        rows = self._all("favorite_lists", (user_id,))
+        for lname, group in itertools.groupby(rows, key=lambda row: row[0]):
+            group = [row for row in group if row[1] is not None]
+            lists.append(FavoriteList(
+                lname, tuple(row[1] for row in group),
+                tuple(Tweet(*row[2:]) for row in group if row[2] is not None)))
+        return lists
+
+    # --- trending hashtags ---
+
+    def trending_hashtags(self, hours=trending.DEFAULT_HOURS, limit=trending.DEFAULT_LIMIT,
+                          now=None):
+        """
+        Return the limit most mentioned hashtags of the last `hours` hours
+        as Trends, most mentions first (see trending.window).
+        """
+        span, first, last = trending.window(hours, now)
+        rows = self._all("trending_hashtags", (span, first, last, limit))
+        return [Trend(*row) for row in rows]
+
+    # --- users ---
+
+    def search_users(self, keyword, limit=-1, offset=0):
+        """
+        Return up to limit Users whose name contains the lower-cased keyword,
+        shortest name first, starting at offset; all of them unless limit is
+        given. Keywords long enough for the trigram index in users_fts are
+        looked up there, shorter ones with lower(name) LIKE.
+        """
+        if self._users_fts and len(keyword) >= FTS_MIN_KEYWORD:
+            name, params = "search_users_fts", (fts_match_expression([keyword]),)
+        else:
+            name, params = "search_users_like", (f"%{keyword}%",)
+        return [User(*row) for row in self._all(name, params + (limit, offset))]
+
+    def search_user_pages(self, keyword, page_size=SEARCH_PAGE_SIZE):
+        return offset_pages(
+            lambda limit, offset: self.search_users(keyword, limit, offset),
+            page_size)
+
+    def user_stats(self, user_id):
+        def load():
+            row = self._one("user_stats", (user_id,))
+            return UserStats(user_id, *(row if row else (0, 0, 0)))
+        return self.caches["users"].get(("stats", str(user_id)), load)
+
+    def recent_tweets(self, user_id):
+        """
+        Return the RECENT_TWEETS newest Tweets of user_id.
+        """
+        return self.caches["users"].get(
+            ("recent", str(user_id)), lambda: self.user_tweets(user_id, RECENT_TWEETS))
+
+    def user_tweets(self, user_id, limit=-1):
+        """
+        Return the Tweets written by user_id, newest first; all of them unless
+        limit is given.
+        """
+        return [Tweet(*row) for row in self._all("user_tweets", (user_id, limit))]
+
+    def is_following(self, user_id, other_id):
+        return self._one("follows", (user_id, other_id)) is not None
+
+    def follow(self, user_id, user_to_follow):
+        # Ids come as ints (signup, login) or as typed strings.
+        if str(user_id) == str(user_to_follow):
+            raise CannotFollowSelf()
+        if not self.follow_many(user_id, [user_to_follow]):
+            if self._one("user_exists", (user_to_follow,)) is None:
+                raise UserNotFound()
+            raise AlreadyFollowing()
+
+    def follow_many(self, user_id, user_ids):
+        """
+        Follow every user in user_ids in one transaction and return how many
+        follows are new; users already followed, unknown users and user_id
+        itself are skipped.
+        """
+        start_date, _, _ = _today()
+        added = self._write(MicroTweetStore._insert_follows, user_id, list(user_ids), start_date)
+        self._user_changed(user_id)
+        for other_id in user_ids:
+            self._user_changed(other_id)
+        return added
+
+    def _insert_follows(self, user_id, user_ids, start_date):
+        conn = self.conn
+        with db.write_transaction(conn):
+            self._all("follow_many", {"user": user_id, "start_date": start_date,
+                                      "users": json.dumps(user_ids)})
+            added = self._one("changes")[0]
+            if added and timeline.enabled(conn):
+                with self.queries.measure("timeline.follow"):
+                    for other_id in user_ids:
+                        timeline.follow(conn, user_id, other_id)
+        return added
+
+    def unfollow(self, user_id, user_to_unfollow):
+        if not self.unfollow_many(user_id, [user_to_unfollow]):
+            raise NotFollowing()
+
+    def unfollow_many(self, user_id, user_ids):
+        """
+        Unfollow every user in user_ids in one transaction and return how
+        many follows were removed.
+        """
+        removed = self._write(MicroTweetStore._delete_follows, user_id, list(user_ids))
+        self._user_changed(user_id)
+        for other_id in user_ids:
+            self._user_changed(other_id)
+        return removed
+
+    def _delete_follows(self, user_id, user_ids):
+        conn = self.conn
+        with db.write_transaction(conn):
+            self._all("unfollow_many", {"user": user_id, "users": json.dumps(user_ids)})
+            removed = self._one("changes")[0]
+            if removed:
+                with self.queries.measure("timeline.unfollow"):
+                    for other_id in user_ids:
+                        timeline.unfollow(conn, user_id, other_id)
+        return removed
+
+    def followers(self, user_id):
+        """
+        Return the ids of the users who follow user_id.
+        """
+        return [row[0] for row in self._all("followers", (user_id,))]
+
+    def follower_summaries(self, user_id, limit=-1, offset=0, viewer=None):
+        """
+        Return up to limit UserSummaries of user_id's followers, by id,
+        starting at offset; all of them unless limit is given. followed
+        tells whether viewer (default: user_id) follows each one.
+        """
+        params = {"user": user_id, "viewer": viewer if viewer is not None else user_id,
+                  "limit": limit, "offset": offset}
+        return [UserSummary(*row[:5], bool(row[5]))
+                for row in self._all("follower_summaries", params)]
+
+    def follower_pages(self, user_id, page_size=SEARCH_PAGE_SIZE):
+        return offset_pages(
+            lambda limit, offset: self.follower_summaries(user_id, limit, offset),
+            page_size)
+
+    def following_summaries(self, user_id, limit=-1, offset=0, viewer=None):
+        """
+        Like follower_summaries, for the users user_id follows.
+        """
+        params = {"user": user_id, "viewer": viewer if viewer is not None else user_id,
+                  "limit": limit, "offset": offset}
+        return [UserSummary(*row[:5], bool(row[5]))
+                for row in self._all("following_summaries", params)]
+
+    def mutuals(self, user_id):
+        """
+        Return the Users who follow user_id and whom user_id follows.
+        """
+        return [User(*row) for row in self._all("mutuals", {"user": user_id})]
+
+    def follow_suggestions(self, user_id, limit=graph.DEFAULT_SUGGESTIONS):
+        """
+        Return up to limit Suggestions of users to follow: those followed by
+        the most of user_id's followees, then by the most followers.
+        """
+        return [Suggestion(*row) for row in
+                self._all("follow_suggestions", {"user": user_id, "limit": limit})]
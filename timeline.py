@@ -0,0 +1,328 @@
+"""
+Fan-out-on-write home feeds.
+
+When enabled, every tweet, reply and retweet is copied into the timeline table
+of each follower of its author as it is written, so opening the feed is a
+range read of the reader's own timeline rows instead of a join over everyone
+they follow. Authors with at least CELEBRITY_FOLLOWERS followers are not fanned
+out; their posts are merged in at read time instead (fan-out-on-read), so a
+single post never has to be copied to a huge follower list.
+
+Each timeline keeps its newest TIMELINE_LIMIT rows; older rows are trimmed
+when the owner opens their feed and by --trim. An unfollow that leaves a
+timeline short refills it from the owner's other followees. When an author drops below the
+threshold (or it is raised), their posts are backfilled into their followers'
+timelines, since they were never fanned out.
+
+    python3 timeline.py <database_file> --enable     # backfill and turn on
+    python3 timeline.py <database_file> --disable    # turn off, drop rows
+    python3 timeline.py <database_file> --backfill   # rebuild all timelines
+    python3 timeline.py <database_file> --trim       # trim all timelines
+    python3 timeline.py <database_file> --verify     # compare with fan-out-on-read
+    python3 timeline.py <database_file> --limit N --celebrity-followers N
+"""
+import argparse
+import sqlite3
+import sys
+
+import migrations
+
+
+DEFAULT_TIMELINE_LIMIT = 800
+DEFAULT_CELEBRITY_FOLLOWERS = 10000
+
+
+def enabled(conn):
+    return bool(migrations.get_setting(conn, "fanout", 0))
+
+
+def timeline_limit(conn):
+    return int(migrations.get_setting(conn, "timeline_limit", DEFAULT_TIMELINE_LIMIT))
+
+
+def celebrity_followers(conn):
+    return int(migrations.get_setting(
+        conn, "celebrity_followers", DEFAULT_CELEBRITY_FOLLOWERS))
+
+
+def is_celebrity(conn, user_id):
+    row = conn.execute(
+        "SELECT followers FROM user_stats WHERE usr = ?", (user_id,)).fetchone()
+    return row is not None and row[0] >= celebrity_followers(conn)
+
+
+# Followees of :user whose posts are read at feed time instead of fanned out.
+CELEBRITY_FOLLOWEES = """
+    SELECT f.flwee
+    FROM follows f JOIN user_stats s ON s.usr = f.flwee
+    WHERE f.flwer = :user AND s.followers >= :celebrity_followers
+"""
+
+# Same columns, parameters and ordering as store.FEED_QUERY. The timeline
+# rows come out of its primary key in order; each celebrity followee adds at
+# most :limit + 1 of their newest posts. The timeline has a row per actor, so
+# a tweet retweeted by two followees is two rows there: DISTINCT makes the
+# :limit + 1 rows distinct posts, as the UNION will count them.
+FEED_QUERY = f"""
+    SELECT ttype, tid, tdate, ttime, spam, ts FROM (
+        SELECT * FROM (
+            SELECT DISTINCT ttype, tid, tdate, ttime, 0 AS spam, ts
+            FROM timeline
+            WHERE owner = :user {{timeline_keyset}}
+            ORDER BY ts DESC, tid DESC, ttype DESC
+            LIMIT :limit + 1)
+        UNION
+        SELECT 'tweet', t.tid, t.tdate, COALESCE(t.ttime, ''), 0, t.ts
+        FROM ({CELEBRITY_FOLLOWEES}) f JOIN tweets t ON t.rowid IN (
+            SELECT rowid FROM tweets
+            WHERE writer_id = f.flwee {{followee_keyset}}
+            ORDER BY ts DESC, tid DESC
+            LIMIT :limit + 1)
+        UNION
+        SELECT 'retweet', r.tid, r.rdate, '', r.spam, r.ts
+        FROM ({CELEBRITY_FOLLOWEES}) f JOIN retweets r ON r.rowid IN (
+            SELECT rowid FROM retweets
+            WHERE retweeter_id = f.flwee AND spam = 0 {{followee_keyset}}
+            ORDER BY ts DESC, tid DESC
+            LIMIT :limit + 1)
+    )
+    {{keyset}}
+    ORDER BY ts DESC, tid DESC, ttype DESC
+    LIMIT :limit
+"""
+FEED_FIRST_PAGE_QUERY = FEED_QUERY.format(timeline_keyset="", followee_keyset="", keyset="")
+FEED_NEXT_PAGE_QUERY = FEED_QUERY.format(
+    timeline_keyset="AND (ts, tid, ttype) < (:ts, :tid, :ttype)",
+    followee_keyset="AND (ts, tid) <= (:ts, :tid)",
+    keyset="WHERE (ts, tid, ttype) < (:ts, :tid, :ttype)")
+
+
+def feed_params(conn, owner):
+    """
+    Named parameters of FEED_QUERY for owner's feed, without the page's.
+    """
+    return {"user": owner, "celebrity_followers": celebrity_followers(conn)}
+
+
+def fan_out(conn, actor, ttype, tid, tdate, ttime, ts):
+    """
+    Copy a post by actor into the timeline of each of actor's followers.
+    Does nothing when fan-out is disabled or actor is a celebrity.
+    Runs inside the caller's transaction.
+    """
+    if not enabled(conn) or is_celebrity(conn, actor):
+        return
+    conn.execute("""
+        INSERT OR IGNORE INTO timeline(owner, ts, tdate, ttime, tid, ttype, actor)
+        SELECT flwer, ?, ?, ?, ?, ?, ?
+        FROM follows
+        WHERE flwee = ?
+    """, (ts, tdate, ttime or '', tid, ttype, actor, actor))
+
+
+# Posts of the non-celebrity followees of each follower, in timeline form.
+BACKFILL_QUERY = f"""
+    INSERT OR IGNORE INTO timeline(owner, ts, tdate, ttime, tid, ttype, actor)
+    SELECT f.flwer, t.ts, t.tdate, COALESCE(t.ttime, ''), t.tid, 'tweet', t.writer_id
+    FROM follows f JOIN tweets t ON t.writer_id = f.flwee
+    WHERE {{owner_filter}} f.flwee NOT IN (
+        SELECT usr FROM user_stats WHERE followers >= ?)
+    UNION ALL
+    SELECT f.flwer, r.ts, r.rdate, '', r.tid, 'retweet', r.retweeter_id
+    FROM follows f JOIN retweets r ON r.retweeter_id = f.flwee
+    WHERE {{owner_filter}} r.spam = 0 AND f.flwee NOT IN (
+        SELECT usr FROM user_stats WHERE followers >= ?)
+"""
+
+
+def follow(conn, flwer, flwee):
+    """
+    Add the existing posts of flwee to flwer's timeline after a new follow.
+    Runs inside the caller's transaction.
+    """
+    if not enabled(conn) or is_celebrity(conn, flwee):
+        return
+    threshold = celebrity_followers(conn)
+    conn.execute(
+        BACKFILL_QUERY.format(owner_filter="f.flwer = ? AND f.flwee = ? AND"),
+        (flwer, flwee, threshold, flwer, flwee, threshold))
+    trim(conn, flwer)
+
+
+def unfollow(conn, flwer, flwee):
+    """
+    Drop flwee's posts from flwer's timeline and refill it from flwer's
+    other followees if that leaves it short of timeline_limit rows, since
+    posts trimmed off it earlier would otherwise never come back. Runs
+    inside the caller's transaction.
+    """
+    conn.execute(
+        "DELETE FROM timeline WHERE owner = ? AND actor = ?", (flwer, flwee))
+    if enabled(conn):
+        rows = conn.execute(
+            "SELECT COUNT(*) FROM timeline WHERE owner = ?", (flwer,)).fetchone()[0]
+        if rows < timeline_limit(conn):
+            threshold = celebrity_followers(conn)
+            conn.execute(BACKFILL_QUERY.format(owner_filter="f.flwer = ? AND"),
+                         (flwer, threshold, flwer, threshold))
+            trim(conn, flwer)
+        row = conn.execute(
+            "SELECT followers FROM user_stats WHERE usr = ?", (flwee,)).fetchone()
+        if row is not None and row[0] == celebrity_followers(conn) - 1:
+            # This unfollow made flwee a regular author again: the posts they
+            # made as a celebrity are no longer read at feed time.
+            backfill_author(conn, flwee)
+
+
+def backfill_author(conn, author):
+    """
+    Add author's posts to the timeline of each of their followers, unless
+    author is a celebrity. Runs inside the caller's transaction; the
+    timelines are trimmed when their owners next open their feed.
+    """
+    threshold = celebrity_followers(conn)
+    conn.execute(BACKFILL_QUERY.format(owner_filter="f.flwee = ? AND"),
+                 (author, threshold, author, threshold))
+
+
+def backfill(conn):
+    """
+    Rebuild every timeline from follows, tweets and retweets, then trim them.
+    Runs inside the caller's transaction.
+    """
+    threshold = celebrity_followers(conn)
+    conn.execute("DELETE FROM timeline")
+    conn.execute(BACKFILL_QUERY.format(owner_filter=""), (threshold, threshold))
+    trim(conn)
+
+
+def trim(conn, owner=None):
+    """
+    Keep only the newest timeline_limit rows of owner's timeline, or of every
+    timeline when owner is None. Runs inside the caller's transaction.
+    """
+    if owner is None:
+        owners = [row[0] for row in
+                  conn.execute("SELECT DISTINCT owner FROM timeline").fetchall()]
+    else:
+        owners = [owner]
+    limit = timeline_limit(conn)
+    for owner in owners:
+        conn.execute("""
+            DELETE FROM timeline
+            WHERE owner = ?
+              AND (ts, tid, ttype, actor) <= (
+                SELECT ts, tid, ttype, actor
+                FROM timeline
+                WHERE owner = ?
+                ORDER BY ts DESC, tid DESC, ttype DESC, actor DESC
+                LIMIT 1 OFFSET ?)
+        """, (owner, owner, limit))
+
+
+def _feed_rows(conn, first_query, next_query, params, page_size, limit):
+    """
+    Up to limit rows of a feed, read page_size rows at a time the way
+    MicroTweetStore.feed_pages does.
+    """
+    params = dict(params, limit=page_size + 1)
+    rows = []
+    page = conn.execute(first_query, params).fetchall()
+    while page and len(rows) < limit:
+        rows.extend(page[:page_size])
+        if len(page) <= page_size:
+            break
+        ttype, tid, _, _, _, ts = page[page_size - 1]
+        page = conn.execute(next_query, dict(params, ts=ts, tid=tid, ttype=ttype)).fetchall()
+    return rows[:limit]
+
+
+def verify(conn, page_size=5):
+    """
+    Return the users whose paged timeline feed differs from their feed read
+    from the follow graph (fan-out-on-read), over the newest timeline_limit
+    posts; an empty list when they all match.
+    """
+    # Imported here because store imports this module.
+    import store
+
+    limit = timeline_limit(conn)
+    differ = []
+    for (owner,) in conn.execute("SELECT DISTINCT flwer FROM follows").fetchall():
+        timeline_rows = _feed_rows(conn, FEED_FIRST_PAGE_QUERY, FEED_NEXT_PAGE_QUERY,
+                                   feed_params(conn, owner), page_size, limit)
+        graph_rows = _feed_rows(conn, store.FEED_FIRST_PAGE_QUERY, store.FEED_NEXT_PAGE_QUERY,
+                                {"user": owner}, page_size, limit)
+        if timeline_rows != graph_rows:
+            differ.append(owner)
+    return differ
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage fan-out-on-write home timelines.")
+    parser.add_argument("database_file")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--enable", action="store_true",
+                      help="backfill all timelines and turn fan-out on")
+    mode.add_argument("--disable", action="store_true",
+                      help="turn fan-out off and drop all timeline rows")
+    mode.add_argument("--backfill", action="store_true",
+                      help="rebuild all timelines from the follow graph")
+    mode.add_argument("--trim", action="store_true",
+                      help="trim every timeline to the size limit")
+    mode.add_argument("--verify", action="store_true",
+                      help="page every user's feed from their timeline and from the "
+                           "follow graph and report the users whose feeds differ")
+    parser.add_argument("--limit", type=int,
+                        help="rows kept per timeline")
+    parser.add_argument("--celebrity-followers", type=int,
+                        help="follower count from which a user is read at feed time")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database_file)
+    migrations.migrate(conn)
+    try:
+        conn.execute("BEGIN")
+        if args.limit is not None:
+            migrations.set_setting(conn, "timeline_limit", args.limit)
+        if args.celebrity_followers is not None:
+            migrations.set_setting(conn, "celebrity_followers", args.celebrity_followers)
+        # A new threshold changes who was fanned out.
+        if args.enable or args.backfill or (
+                args.celebrity_followers is not None and enabled(conn)):
+            backfill(conn)
+        if args.enable:
+            migrations.set_setting(conn, "fanout", 1)
+        if args.disable:
+            migrations.set_setting(conn, "fanout", 0)
+            conn.execute("DELETE FROM timeline")
+        if args.trim:
+            trim(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if args.verify:
+        if not enabled(conn):
+            conn.close()
+            sys.exit("Fan-out on write is off: there are no timelines to verify.")
+        differ = verify(conn)
+        conn.close()
+        if differ:
+            print(f"{len(differ)} feeds differ from fan-out-on-read, e.g. users "
+                  f"{', '.join(map(str, differ[:10]))}")
+            sys.exit(1)
+        print("Timeline feeds match fan-out-on-read.")
+        return
+
+    rows = conn.execute("SELECT COUNT(*) FROM timeline").fetchone()[0]
+    print(f"Fan-out on write: {'on' if enabled(conn) else 'off'}")
+    print(f"Timeline rows: {rows} (limit {timeline_limit(conn)} per user, "
+          f"celebrities from {celebrity_followers(conn)} followers)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Trending hashtags from the hashtag_counts rollup.
+
+Triggers (see migrations.TRENDING_DDL) count every hashtag mention into the
+hour and the day of its tweet's tdate/ttime, so the top hashtags of a window
+are a sum over that window's buckets instead of a GROUP BY over every
+mention. Windows are whole buckets: "the last 24 hours" at 14:35 is the
+24 hourly buckets from 15:00 yesterday to the 14:00 bucket of today.
+Windows longer than DAY_SPAN_AFTER_HOURS are counted in whole days.
+
+    python3 trending.py <database_file> [--hours 24] [--limit 20] [--at "2025-01-01 12:00"]
+    python3 trending.py <database_file> --verify     # compare with hashtag_mentions and search
+    python3 trending.py <database_file> --rebuild    # recompute from scratch
+"""
+import argparse
+import datetime
+import sqlite3
+import sys
+
+import migrations
+
+
+DEFAULT_HOURS = 24
+DEFAULT_LIMIT = 20
+DAY_SPAN_AFTER_HOURS = 72
+
+# Top terms of one span between two buckets (first exclusive, last inclusive).
+TOP_QUERY = """
+    SELECT term, SUM(mentions) AS mentions
+    FROM hashtag_counts
+    WHERE span = ? AND bucket > ? AND bucket <= ?
+    GROUP BY term
+    HAVING SUM(mentions) > 0
+    ORDER BY mentions DESC, term
+    LIMIT ?
+"""
+
+EXPECTED_COUNTS = f"""
+    SELECT span, {migrations.trending_bucket("t.tdate", "t.ttime")} AS bucket,
+           {migrations.trending_term("m.term")} AS term, COUNT(*) AS mentions
+    FROM hashtag_mentions m JOIN tweets t ON t.tid = m.tid,
+         {migrations.TRENDING_SPANS}
+    WHERE t.tdate IS NOT NULL AND m.term IS NOT NULL
+    GROUP BY 1, 2, 3
+"""
+
+# Buckets whose stored count differs from the expected one; zero rows are
+# ignored, like a missing row.
+DRIFT_QUERY = f"""
+    WITH expected AS ({EXPECTED_COUNTS}),
+    actual AS (
+        SELECT span, bucket, term, mentions FROM hashtag_counts WHERE mentions != 0
+    )
+    SELECT span, bucket, term FROM (SELECT * FROM expected EXCEPT SELECT * FROM actual)
+    UNION
+    SELECT span, bucket, term FROM (SELECT * FROM actual EXCEPT SELECT * FROM expected)
+"""
+
+
+def rebuild(conn):
+    """
+    Recompute hashtag_counts from hashtag_mentions and tweets. Runs inside
+    the caller's transaction; the caller commits.
+    """
+    conn.execute("DELETE FROM hashtag_counts")
+    conn.execute(
+        f"INSERT INTO hashtag_counts(span, bucket, term, mentions) {EXPECTED_COUNTS}")
+
+
+def verify(conn):
+    """
+    Return the (span, bucket, term) rows that drifted; empty when the
+    rollup matches the base tables.
+    """
+    return conn.execute(DRIFT_QUERY).fetchall()
+
+
+def verify_drilldown(conn):
+    """
+    Return the rollup terms whose hashtag search (what the menu runs when a
+    trending hashtag is picked) finds no tweet; empty when every one does.
+    """
+    # Imported here because store imports this module.
+    import store
+
+    missing = []
+    terms = conn.execute(
+        "SELECT DISTINCT term FROM hashtag_counts WHERE mentions > 0").fetchall()
+    for (term,) in terms:
+        _, params = store.compile_search(["#" + term], fts=False)
+        if not conn.execute(store.SEARCH_LIKE_QUERY, params + (1, 0)).fetchone():
+            missing.append(term)
+    return missing
+
+
+def window(hours=DEFAULT_HOURS, now=None):
+    """
+    Return (span, first bucket exclusive, last bucket inclusive) of the
+    last `hours` hours up to now (default: the local time tweets are
+    stamped with).
+    """
+    now = now or datetime.datetime.now()
+    if hours > DAY_SPAN_AFTER_HOURS:
+        days = -(-hours // 24)
+        start = now - datetime.timedelta(days=days)
+        return "day", start.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
+    start = now - datetime.timedelta(hours=hours)
+    return "hour", start.strftime("%Y-%m-%d %H"), now.strftime("%Y-%m-%d %H")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show, verify or rebuild the trending hashtag rollup.")
+    parser.add_argument("database_file")
+    parser.add_argument("--hours", type=int, default=DEFAULT_HOURS,
+                        help=f"window length (default: {DEFAULT_HOURS})")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--at", type=datetime.datetime.fromisoformat,
+                        help="end of the window (default: now)")
+    parser.add_argument("--verify", action="store_true",
+                        help="compare the rollup with hashtag_mentions and check "
+                             "that every term's search finds tweets")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute the rollup from hashtag_mentions")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database_file)
+    migrations.migrate(conn)
+
+    if args.rebuild:
+        try:
+            conn.execute("BEGIN")
+            rebuild(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print("Trending rollup rebuilt.")
+
+    if args.verify:
+        drifted = verify(conn)
+        missing = verify_drilldown(conn)
+        conn.close()
+        if not drifted and not missing:
+            print("Trending rollup is consistent.")
+            return
+        if drifted:
+            print(f"{len(drifted)} bucket(s) drifted, for example: "
+                  + ", ".join(f"{span} {bucket} #{term}" for span, bucket, term in drifted[:5]))
+            print("Run with --rebuild to recompute them.")
+        if missing:
+            print(f"{len(missing)} trending hashtag(s) find no tweets, for example: "
+                  + ", ".join(f"#{term}" for term in missing[:5]))
+        sys.exit(1)
+
+    span, first, last = window(args.hours, args.at)
+    rows = conn.execute(TOP_QUERY, (span, first, last, args.limit)).fetchall()
+    conn.close()
+    print(f"Top hashtags, {span} buckets after {first} up to {last}:")
+    for rank, (term, mentions) in enumerate(rows, 1):
+        print(f"{rank:3}. #{term:30} {mentions:>9,}")
+    if not rows:
+        print("   (no hashtags in this window)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,99 @@
-import sqlite3
+import argparse
 import sys
 import getpass
-import re
-import datetime
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 twitter.py <database_file>")
-        sys.exit(1)
+import batch
+import cache
+import credentials
+import db
+import importer
+import migrations
+import queries
+import snapshot
+import writequeue
+from store import QUERIES, MicroTweetStore, StoreError
 
-    db_name = sys.argv[1]
-    conn = sqlite3.connect(db_name)
-    conn.execute("PRAGMA foreign_keys = ON;")
 
-    current_user_id = None
+# Non-interactive subcommands: python3 twitter.py <command> ...
+COMMANDS = {
+    "import": importer.main,
+    "batch": batch.main,
+    "export": snapshot.export_main,
+}
 
-    while True:
-        if current_user_id is None:
-            choice = login_menu()
-            if choice == '1':
-                user_id = login(conn)
-                if user_id is not None:
-                    current_user_id = user_id
-                    show_followed_tweets(conn, current_user_id)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(
+        usage="python3 twitter.py <database_file> [options]\n"
+              f"       python3 twitter.py {{{','.join(COMMANDS)}}} ...")
+    parser.add_argument("database_file")
+    db.add_connection_arguments(parser)
+    cache.add_cache_arguments(parser)
+    credentials.add_credential_arguments(parser)
+    writequeue.add_write_queue_arguments(parser)
+    queries.add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    conn = db.connect_from_args(args.database_file, args)
+    migrations.migrate(conn)
+    registry = queries.registry_from_args(QUERIES, args)
+    verifier = credentials.verifier_from_args(args)
+    write_queue = writequeue.write_queue_from_args(args.database_file, args, registry, verifier)
+    store = MicroTweetStore(conn, registry, args.cache_entries, args.cache_ttl,
+                            write_queue=write_queue, verifier=verifier)
+
+    current_user_id = None
+    try:
+        while True:
+            if current_user_id is None:
+                choice = login_menu()
+                if choice == '1':
+                    user_id = login(store)
+                    if user_id is not None:
+                        current_user_id = user_id
+                        show_followed_tweets(store, current_user_id)
+                    else:
+                        print("Login failed.")
+                elif choice == '2':
+                    user_id = signup(store)
+                    if user_id is not None:
+                        current_user_id = user_id
+                        show_followed_tweets(store, current_user_id)
+                elif choice == '3':
+                    print("Exiting. Goodbye!")
+                    break
                 else:
-                    print("Login failed.")
-            elif choice == '2':
-                user_id = signup(conn)
-                if user_id is not None:
-                    current_user_id = user_id
-                    show_followed_tweets(conn, current_user_id)
-            elif choice == '3':
-                print("Exiting. Goodbye!")
-                break
+                    print("Invalid choice. Try again.")
             else:
-                print("Invalid choice. Try again.")
-        else:
-            choice = main_menu()
-            if choice == '1':
-                search_tweets(conn, current_user_id)
-            elif choice == '2':
-                search_users(conn, current_user_id)
-            elif choice == '3':
-                compose_tweet(conn, current_user_id)
-            elif choice == '4':
-                list_followers(conn, current_user_id)
-            elif choice == '5':
-                list_favorite_lists(conn, current_user_id)
-            elif choice == '6':
-                current_user_id = None
-            else:
-                print("Invalid choice. Try again.")
-
-    conn.close()
+                choice = main_menu()
+                if choice == '1':
+                    search_tweets(store, current_user_id)
+                elif choice == '2':
+                    search_users(store, current_user_id)
+                elif choice == '3':
+                    compose_tweet(store, current_user_id)
+                elif choice == '4':
+                    list_followers(store, current_user_id)
+                elif choice == '5':
+                    list_favorite_lists(store, current_user_id)
+                elif choice == '6':
+                    trending_hashtags(store, current_user_id)
+                elif choice == '7':
+                    who_to_follow(store, current_user_id)
+                elif choice == '8':
+                    current_user_id = None
+                else:
+                    print("Invalid choice. Try again.")
+    finally:
+        # Closing the store flushes writes still in the queue (--durability).
+        store.close()
+        verifier.close()
+    queries.finish(registry, args)
+    if args.profile:
+        print("\n" + cache.report(store.caches), file=sys.stderr)
 
 
 def login_menu():
@@ -69,31 +110,28 @@ def main_menu():
     print("3. Compose a Tweet")
     print("4. List Followers")
     print("5. List Favorite Lists")
-    print("6. Logout")
+    print("6. Trending Hashtags")
+    print("7. Who to Follow")
+    print("8. Logout")
     return input("Enter your choice: ").strip()
 
 
-def login(conn):
+def login(store):
     print("\n--- Login ---")
     usr = input("User ID: ").strip()
 
     pwd = getpass.getpass("Password: ")
 
-    cur = conn.cursor()
-    query = "SELECT usr FROM users WHERE usr = ? AND pwd = ?"
-    cur.execute(query, (usr, pwd))
-    row = cur.fetchone()
-    if row:
+    user_id = store.login(usr, pwd)
+    if user_id is not None:
         print("Login successful.")
-        return row[0]
-    else:
-        return None
+    return user_id
 
 
-def signup(conn):
+def signup(store):
     """
     Unregistered user can sign up by providing name, email, phone, pwd.
-    The system generates the user ID (1 + max(usr)).
+    The system generates the user ID from the users sequence (see db.allocate_id).
     """
     print("\n--- Signup ---")
     name = input("Enter name: ").strip()
@@ -101,95 +139,64 @@ def signup(conn):
     phone = input("Enter phone: ").strip()
     pwd = getpass.getpass("Enter password: ")
 
-    if "@" not in email or "." not in email:
-        print("Invalid email format.")
-        return None
-    
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(usr) FROM users")
-    result = cur.fetchone()
-    max_id = result[0] if result and result[0] is not None else 0
-    new_id = int(max_id) + 1
-
-    insert_query = """
-        INSERT INTO users(usr, name, email, phone, pwd)
-        VALUES (?, ?, ?, ?, ?)
-    """
     try:
-        cur.execute(insert_query, (new_id, name, email, phone, pwd))
-        conn.commit()
-        print(f"Signup successful! Your user ID is {new_id}")
-        return str(new_id)
+        new_id = store.signup(name, email, phone, pwd)
+    except StoreError as e:
+        print(e)
+        return None
     except Exception as e:
         print(f"Error signing up: {e}")
-        conn.rollback()
         return None
+    print(f"Signup successful! Your user ID is {new_id}")
+    return new_id
 
 
-def show_followed_tweets(conn, current_user_id):
+def page_through(pages, show, header=None):
     """
-    List all tweets and retweets (spam=0) from users who are being followed by current_user_id,
-    ordered by date desc. Show 5 at a time with an option to show more.
-    This retrieves tweet/retweet info from 'tweets' and 'retweets'.
+    Call show(item, number) for each item of the (items, has_more) pages,
+    numbering items from 1 and asking "Show more?" between pages. Returns
+    the items shown, so the caller can let the user pick one by number.
     """
-    print("\n--- Your Feed (Followed Users' Tweets/Retweets) ---")
-
-    cur = conn.cursor()
-
-    tweet_query = """
-    SELECT
-        'tweet' AS ttype,
-        t.tid,
-        t.tdate,
-        t.ttime,
-        0 AS spam
-    FROM tweets t
-    WHERE t.writer_id IN
-        (SELECT flwee FROM follows WHERE flwer = ?)
-    """
-
-    retweet_query = """
-    SELECT
-        'retweet' AS ttype,
-        r.tid,
-        r.rdate AS tdate,
-        NULL AS ttime,
-        r.spam
-    FROM retweets r
-    WHERE r.retweeter_id IN
-        (SELECT flwee FROM follows WHERE flwer = ?)
-      AND r.spam = 0
-    """
-
-    union_query = f"""
-    SELECT * FROM (
-        {tweet_query}
-        UNION
-        {retweet_query}
-    )
-    ORDER BY tdate DESC
-    """
-
-    cur.execute(union_query, (current_user_id, current_user_id))
-    results = cur.fetchall()
-
-    index = 0
-    while True:
-        chunk = results[index:index+5]
-        if not chunk:
-            break
-        for row in chunk:
-            ttype, tid, date, ttime, spam = row
-            print(f"{ttype.upper()} | tid={tid} | date={date} | time={ttime or 'N/A'} | spam={spam}")
-        index += 5
-        if index >= len(results):
+    shown = []
+    for items, has_more in pages:
+        if header:
+            print(header)
+        for item in items:
+            shown.append(item)
+            show(item, len(shown))
+        if not has_more:
             break
         choice = input("Show more? (y/n): ").strip().lower()
         if choice != 'y':
             break
+    return shown
+
+
+def list_pages(items, page_size=5):
+    """
+    (items, has_more) pages over an already fetched list.
+    """
+    for index in range(0, len(items), page_size):
+        yield items[index:index + page_size], index + page_size < len(items)
+
+
+def show_followed_tweets(store, current_user_id):
+    """
+    List all tweets and retweets (spam=0) from users who are being followed by current_user_id,
+    ordered by date desc. Show 5 at a time with an option to show more.
+    Pages are pulled lazily from store.feed_pages, so declining "Show more?"
+    never touches the rest of the feed.
+    """
+    print("\n--- Your Feed (Followed Users' Tweets/Retweets) ---")
+
+    def show(item, number):
+        print(f"{item.ttype.upper()} | tid={item.tid} | date={item.tdate} | "
+              f"time={item.ttime or 'N/A'} | spam={item.spam}")
 
+    page_through(store.feed_pages(current_user_id), show)
 
-def search_tweets(conn, current_user_id):
+
+def search_tweets(store, current_user_id):
     """
     The user enters one or more keywords separated by commas.
     A tweet matches a keyword if:
@@ -207,212 +214,245 @@ def search_tweets(conn, current_user_id):
         print("No keywords entered. Returning.")
         return
 
-    cur = conn.cursor()
-
-    matched_tids = set()
-
-    for kw in keywords:
-        if kw.startswith('#'):
-            term = kw[1:]
-            tag_query = """
-                SELECT tid
-                FROM hashtag_mentions
-                WHERE lower(term) = ?
-            """
-            cur.execute(tag_query, (term,))
-            rows = cur.fetchall()
-            for r in rows:
-                matched_tids.add(r[0])
-        else:
-            text_query = """
-                SELECT tid
-                FROM tweets
-                WHERE lower(text) LIKE ?
-            """
-            cur.execute(text_query, (f"%{kw}%",))
-            rows_text = cur.fetchall()
-            for r in rows_text:
-                matched_tids.add(r[0])
-
-            tag_query = """
-                SELECT tid
-                FROM hashtag_mentions
-                WHERE lower(term) = ?
-            """
-            cur.execute(tag_query, (kw,))
-            rows_tag = cur.fetchall()
-            for r in rows_tag:
-                matched_tids.add(r[0])
-
-    if not matched_tids:
+    show_search_results(store, current_user_id, keywords)
+
+
+def show_search_results(store, current_user_id, keywords):
+    """
+    Page through the tweets matching keywords and offer tweet_options for
+    the one the user picks.
+    """
+    def show(tweet, number):
+        print(f"{number}. TID={tweet.tid}, WRITER={tweet.writer_id}, DATE={tweet.tdate}, "
+              f"TIME={tweet.ttime}, TEXT={tweet.text}")
+
+    results = page_through(store.search_tweet_pages(keywords), show,
+                           header="\n--- Search Results (page) ---")
+
+    if not results:
         print("No tweets found for your keywords.")
         return
 
-    tweet_details_query = f"""
-        SELECT tid, writer_id, tdate, ttime, text
-        FROM tweets
-        WHERE tid IN ({','.join(['?']*len(matched_tids))})
-        ORDER BY tdate DESC, ttime DESC
-    """
-    cur.execute(tweet_details_query, tuple(matched_tids))
-    results = cur.fetchall()
+    selection = input("\nEnter the number of a tweet to view options (or blank to skip): ").strip()
+    if selection.isdigit():
+        selection_idx = int(selection) - 1
+        if 0 <= selection_idx < len(results):
+            tweet_options(store, current_user_id, results[selection_idx].tid)
+        else:
+            print("Invalid tweet selection.")
+    else:
+        print("Skipped.")
 
-    index = 0
-    while True:
-        chunk = results[index:index+5]
-        if not chunk:
-            break
-        print("\n--- Search Results (page) ---")
-        for i, row in enumerate(chunk):
-            tid, writer_id, tdate, ttime, text = row
-            print(f"{index + i + 1}. TID={tid}, WRITER={writer_id}, DATE={tdate}, TIME={ttime}, TEXT={text}")
-        index += 5
-        if index >= len(results):
-            break
-        choice = input("Show more? (y/n): ").strip().lower()
-        if choice != 'y':
-            break
 
-    if results:
-        selection = input("\nEnter the number of a tweet to view options (or blank to skip): ").strip()
-        if selection.isdigit():
-            selection_idx = int(selection) - 1
-            if 0 <= selection_idx < len(results):
-                tid, writer_id, tdate, ttime, text = results[selection_idx]
-                tweet_options(conn, current_user_id, tid)
-            else:
-                print("Invalid tweet selection.")
+TRENDING_WINDOWS = {'1': ("last hour", 1), '2': ("last 24 hours", 24),
+                    '3': ("last 7 days", 7 * 24)}
+
+
+def trending_hashtags(store, current_user_id):
+    """
+    Show the 20 most mentioned hashtags of the last hour, day or week (read
+    from the hashtag_counts rollup, see trending.py). Picking one searches
+    its tweets.
+    """
+    print("\n--- Trending Hashtags ---")
+    for key, (label, _) in TRENDING_WINDOWS.items():
+        print(f"{key}. {label.capitalize()}")
+    label, hours = TRENDING_WINDOWS.get(input("Choose a window (default 2): ").strip(),
+                                        TRENDING_WINDOWS['2'])
+
+    trends = store.trending_hashtags(hours)
+    if not trends:
+        print(f"No hashtags in the {label}.")
+        return
+    print(f"\n--- Top hashtags, {label} ---")
+    for number, trend in enumerate(trends, 1):
+        print(f"{number}. #{trend.term} ({trend.mentions} mentions)")
+
+    selection = input("\nEnter the number of a hashtag to see its tweets (or blank to skip): ").strip()
+    if selection.isdigit():
+        selection_idx = int(selection) - 1
+        if 0 <= selection_idx < len(trends):
+            show_search_results(store, current_user_id, ["#" + trends[selection_idx].term])
         else:
-            print("Skipped.")
+            print("Invalid hashtag selection.")
+    else:
+        print("Skipped.")
 
 
-def tweet_options(conn, current_user_id, tid):
+def tweet_options(store, current_user_id, tid):
     """
     Show stats: # retweets, # replies
     Then allow user to:
       - reply
       - retweet
       - add to a favorite list
+      - view the conversation
     """
-    cur = conn.cursor()
-
-    cur.execute("SELECT COUNT(*) FROM retweets WHERE tid=?", (tid,))
-    num_retweets = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM tweets WHERE replyto_tid=?", (tid,))
-    num_replies = cur.fetchone()[0]
+    stats = store.tweet_stats(tid)
 
     print(f"\n--- Tweet TID={tid} Stats ---")
-    print(f"Number of retweets: {num_retweets}")
-    print(f"Number of replies: {num_replies}")
+    print(f"Number of retweets: {stats.retweets}")
+    print(f"Number of replies: {stats.replies}")
 
     while True:
         print("\nOptions:")
         print("1. Reply to Tweet")
         print("2. Retweet")
         print("3. Add to Favorite List")
-        print("4. Back to Main Menu")
+        print("4. View Conversation")
+        print("5. Back to Main Menu")
         opt = input("Choose an option: ").strip()
         if opt == '1':
-            reply_to_tweet(conn, current_user_id, tid)
+            reply_to_tweet(store, current_user_id, tid)
         elif opt == '2':
-            retweet_tweet(conn, current_user_id, tid)
+            retweet_tweet(store, current_user_id, tid)
         elif opt == '3':
-            add_to_favorite_list(conn, current_user_id, tid)
+            add_to_favorite_list(store, current_user_id, tid)
         elif opt == '4':
+            show_conversation(store, tid)
+        elif opt == '5':
             break
         else:
             print("Invalid option.")
 
 
-def reply_to_tweet(conn, current_user_id, replyto_tid):
+def show_reply_tree(nodes, depth, expandable):
+    """
+    Print nodes and the replies under them, indented by depth. Each tweet
+    with replies not loaded yet is appended to expandable as
+    [node, replies loaded so far, depth] and marked with its number.
+    """
+    for node in nodes:
+        tweet = node.tweet
+        line = (f"{'    ' * depth}TID={tweet.tid}, WRITER={tweet.writer_id}, DATE={tweet.tdate}, "
+                f"TIME={tweet.ttime}, TEXT={tweet.text}")
+        if node.hidden_replies > 0:
+            expandable.append([node, list(node.children), depth])
+            line += f"  [{len(expandable)}: {node.hidden_replies} more replies]"
+        print(line)
+        show_reply_tree(node.children, depth + 1, expandable)
+
+
+def show_conversation(store, tid):
+    """
+    Show the tweets tid replies to and the tree of its replies, loaded
+    together with one query. Large subtrees are cut short; picking one's
+    number loads its next replies.
+    """
+    conversation = store.conversation(tid)
+    if conversation is None:
+        print("Tweet not found.")
+        return
+    print(f"\n--- Conversation of TID={tid} ---")
+    for tweet in conversation.ancestors:
+        print(f"TID={tweet.tid}, WRITER={tweet.writer_id}, DATE={tweet.tdate}, "
+              f"TIME={tweet.ttime}, TEXT={tweet.text}")
+        print("  |")
+    expandable = []
+    show_reply_tree([conversation.focus], 0, expandable)
+
+    while expandable:
+        selection = input("\nEnter a [number] to load more replies (or blank to go back): ").strip()
+        if not selection.isdigit():
+            break
+        selection_idx = int(selection) - 1
+        if not 0 <= selection_idx < len(expandable):
+            print("Invalid selection.")
+            continue
+        node, loaded, depth = expandable[selection_idx]
+        after = (loaded[-1].ts, loaded[-1].tweet.tid) if loaded else None
+        more = store.replies(node.tweet.tid, after)
+        if not more:
+            print("No more replies.")
+            continue
+        loaded.extend(more)
+        print(f"\n--- More replies to TID={node.tweet.tid} ---")
+        show_reply_tree(more, depth + 1, expandable)
+        if node.replies > len(loaded):
+            print(f"[{selection}: {node.replies - len(loaded)} more replies]")
+
+
+def reply_to_tweet(store, current_user_id, replyto_tid):
     print("\n--- Reply to Tweet ---")
     text = input("Enter your reply text: ")
 
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(tid) FROM tweets")
-    row = cur.fetchone()
-    max_tid = row[0] if row and row[0] is not None else 0
-    new_tid = max_tid + 1
-
-    now = datetime.datetime.now()
-    tdate = now.strftime("%Y-%m-%d")
-    ttime = now.strftime("%H:%M:%S")
-
-    insert_query = """
-        INSERT INTO tweets(tid, writer_id, text, tdate, ttime, replyto_tid)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """
     try:
-        cur.execute(insert_query, (new_tid, current_user_id, text, tdate, ttime, replyto_tid))
-        conn.commit()
-        print(f"Reply posted (TID={new_tid}).")
+        new_tid, hashtags = store.post_tweet(current_user_id, text, replyto_tid)
     except Exception as e:
-        conn.rollback()
         print(f"Error replying: {e}")
+        return
+    print(f"Reply posted (TID={new_tid}).")
+    if hashtags:
+        print(f"Hashtags added: {', '.join(hashtags)}")
 
 
-def retweet_tweet(conn, current_user_id, tid):
+def retweet_tweet(store, current_user_id, tid):
     print("\n--- Retweet ---")
-    cur = conn.cursor()
-
-    cur.execute("SELECT writer_id FROM tweets WHERE tid=?", (tid,))
-    row = cur.fetchone()
-    if not row:
-        print("Tweet does not exist for retweet.")
-        return
-    writer_id = row[0]
-    now = datetime.datetime.now().strftime("%Y-%m-%d")
-
-    insert_query = """
-        INSERT INTO retweets(tid, retweeter_id, writer_id, spam, rdate)
-        VALUES (?, ?, ?, ?, ?)
-    """
     try:
-        cur.execute(insert_query, (tid, current_user_id, writer_id, 0, now))
-        conn.commit()
-        print("Retweeted successfully.")
+        store.retweet(current_user_id, tid)
+    except StoreError as e:
+        print(e)
+        return
     except Exception as e:
-        conn.rollback()
         print(f"Error retweeting: {e}")
+        return
+    print("Retweeted successfully.")
 
 
-def add_to_favorite_list(conn, current_user_id, tid):
+def add_to_favorite_list(store, current_user_id, tid):
     print("\n--- Add to Favorite List ---")
-    cur = conn.cursor()
-    cur.execute("SELECT lname FROM lists WHERE owner_id=?", (current_user_id,))
-    lists = [row[0] for row in cur.fetchall()]
-    if not lists:
-        print("You have no favorite lists. Create one first (via manual SQL or extend code).")
+    lists = store.favorite_list_names(current_user_id)
+    if lists:
+        print("Your favorite lists:")
+        for i, lname in enumerate(lists):
+            print(f"{i+1}. {lname}")
+        choice = input("Select a list number, or type a name for a new list "
+                       "(blank to cancel): ").strip()
+    else:
+        print("You have no favorite lists yet.")
+        choice = input("Type a name for a new list (blank to cancel): ").strip()
+    if not choice:
+        print("Cancelled.")
         return
+    if lists and choice.isdigit():
+        idx = int(choice) - 1
+        if idx < 0 or idx >= len(lists):
+            print("Invalid list selection.")
+            return
+        lname = lists[idx]
+    else:
+        lname = choice
+        if not create_favorite_list(store, current_user_id, lname):
+            return
 
-    print("Your favorite lists:")
-    for i, lname in enumerate(lists):
-        print(f"{i+1}. {lname}")
-    choice = input("Select a list number (or blank to cancel): ").strip()
-    if not choice.isdigit():
-        print("Cancelled.")
+    try:
+        store.add_to_favorite_list(current_user_id, lname, tid)
+    except StoreError as e:
+        print(e)
         return
-    idx = int(choice) - 1
-    if idx < 0 or idx >= len(lists):
-        print("Invalid list selection.")
+    except Exception as e:
+        print(f"Error adding to favorite list: {e}")
         return
+    print(f"Tweet {tid} added to list '{lname}'.")
 
-    lname = lists[idx]
-    insert_query = """
-        INSERT INTO include(owner_id, lname, tid)
-        VALUES (?, ?, ?)
+
+def create_favorite_list(store, current_user_id, lname):
+    """
+    Create the list lname; returns whether it was created.
     """
     try:
-        cur.execute(insert_query, (current_user_id, lname, tid))
-        conn.commit()
-        print(f"Tweet {tid} added to list '{lname}'.")
+        store.create_favorite_list(current_user_id, lname)
+    except StoreError as e:
+        print(e)
+        return False
     except Exception as e:
-        conn.rollback()
-        print(f"Error adding to favorite list: {e}")
+        print(f"Error creating favorite list: {e}")
+        return False
+    print(f"List '{lname}' created.")
+    return True
 
 
-def search_users(conn, current_user_id):
+def search_users(store, current_user_id):
     """
     The user enters a single keyword. Show all users whose names contain that keyword
     (case-insensitive). Sort by ascending length of name. Show 5 at a time. Then can
@@ -424,144 +464,96 @@ def search_users(conn, current_user_id):
     if not keyword:
         return
 
-    cur = conn.cursor()
-    query = """
-        SELECT usr, name
-        FROM users
-        WHERE lower(name) LIKE ?
-    """
-    cur.execute(query, (f"%{keyword}%",))
-    rows = cur.fetchall()
-    rows.sort(key=lambda x: len(x[1]))
+    def show(user, number):
+        print(f"{number}. UserID={user.usr}, Name={user.name}")
 
-    index = 0
-    while True:
-        chunk = rows[index:index+5]
-        if not chunk:
-            break
-        for i, row in enumerate(chunk):
-            uid, uname = row
-            print(f"{index + i + 1}. UserID={uid}, Name={uname}")
-        index += 5
-        if index >= len(rows):
-            break
-        choice = input("Show more? (y/n): ").strip().lower()
-        if choice != 'y':
-            break
+    users = page_through(store.search_user_pages(keyword), show)
 
-    if rows:
+    if users:
         selection = input("\nEnter the number of a user to see details (blank to skip): ").strip()
         if selection.isdigit():
             selection_idx = int(selection) - 1
-            if 0 <= selection_idx < len(rows):
-                user_id, uname = rows[selection_idx]
-                show_user_details(conn, current_user_id, user_id)
+            if 0 <= selection_idx < len(users):
+                show_user_details(store, current_user_id, users[selection_idx].usr)
             else:
                 print("Invalid selection.")
         else:
             print("Skipped.")
 
 
-def show_user_details(conn, current_user_id, user_id):
+def show_user_details(store, current_user_id, user_id):
     """
     Show #tweets, #following, #followers, up to 3 most recent tweets.
-    Then can follow that user or see more tweets.
+    Then can follow (or unfollow) that user or see more tweets.
     """
-    cur = conn.cursor()
-
-    cur.execute("SELECT COUNT(*) FROM tweets WHERE writer_id=?", (user_id,))
-    num_tweets = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM follows WHERE flwer=?", (user_id,))
-    num_following = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM follows WHERE flwee=?", (user_id,))
-    num_followers = cur.fetchone()[0]
+    stats = store.user_stats(user_id)
 
     print(f"\n--- User {user_id} Details ---")
-    print(f"Total tweets: {num_tweets}")
-    print(f"Follows: {num_following}")
-    print(f"Followers: {num_followers}")
-
-    cur.execute("""
-        SELECT tid, text, tdate, ttime
-        FROM tweets
-        WHERE writer_id=?
-        ORDER BY tdate DESC, ttime DESC
-        LIMIT 3
-    """, (user_id,))
-    recents = cur.fetchall()
+    print(f"Total tweets: {stats.tweets}")
+    print(f"Follows: {stats.following}")
+    print(f"Followers: {stats.followers}")
+
+    recents = store.recent_tweets(user_id)
     if recents:
         print("Most recent tweets:")
-        for r in recents:
-            print(f"   TID={r[0]}, DATE={r[2]}, TIME={r[3]}, TEXT={r[1]}")
+        for t in recents:
+            print(f"   TID={t.tid}, DATE={t.tdate}, TIME={t.ttime}, TEXT={t.text}")
     else:
         print("No recent tweets.")
 
     while True:
         print("\nOptions:")
-        print("1. Follow this user")
+        following = store.is_following(current_user_id, user_id)
+        print("1. Unfollow this user" if following else "1. Follow this user")
         print("2. See more tweets by this user")
         print("3. Back")
         choice = input("Choose an option: ").strip()
-        if choice == '1':
-            follow_user(conn, current_user_id, user_id)
+        if choice == '1' and following:
+            unfollow_user(store, current_user_id, user_id)
+        elif choice == '1':
+            follow_user(store, current_user_id, user_id)
         elif choice == '2':
-            list_user_tweets(conn, user_id)
+            list_user_tweets(store, user_id)
         elif choice == '3':
             break
         else:
             print("Invalid input.")
 
 
-def follow_user(conn, current_user_id, user_to_follow):
-    if current_user_id == user_to_follow:
-        print("You cannot follow yourself.")
+def follow_user(store, current_user_id, user_to_follow):
+    try:
+        store.follow(current_user_id, user_to_follow)
+    except StoreError as e:
+        print(e)
         return
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM follows WHERE flwer=? AND flwee=?", (current_user_id, user_to_follow))
-    if cur.fetchone():
-        print("You already follow this user.")
+    except Exception as e:
+        print(f"Error following user: {e}")
         return
-    now = datetime.datetime.now().strftime("%Y-%m-%d")
+    print("Followed user successfully.")
+
+
+def unfollow_user(store, current_user_id, user_to_unfollow):
     try:
-        cur.execute("INSERT INTO follows(flwer, flwee, start_date) VALUES (?,?,?)",
-                    (current_user_id, user_to_follow, now))
-        conn.commit()
-        print("Followed user successfully.")
+        store.unfollow(current_user_id, user_to_unfollow)
+    except StoreError as e:
+        print(e)
+        return
     except Exception as e:
-        conn.rollback()
-        print(f"Error following user: {e}")
+        print(f"Error unfollowing user: {e}")
+        return
+    print("Unfollowed user successfully.")
 
 
-def list_user_tweets(conn, user_id):
+def list_user_tweets(store, user_id):
     print(f"\n--- Tweets by User {user_id} ---")
-    cur = conn.cursor()
-    query = """
-        SELECT tid, text, tdate, ttime
-        FROM tweets
-        WHERE writer_id=?
-        ORDER BY tdate DESC, ttime DESC
-    """
-    cur.execute(query, (user_id,))
-    results = cur.fetchall()
-    index = 0
-    while True:
-        chunk = results[index:index+5]
-        if not chunk:
-            break
-        for row in chunk:
-            tid, text, tdate, ttime = row
-            print(f"TID={tid}, DATE={tdate}, TIME={ttime}, TEXT={text}")
-        index += 5
-        if index >= len(results):
-            break
-        choice = input("Show more? (y/n): ").strip().lower()
-        if choice != 'y':
-            break
+
+    def show(tweet, number):
+        print(f"TID={tweet.tid}, DATE={tweet.tdate}, TIME={tweet.ttime}, TEXT={tweet.text}")
+
+    page_through(list_pages(store.user_tweets(user_id)), show)
 
 
-def compose_tweet(conn, current_user_id):
+def compose_tweet(store, current_user_id):
     """
     The user composes a tweet that may have hashtags (#something).
     We'll extract hashtags, store them in hashtag_mentions.
@@ -570,116 +562,150 @@ def compose_tweet(conn, current_user_id):
     print("\n--- Compose Tweet ---")
     text = input("Enter your tweet text: ")
 
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(tid) FROM tweets")
-    row = cur.fetchone()
-    max_tid = row[0] if row and row[0] is not None else 0
-    new_tid = max_tid + 1
-
-    now = datetime.datetime.now()
-    tdate = now.strftime("%Y-%m-%d")
-    ttime = now.strftime("%H:%M:%S")
-
-    insert_query = """
-        INSERT INTO tweets(tid, writer_id, text, tdate, ttime, replyto_tid)
-        VALUES (?, ?, ?, ?, ?, NULL)
-    """
     try:
-        cur.execute(insert_query, (new_tid, current_user_id, text, tdate, ttime))
-        conn.commit()
-        print(f"Tweet posted (TID={new_tid}).")
+        new_tid, hashtags = store.post_tweet(current_user_id, text)
     except Exception as e:
-        conn.rollback()
         print(f"Error posting tweet: {e}")
         return
-
-    hashtags = set()
-    for match in re.findall(r"#(\w+)", text, flags=re.IGNORECASE):
-        hashtags.add(match.lower())
-
-    for h in hashtags:
-        try:
-            cur.execute("INSERT INTO hashtag_mentions(tid, term) VALUES (?, ?)", (new_tid, h))
-        except:
-            pass
-    conn.commit()
+    print(f"Tweet posted (TID={new_tid}).")
     if hashtags:
         print(f"Hashtags added: {', '.join(hashtags)}")
 
 
-def list_followers(conn, current_user_id):
+def list_followers(store, current_user_id):
     """
     The user should be able to list all users who follow them (follows.flwee = current_user_id).
-    Show 5 at a time.
+    Show 5 at a time, each with their name and counts (one query per page).
     Then can select a follower -> show details (#tweets, #following, #followers, up to 3 tweets),
     option to follow them, or see more tweets, etc.
     """
     print("\n--- List Followers ---")
-    cur = conn.cursor()
-    query = """
-        SELECT flwer
-        FROM follows
-        WHERE flwee=?
-    """
-    cur.execute(query, (current_user_id,))
-    rows = cur.fetchall()
-    followers = [r[0] for r in rows]
+
+    def show(user, number):
+        print(f"{number}. UserID={user.usr}, Name={user.name}, Tweets={user.tweets}, "
+              f"Followers={user.followers}{', you follow them' if user.followed else ''}")
+
+    followers = page_through(store.follower_pages(current_user_id), show)
     if not followers:
         print("No one follows you.")
         return
 
-    index = 0
+    selection = input("\nEnter the number of a follower to see details (blank to skip): ").strip()
+    if selection.isdigit():
+        selection_idx = int(selection) - 1
+        if 0 <= selection_idx < len(followers):
+            show_user_details(store, current_user_id, followers[selection_idx].usr)
+        else:
+            print("Invalid selection.")
+    else:
+        print("Skipped.")
+
+
+def who_to_follow(store, current_user_id):
+    """
+    Suggest users followed by many of the people current_user_id follows,
+    and list the users who follow each other with them. Picking a
+    suggestion shows its details, from where it can be followed.
+    """
+    print("\n--- Who to Follow ---")
+    suggestions = store.follow_suggestions(current_user_id)
+    for number, s in enumerate(suggestions, 1):
+        print(f"{number}. UserID={s.usr}, Name={s.name}, followed by {s.via} of the "
+              f"users you follow, {s.followers} followers")
+    if not suggestions:
+        print("No suggestions yet. Follow a few users first.")
+
+    mutuals = store.mutuals(current_user_id)
+    if mutuals:
+        print("\nYou and these users follow each other: "
+              + ", ".join(f"{user.name} ({user.usr})" for user in mutuals))
+    if not suggestions:
+        return
+
+    selection = input("\nEnter the number of a user to see details (blank to skip): ").strip()
+    if selection.isdigit():
+        selection_idx = int(selection) - 1
+        if 0 <= selection_idx < len(suggestions):
+            show_user_details(store, current_user_id, suggestions[selection_idx].usr)
+        else:
+            print("Invalid selection.")
+    else:
+        print("Skipped.")
+
+
+def list_favorite_lists(store, current_user_id):
+    """
+    Show all of the user's favorite lists and the tweets in them (read with
+    one query), then let the user create or delete a list, add tweets to
+    one by TID, or remove a tweet from one.
+    """
     while True:
-        chunk = followers[index:index+5]
-        if not chunk:
-            break
-        for i, fid in enumerate(chunk):
-            print(f"{index + i + 1}. UserID={fid}")
-        index += 5
-        if index >= len(followers):
-            break
-        choice = input("Show more? (y/n): ").strip().lower()
-        if choice != 'y':
-            break
+        print("\n--- List Favorite Lists ---")
+        lists = store.favorite_lists(current_user_id)
+        if not lists:
+            print("You have no favorite lists.")
+
+        for flist in lists:
+            print(f"\nList: {flist.lname}")
+            for tweet in flist.tweets:
+                print(f"   TID={tweet.tid}, WRITER={tweet.writer_id}, DATE={tweet.tdate}, "
+                      f"TIME={tweet.ttime}, TEXT={tweet.text}")
+            if not flist.tids:
+                print("No TIDs in this list.")
 
-    if followers:
-        selection = input("\nEnter the number of a follower to see details (blank to skip): ").strip()
-        if selection.isdigit():
-            selection_idx = int(selection) - 1
-            if 0 <= selection_idx < len(followers):
-                follower_id = followers[selection_idx]
-                show_user_details(conn, current_user_id, follower_id)
-            else:
-                print("Invalid selection.")
+        print("\nOptions:")
+        print("1. Create a list")
+        print("2. Delete a list")
+        print("3. Add tweets to a list")
+        print("4. Remove a tweet from a list")
+        print("5. Back to Main Menu")
+        opt = input("Choose an option: ").strip()
+        if opt == '1':
+            lname = input("Name of the new list: ").strip()
+            if lname:
+                create_favorite_list(store, current_user_id, lname)
+        elif opt in ('2', '3', '4'):
+            if not lists:
+                print("You have no favorite lists.")
+                continue
+            manage_favorite_list(store, current_user_id, opt, lists)
+        elif opt == '5':
+            break
         else:
-            print("Skipped.")
+            print("Invalid option.")
 
 
-def list_favorite_lists(conn, current_user_id):
+def manage_favorite_list(store, current_user_id, opt, lists):
     """
-    Show all of the user's favorite lists and the TIDs in them.
+    Delete (opt '2'), add tweets to (opt '3') or remove a tweet from (opt
+    '4') one of lists, picked by number.
     """
-    print("\n--- List Favorite Lists ---")
-    cur = conn.cursor()
-    lists_query = "SELECT lname FROM lists WHERE owner_id=?"
-    cur.execute(lists_query, (current_user_id,))
-    rows = cur.fetchall()
-    if not rows:
-        print("You have no favorite lists.")
+    for i, flist in enumerate(lists):
+        print(f"{i+1}. {flist.lname} ({len(flist.tids)} tweets)")
+    choice = input("Select a list number (or blank to cancel): ").strip()
+    if not choice.isdigit() or not 0 < int(choice) <= len(lists):
+        print("Cancelled." if not choice else "Invalid list selection.")
         return
+    lname = lists[int(choice) - 1].lname
 
-    for row in rows:
-        lname = row[0]
-        print(f"\nList: {lname}")
-        inc_query = "SELECT tid FROM include WHERE owner_id=? AND lname=?"
-        cur.execute(inc_query, (current_user_id, lname))
-        inc_rows = cur.fetchall()
-        if inc_rows:
-            tids = [str(r[0]) for r in inc_rows]
-            print("TIDs:", ", ".join(tids))
+    try:
+        if opt == '2':
+            store.delete_favorite_list(current_user_id, lname)
+            print(f"List '{lname}' deleted.")
+        elif opt == '3':
+            tids = [t.strip() for t in input("TIDs to add (comma-separated): ").split(',')
+                    if t.strip()]
+            added = store.add_many_to_favorite_list(current_user_id, lname, tids)
+            print(f"Added {added} of {len(tids)} tweets to '{lname}'.")
         else:
-            print("No TIDs in this list.")
+            tid = input("TID to remove: ").strip()
+            store.remove_from_favorite_list(current_user_id, lname, tid)
+            print(f"Tweet {tid} removed from '{lname}'.")
+    except StoreError as e:
+        print(e)
+    except Exception as e:
+        print(f"Error updating favorite list: {e}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
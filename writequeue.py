@@ -0,0 +1,218 @@
+"""
+Group commit for the client's writes.
+
+Without a queue every post, retweet, follow, ... is its own transaction and
+pays for its own commit. A WriteQueue hands the writes to one writer thread
+with its own connection, which applies each one in a savepoint as it
+arrives and commits them together once --flush-ops writes are pending or
+--flush-ms has passed since the first of them.
+
+Durability modes (--durability):
+
+    sync    every write commits before the call returns (no queue; the
+            default, and how the client always behaved)
+    group   writes share commits; a call returns once the commit that holds
+            its write is done, so nothing acknowledged is ever lost. The
+            writer commits as soon as no more writes are queued, so the
+            writes that arrive while one commit runs share the next one
+    async   a call returns as soon as its write is applied; commits follow in
+            the background. A crash or power loss can drop the last
+            flush-ms of acknowledged writes. Other connections see them
+            after the next commit; the store flushes before its own reads
+            if it has writes pending, so a client always reads its writes
+
+The queue is flushed on close(), which the client calls on exit.
+PRAGMA synchronous (--synchronous) still decides how hard each commit
+syncs to disk.
+"""
+import concurrent.futures
+import queue
+import sys
+import threading
+import time
+
+import db
+import migrations
+from store import MicroTweetStore
+
+DURABILITY_MODES = ["sync", "group", "async"]
+DEFAULT_DURABILITY = "sync"
+DEFAULT_FLUSH_MS = 20.0
+DEFAULT_FLUSH_OPS = 100
+
+_FLUSH = object()
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    submit(fn, *args) runs fn(store, *args) on the writer thread's
+    MicroTweetStore and returns its result (or raises its exception) as the
+    durability mode allows. The writer store times its statements in
+    registry and hashes passwords with verifier, normally the client
+    store's, so its writes show up in --profile and the slow-query log.
+    """
+
+    def __init__(self, db_name, durability="group", flush_ms=DEFAULT_FLUSH_MS,
+                 flush_ops=DEFAULT_FLUSH_OPS, connect_options=None,
+                 registry=None, verifier=None):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.durability = durability
+        self.flush_ms = flush_ms
+        self.flush_ops = 1 if durability == "sync" else max(1, flush_ops)
+        self.stats = {"writes": 0, "commits": 0, "failed_commits": 0}
+        self._db_name = db_name
+        self._connect_options = connect_options or {}
+        self._registry = registry
+        self._verifier = verifier
+        self._queue = queue.Queue()
+        self._unflushed = 0
+        self._unflushed_lock = threading.Lock()
+        self._error = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def pending(self):
+        """
+        Writes submitted but not yet committed.
+        """
+        return self._unflushed
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        with self._unflushed_lock:
+            self._unflushed += 1
+        self._queue.put((fn, args, future))
+        return future.result()
+
+    def flush(self):
+        """
+        Commit everything submitted so far and wait for it.
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((_FLUSH, (), future))
+        future.result()
+
+    def close(self):
+        """
+        Flush, then stop the writer thread and close its store.
+        """
+        if not self._thread.is_alive():
+            return
+        future = concurrent.futures.Future()
+        self._queue.put((_STOP, (), future))
+        future.result()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            conn = db.connect(self._db_name, **self._connect_options)
+            migrations.migrate(conn)
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        store = MicroTweetStore(conn, self._registry, cache_entries=0,
+                                verifier=self._verifier)
+        self._ready.set()
+
+        waiting = []            # futures answered at the next commit
+        applied = 0             # writes in the open transaction
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                fn, args, future = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                fn, args, future = _FLUSH, (), None
+
+            if fn is _FLUSH or fn is _STOP:
+                self._commit(conn, waiting, applied)
+                applied = 0
+                deadline = None
+                if future is not None:
+                    future.set_result(None)
+                if fn is _STOP:
+                    store.close()
+                    return
+                continue
+
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+                deadline = time.monotonic() + self.flush_ms / 1000
+            conn.execute("SAVEPOINT write")
+            try:
+                result = fn(store, *args)
+            except BaseException as e:
+                conn.execute("ROLLBACK TO write")
+                conn.execute("RELEASE write")
+                self._flushed(1)
+                future.set_exception(e)
+                continue
+            conn.execute("RELEASE write")
+            applied += 1
+            if self.durability == "async":
+                future.set_result(result)
+            else:
+                waiting.append((future, result))
+            if applied >= self.flush_ops or (self.durability == "group"
+                                             and self._queue.empty()):
+                self._commit(conn, waiting, applied)
+                applied = 0
+                deadline = None
+
+    def _flushed(self, count):
+        with self._unflushed_lock:
+            self._unflushed -= count
+
+    def _commit(self, conn, waiting, applied):
+        self._flushed(applied)
+        if conn.in_transaction:
+            try:
+                conn.commit()
+                self.stats["commits"] += 1
+                self.stats["writes"] += applied
+            except Exception as e:
+                conn.rollback()
+                self.stats["failed_commits"] += 1
+                for future, _ in waiting:
+                    future.set_exception(e)
+                waiting.clear()
+                if self.durability == "async":
+                    print(f"Write queue commit failed, writes lost: {e}", file=sys.stderr)
+                return
+        for future, result in waiting:
+            future.set_result(result)
+        waiting.clear()
+
+
+def add_write_queue_arguments(parser):
+    """
+    Add the durability options to an argparse parser.
+    """
+    group = parser.add_argument_group("write batching")
+    group.add_argument("--durability", choices=DURABILITY_MODES, default=DEFAULT_DURABILITY,
+                       help="sync: commit every write; group: share commits, return "
+                            "after the commit; async: return at once, commit in the "
+                            f"background (default: {DEFAULT_DURABILITY})")
+    group.add_argument("--flush-ms", type=float, default=DEFAULT_FLUSH_MS,
+                       help="longest a write waits for its commit "
+                            f"(default: {DEFAULT_FLUSH_MS:g})")
+    group.add_argument("--flush-ops", type=int, default=DEFAULT_FLUSH_OPS,
+                       help=f"most writes per commit (default: {DEFAULT_FLUSH_OPS})")
+
+
+def write_queue_from_args(db_name, args, registry=None, verifier=None):
+    """
+    The WriteQueue the options ask for, or None for sync.
+    """
+    if args.durability == "sync":
+        return None
+    return WriteQueue(db_name, args.durability, args.flush_ms, args.flush_ops,
+                      db.connection_options(args), registry, verifier)